@@ -0,0 +1,161 @@
+"""Aggregation of provincial data to macro-regions and the nation.
+
+The hierarchy is given as a mapping of provinces to macro-regions, and all
+the provinces together make up the nation. Each variable is aggregated by a
+rule:
+
+- 'sum' (the default): the sum over the provinces; NaN where none of them
+  has a value
+- ('ratio', numerator, denominator, factor): factor times the ratio of the
+  sums of two other variables, e.g. a share of a total
+- ('mean', weight): the mean weighted by another variable, e.g. 'pop' or
+  'GDP'; None for an unweighted mean. Missing values carry no weight.
+- a function, called with the aggregated Dataset, for anything else
+
+All variables that are summed, weighted or divided are stacked and reduced
+by a single product with the membership matrix of the hierarchy, for every
+case and year at once.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import xray
+
+
+__all__ = ['MACRO_REGIONS', 'aggregate', 'membership']
+
+
+# The macro-regions of the provinces in the C-REM model
+MACRO_REGIONS = {
+    'BJ': 'East',
+    'TJ': 'East',
+    'HE': 'Center',
+    'SX': 'Center',
+    'NM': 'Center',
+    'LN': 'Center',
+    'JL': 'Center',
+    'HL': 'Center',
+    'SH': 'East',
+    'JS': 'East',
+    'ZJ': 'East',
+    'AH': 'Center',
+    'FJ': 'East',
+    'JX': 'Center',
+    'SD': 'East',
+    'HA': 'Center',
+    'HB': 'Center',
+    'HN': 'Center',
+    'GD': 'East',
+    'GX': 'Center',
+    'HI': 'East',
+    'CQ': 'Center',
+    'SC': 'Center',
+    'GZ': 'Center',
+    'YN': 'West',
+    'SN': 'West',
+    'GS': 'West',
+    'QH': 'West',
+    'NX': 'West',
+    'XJ': 'West',
+}
+
+
+def membership(regions, groups=MACRO_REGIONS, total='China'):
+    """The aggregate regions and their membership matrix.
+
+    Returns (labels, matrix): the macro-regions followed by the total, and
+    a 0/1 array of shape (len(labels), len(regions)). Regions missing from
+    `groups` only count towards the total.
+    """
+    labels = sorted(set(groups[r] for r in regions if r in groups)) + [total]
+    matrix = np.zeros((len(labels), len(regions)))
+    for j, region in enumerate(regions):
+        if region in groups:
+            matrix[labels.index(groups[region]), j] = 1
+    matrix[-1, :] = 1
+    return labels, matrix
+
+
+def _terms(data, rules, dim):
+    """The arrays to be summed: {name: DataArray with `dim` last}."""
+    terms = OrderedDict()
+
+    def add(name, array):
+        dims = [d for d in array.dims if d != dim] + [dim]
+        terms[name] = array.transpose(*dims)
+
+    for name, variable in data.data_vars.items():
+        if dim not in variable.dims:
+            continue
+        rule = rules.get(name, 'sum')
+        if rule == 'sum':
+            add(name, variable.fillna(0))
+            add(('count', name), variable.notnull())
+        elif isinstance(rule, tuple) and rule[0] == 'ratio':
+            for part in rule[1:3]:
+                add(part, data[part].fillna(0))
+                add(('count', part), data[part].notnull())
+        elif isinstance(rule, tuple) and rule[0] == 'mean':
+            weight = 1 if rule[1] is None else data[rule[1]]
+            present = variable.notnull()
+            add(('weighted', name), (variable * weight).fillna(0))
+            add(('weight', name), (present * weight).fillna(0))
+    return terms
+
+
+def aggregate(data, rules=None, groups=MACRO_REGIONS, dim='r', total='China'):
+    """Aggregate the variables of a Dataset along its region dimension.
+
+    data - xray.Dataset with a `dim` dimension of provinces
+    rules - {variable: rule}, see the module docstring
+
+    Returns a Dataset of the variables that have the region dimension, with
+    the macro-regions and the total along it. Other variables are left out.
+    """
+    rules = rules or {}
+    regions = [str(r) for r in data[dim].values]
+    labels, matrix = membership(regions, groups, total)
+    terms = _terms(data, rules, dim)
+
+    # Terms of the same shape are reduced together, by one product each
+    sums = {}
+    by_dims = OrderedDict()
+    for name, array in terms.items():
+        by_dims.setdefault(array.dims, []).append(name)
+    for dims, names in by_dims.items():
+        stacked = np.array([terms[name].values for name in names])
+        reduced = np.tensordot(stacked, matrix, axes=([-1], [1]))
+        coords = [(d, terms[names[0]][d].values) for d in dims[:-1]] + [(dim, labels)]
+        for name, values in zip(names, reduced):
+            sums[name] = xray.DataArray(values, coords=coords, dims=dims)
+
+    def total(name):
+        # NaN where no member has a value, rather than a sum of 0
+        return sums[name].where(sums[('count', name)] > 0)
+
+    result = xray.Dataset()
+    functions = []
+    for name, variable in data.data_vars.items():
+        if dim not in variable.dims:
+            continue
+        rule = rules.get(name, 'sum')
+        if rule == 'sum':
+            result[name] = total(name)
+        elif isinstance(rule, tuple) and rule[0] == 'ratio':
+            factor = rule[3] if len(rule) > 3 else 1
+            result[name] = factor * total(rule[1]) / total(rule[2])
+        elif isinstance(rule, tuple) and rule[0] == 'mean':
+            # All weight missing gives 0 / 0, so NaN
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[name] = sums[('weighted', name)] / sums[('weight', name)]
+        elif callable(rule):
+            functions.append((name, rule))
+        else:
+            raise ValueError('Unknown aggregation rule for %s: %r' % (name, rule))
+        if name in result:
+            result[name] = result[name].transpose(*variable.dims)
+            result[name].attrs.update(variable.attrs)
+    for name, function in functions:
+        result[name] = function(result)
+        result[name].attrs.update(data[name].attrs)
+    return result
@@ -0,0 +1,131 @@
+"""Classification schemes for choropleth colors.
+
+Each scheme returns the class edges: an array of n_classes + 1 values from
+the minimum to the maximum, a value belonging to the first class whose upper
+edge is not below it. Breaks are computed over every value given, so pass
+all the frames (years, scenarios) of a variable at once to get colors that
+compare between them.
+"""
+import numpy as np
+
+
+__all__ = ['classify', 'equal_interval', 'get_breaks', 'jenks', 'quantile',
+           'std_dev', 'SCHEMES']
+
+
+def _finite(values):
+    values = np.asarray(values, dtype=float).ravel()
+    return values[np.isfinite(values)]
+
+
+def equal_interval(values, n_classes):
+    values = _finite(values)
+    return np.linspace(values.min(), values.max(), n_classes + 1)
+
+
+def quantile(values, n_classes):
+    values = _finite(values)
+    return np.percentile(values, np.linspace(0, 100, n_classes + 1))
+
+
+def std_dev(values, n_classes):
+    """Breaks one standard deviation apart, centered on the mean."""
+    values = _finite(values)
+    inner = values.mean() + values.std() * (np.arange(1, n_classes) - n_classes / 2.0)
+    inner = np.clip(inner, values.min(), values.max())
+    return np.concatenate([[values.min()], inner, [values.max()]])
+
+
+def _jenks_layer(previous, cost, first, n):
+    """One class more: best[j] = min over i of previous[i] + cost(i, j).
+
+    The best split point is monotone in j, so the rows are solved by divide
+    and conquer, a whole level of the recursion per vectorized step.
+    """
+    best = np.full(n + 1, np.inf)
+    split = np.zeros(n + 1, dtype=int)
+    # Pending ranges: rows j_lo..j_hi, with split points in i_lo..i_hi
+    j_lo, j_hi = np.array([first]), np.array([n])
+    i_lo, i_hi = np.array([first - 1]), np.array([n - 1])
+    while len(j_lo):
+        mid = (j_lo + j_hi) // 2
+        top = np.minimum(i_hi, mid - 1)
+        lengths = top - i_lo + 1
+        segment = np.repeat(np.arange(len(mid)), lengths)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        candidates = i_lo[segment] + np.arange(lengths.sum()) - starts[segment]
+        totals = previous[candidates] + cost(candidates, mid[segment])
+        minima = np.minimum.reduceat(totals, starts)
+        # The first candidate reaching the minimum of its segment
+        hits = np.flatnonzero(totals <= minima[segment])
+        _, firsts = np.unique(segment[hits], return_index=True)
+        chosen = candidates[hits[firsts]]
+        best[mid] = minima
+        split[mid] = chosen
+
+        left = mid - 1 >= j_lo
+        right = mid + 1 <= j_hi
+        j_lo, j_hi, i_lo, i_hi = (
+            np.concatenate([j_lo[left], mid[right] + 1]),
+            np.concatenate([mid[left] - 1, j_hi[right]]),
+            np.concatenate([i_lo[left], chosen[right]]),
+            np.concatenate([chosen[left], i_hi[right]]),
+        )
+    return best, split
+
+
+def jenks(values, n_classes):
+    """Jenks natural breaks: the classes of least squared deviation.
+
+    Solved exactly by dynamic programming over the sorted unique values,
+    weighted by their counts, with prefix sums giving the deviation of any
+    class in constant time. Each added class takes O(n log n).
+    """
+    unique, counts = np.unique(_finite(values), return_counts=True)
+    n = len(unique)
+    if n <= n_classes:
+        return np.concatenate([[unique[0]], unique, [unique[-1]] * (n_classes - n)])
+    weights = np.concatenate([[0], np.cumsum(counts)])
+    sums = np.concatenate([[0], np.cumsum(counts * unique)])
+    squares = np.concatenate([[0], np.cumsum(counts * unique ** 2)])
+
+    def cost(i, j):
+        # Squared deviation of the class of unique[i:j]
+        return (squares[j] - squares[i]) - (sums[j] - sums[i]) ** 2 / (weights[j] - weights[i])
+
+    indices = np.arange(n + 1)
+    best = np.full(n + 1, np.inf)
+    best[1:] = cost(np.zeros(n, dtype=int), indices[1:])
+    splits = []
+    for k in range(2, n_classes + 1):
+        best, split = _jenks_layer(best, cost, k, n)
+        splits.append(split)
+
+    # Walk back from the last value to find each class's upper edge
+    edges = [unique[-1]]
+    j = n
+    for split in reversed(splits):
+        j = split[j]
+        edges.append(unique[j - 1])
+    edges.append(unique[0])
+    return np.array(edges[::-1])
+
+
+SCHEMES = {
+    'equal_interval': equal_interval,
+    'jenks': jenks,
+    'quantile': quantile,
+    'std_dev': std_dev,
+}
+
+
+def get_breaks(values, n_classes, scheme='jenks'):
+    """Class edges of the values, by the name of a scheme in SCHEMES."""
+    return SCHEMES[scheme](values, n_classes)
+
+
+def classify(values, breaks):
+    """Class index of each value; -1 where it is missing."""
+    values = np.asarray(values, dtype=float)
+    classes = np.searchsorted(breaks[1:-1], values, side='left')
+    return np.where(np.isnan(values), -1, classes)
@@ -0,0 +1,49 @@
+FONT = "News Cycle"
+FONT_SIZE = "20pt"
+NODATA_COLOR = "#eeeeee"
+GRAY = "#CCCCCC"
+DARK_GRAY = "#6B6B73"
+AXIS_FORMATS = dict(
+    minor_tick_in=None,
+    minor_tick_out=None,
+    major_tick_in=None,
+    major_label_text_font=FONT,
+    major_label_text_font_size="10pt",
+    major_label_text_font_style="bold",
+    axis_label_text_font=FONT,
+    axis_label_text_font_size="10pt",
+
+    axis_line_color=GRAY,
+    major_tick_line_color=GRAY,
+    major_label_text_color=DARK_GRAY,
+
+    major_tick_line_cap="round",
+    axis_line_cap="round",
+    axis_line_width=3,
+    major_tick_line_width=3,
+)
+PLOT_FORMATS = dict(
+    toolbar_location=None,
+    outline_line_color="#FFFFFF",
+    title_text_font=FONT,
+    #title_text_align='below',
+    title_text_color=DARK_GRAY,
+    #title_text_baseline='top',
+)
+FONT_PROPS_SM = dict(
+    text_color=DARK_GRAY,
+    text_font=FONT,
+    text_font_style="normal",
+    text_font_size='10pt',
+)
+FONT_PROPS_MD = dict(
+    text_color=DARK_GRAY,
+    text_font=FONT,
+    text_font_style="normal",
+    text_font_size='18pt',
+)
+FONT_PROPS_LG = dict(
+    text_font=FONT,
+    text_font_style="bold",
+    text_font_size='23pt',
+)
@@ -0,0 +1,91 @@
+"""Differences of scenarios from their baselines.
+
+Given a Dataset with a case dimension, e.g. case × r × t as built by
+crem_presentation/data/pre.py, the absolute and percent differences of any
+scenarios from their baselines are computed for many variables at once:
+variables of the same dimensions are stacked, and the scenarios and their
+baselines taken from the stack by index, in one broadcast operation.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import xray
+
+
+__all__ = ['Deltas', 'delta']
+
+
+def _pairs(cases, scenarios, baseline):
+    """(scenario, baseline) pairs; baseline is a case or {scenario: case}."""
+    if isinstance(baseline, dict):
+        if scenarios is None:
+            scenarios = list(baseline)
+        return [(s, baseline[s]) for s in scenarios]
+    if scenarios is None:
+        scenarios = [c for c in cases if c != baseline]
+    return [(s, baseline) for s in scenarios]
+
+
+def delta(data, variables=None, scenarios=None, baseline='bau', dim='case'):
+    """Absolute and percent differences of scenarios from a baseline.
+
+    data - xray.Dataset with a `dim` dimension of cases
+    variables - names of the variables; by default all that have `dim`
+    scenarios - cases to compare; by default all but the baseline
+    baseline - the case compared to, or {scenario: baseline}, e.g.
+        {'4': 'bau', '4_lo': 'bau_lo'}
+
+    Returns (absolute, percent): Datasets of the variables, with the
+    scenarios along `dim`. Percentages of a zero baseline are NaN or inf.
+    """
+    cases = [str(c) for c in data[dim].values]
+    if variables is None:
+        variables = [name for name, v in data.data_vars.items() if dim in v.dims]
+    pairs = _pairs(cases, scenarios, baseline)
+    scenario_index = [cases.index(s) for s, _ in pairs]
+    baseline_index = [cases.index(b) for _, b in pairs]
+
+    by_dims = OrderedDict()
+    for name in variables:
+        dims = data[name].dims
+        by_dims.setdefault((dim,) + tuple(d for d in dims if d != dim), []).append(name)
+
+    absolute, percent = xray.Dataset(), xray.Dataset()
+    for dims, names in by_dims.items():
+        stacked = np.array([data[name].transpose(*dims).values for name in names], dtype=float)
+        base = stacked[:, baseline_index]
+        difference = stacked[:, scenario_index] - base
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = difference / base * 100
+        coords = [(dim, [s for s, _ in pairs])] + [(d, data[d].values) for d in dims[1:]]
+        for i, name in enumerate(names):
+            original = data[name].dims
+            for result, values in ((absolute, difference[i]), (percent, ratio[i])):
+                result[name] = xray.DataArray(values, coords=coords, dims=dims).transpose(*original)
+                result[name].attrs.update(data[name].attrs)
+            percent[name].attrs['unit_short'] = '%'
+    return absolute, percent
+
+
+class Deltas(object):
+    """Differences from baselines of one Dataset, computed once per query.
+
+    >>> deltas = Deltas(data)
+    >>> absolute, percent = deltas.get(['CO2_emi', 'PM25_conc'], ['4'])
+    >>> absolute['CO2_emi'].sel(case='4', t='2030')
+    """
+
+    def __init__(self, data, baseline='bau', dim='case'):
+        self.data = data
+        self.baseline = baseline
+        self.dim = dim
+        self._cache = {}
+
+    def get(self, variables, scenarios=None, baseline=None):
+        "As `delta`, with this object's data and default baseline."
+        baseline = self.baseline if baseline is None else baseline
+        key = (tuple(variables), None if scenarios is None else tuple(scenarios),
+               tuple(sorted(baseline.items())) if isinstance(baseline, dict) else baseline)
+        if key not in self._cache:
+            self._cache[key] = delta(self.data, variables, scenarios, baseline, self.dim)
+        return self._cache[key]
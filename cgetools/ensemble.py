@@ -0,0 +1,285 @@
+"""Percentile bands of large ensembles of model runs.
+
+Summarizes hundreds of runs, e.g. of a sensitivity analysis, by the mean and
+percentiles of each variable for every region and year, in one pass over the
+runs:
+
+    >>> summary = summarize(runs, ['CO2_emi', 'GDP'])  # runs: xray.Datasets
+    >>> summary['CO2_emi'].sel(stat=['p5', 'p50', 'p95'], r='BJ')
+
+Only a sketch of each variable is held in memory, never the runs. The
+sketches are mergeable, so shares of the runs can be summarized in parallel
+and combined (`summarize_files`).
+
+The quantile sketch is a compactor stack, as in KLL sketches: level h holds
+values each standing for 2**h runs; when a level fills up it is sorted and
+every other value, from a random start, is promoted to the next level. Every
+cell of a variable sees one value per run, so all cells compact at the same
+time, and a sketch is a few 2-d arrays of cells × values. Ensembles of fewer
+than 2k runs are summarized exactly; beyond that the rank error is of the
+order of log2(runs / k) / k.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+import xray
+
+
+__all__ = ['EnsembleSummary', 'QuantileSketch', 'summarize', 'summarize_files']
+
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Values kept per level of a sketch
+DEFAULT_K = 128
+
+
+class QuantileSketch(object):
+    """Streaming quantiles of an array of cells, one value per cell per run.
+
+    shape - of the arrays added
+    k - values kept per level; the memory used is about k × log2(runs / k)
+        values per cell
+
+    Missing (NaN) values are counted apart and left out of the quantiles and
+    mean.
+    """
+
+    def __init__(self, shape, k=DEFAULT_K, seed=None):
+        self.shape = tuple(shape)
+        self.k = k
+        n_cells = int(np.prod(self.shape))
+        self.levels = []
+        self.count = 0
+        self.missing = np.zeros(n_cells, dtype=int)
+        self.total = np.zeros(n_cells)
+        self.random = np.random.RandomState(seed)
+        # Runs are added to a buffer, moved to level 0 once full
+        self._buffer = np.empty((n_cells, 2 * k))
+        self._buffered = 0
+
+    def add(self, values):
+        "Add the values of one run."
+        values = np.asarray(values, dtype=float).reshape(-1, 1)
+        missing = np.isnan(values[:, 0])
+        self.missing += missing
+        self.total += np.where(missing, 0, values[:, 0])
+        # Missing values sort last, where they stay when compacted
+        self._buffer[:, self._buffered] = np.where(missing, np.inf, values[:, 0])
+        self._buffered += 1
+        self.count += 1
+        if self._buffered == self._buffer.shape[1]:
+            self._flush()
+            self._compact()
+
+    def _flush(self):
+        self._extend(0, self._buffer[:, :self._buffered])
+        self._buffered = 0
+
+    def merge(self, other):
+        "Add the runs summarized by another sketch of the same shape."
+        if other.shape != self.shape:
+            raise ValueError('Cannot merge sketches of shapes %s and %s' % (self.shape, other.shape))
+        self._flush()
+        self._extend(0, other._buffer[:, :other._buffered])
+        for level, values in enumerate(other.levels):
+            self._extend(level, values)
+        self.count += other.count
+        self.missing += other.missing
+        self.total += other.total
+        self._compact()
+        return self
+
+    def _extend(self, level, values):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty((len(self.missing), 0)))
+        self.levels[level] = np.hstack([self.levels[level], values])
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if values.shape[1] >= 2 * self.k:
+                values = np.sort(values, axis=1)
+                # An odd value out stays at this level
+                n = values.shape[1] - values.shape[1] % 2
+                start = self.random.randint(2)
+                self.levels[level] = values[:, n:]
+                self._extend(level + 1, values[:, start:n:2])
+            level += 1
+
+    def quantiles(self, q):
+        """Values at the quantiles q (between 0 and 1), by nearest rank.
+
+        Returns an array of shape (len(q),) + shape; NaN where all the
+        values of a cell were missing.
+        """
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        self._flush()
+        if not self.count:
+            return np.full((len(q),) + self.shape, np.nan)
+        values = np.hstack(self.levels)
+        weights = np.hstack([np.full(level.shape[1], 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, axis=1)
+        rows = np.arange(values.shape[0])[:, np.newaxis]
+        values = values[rows, order]
+        ranks = np.cumsum(weights[order], axis=1)
+        present = self.count - self.missing
+        # Missing values are stored as inf, sorted last; never return them
+        last = np.maximum(np.isfinite(values).sum(axis=1) - 1, 0)
+        result = np.empty((len(q), values.shape[0]))
+        for i, quantile in enumerate(q):
+            # First value whose rank reaches the target
+            target = np.maximum(quantile * present, 1)
+            index = np.minimum((ranks < target[:, np.newaxis]).sum(axis=1), last)
+            result[i] = values[rows[:, 0], index]
+        result[:, present == 0] = np.nan
+        return result.reshape((len(q),) + self.shape)
+
+    def mean(self):
+        present = self.count - self.missing
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.total / present).reshape(self.shape)
+
+
+class EnsembleSummary(object):
+    """Mean and percentiles of the variables of many runs.
+
+    variables - names of the variables summarized; by default those of the
+        first run. Each keeps the dimensions and coordinates it has in the
+        first run; later runs are aligned to them.
+    k, seed - for the QuantileSketch of each variable
+    """
+
+    def __init__(self, variables=None, k=DEFAULT_K, seed=None):
+        self.variables = None if variables is None else list(variables)
+        self.k = k
+        self.seed = seed
+        self.coords = {}
+        self.sketches = {}
+
+    def add(self, run):
+        "Add one run, an xray.Dataset."
+        if self.variables is None:
+            self.variables = list(run.data_vars)
+        for name in self.variables:
+            values = run[name]
+            if name not in self.sketches:
+                self.coords[name] = [(dim, values[dim].values) for dim in values.dims]
+                self.sketches[name] = QuantileSketch(values.shape, self.k, self.seed)
+            else:
+                values = values.reindex(**dict(self.coords[name])).transpose(*[d for d, _ in self.coords[name]])
+            self.sketches[name].add(values.values)
+        return self
+
+    def merge(self, other):
+        "Add the runs summarized by another EnsembleSummary."
+        for name, sketch in other.sketches.items():
+            if name in self.sketches:
+                if not all(d1 == d2 and np.array_equal(c1, c2)
+                           for (d1, c1), (d2, c2) in zip(self.coords[name], other.coords[name])):
+                    raise ValueError('The runs of the two summaries differ in the coordinates of %s' % name)
+                self.sketches[name].merge(sketch)
+            else:
+                self.coords[name] = other.coords[name]
+                self.sketches[name] = sketch
+        if self.variables is None:
+            self.variables = other.variables
+        return self
+
+    @property
+    def count(self):
+        "The number of runs summarized."
+        return max([sketch.count for sketch in self.sketches.values()] or [0])
+
+    def result(self, percentiles=PERCENTILES):
+        """The summary as an xray.Dataset.
+
+        Each variable gains a first dimension 'stat' with the labels 'mean'
+        and 'p<percentile>', e.g. 'p5' and 'p95'.
+        """
+        stats = ['mean'] + ['p%g' % p for p in percentiles]
+        result = xray.Dataset()
+        for name in self.variables or []:
+            if name not in self.sketches:
+                continue
+            sketch = self.sketches[name]
+            values = np.concatenate([sketch.mean()[np.newaxis],
+                                     sketch.quantiles(np.asarray(percentiles) / 100.0)])
+            result[name] = xray.DataArray(values, coords=[('stat', stats)] + self.coords[name])
+        result.attrs['runs'] = self.count
+        return result
+
+
+def summarize(runs, variables=None, percentiles=PERCENTILES, k=DEFAULT_K, seed=None):
+    """Summarize an iterable of runs (xray.Datasets), one at a time.
+
+    Returns the Dataset of EnsembleSummary.result.
+    """
+    summary = EnsembleSummary(variables, k, seed)
+    for run in runs:
+        summary.add(run)
+    return summary.result(percentiles)
+
+
+def _summarize_share(job):
+    paths, read, variables, k, seed = job
+    summary = EnsembleSummary(variables, k, seed)
+    for path in paths:
+        summary.add(read(path, variables))
+    return summary
+
+
+def read_gdx(path, variables):
+    "The variables of a GDX file, as a Dataset."
+    import gdx
+    f = gdx.File(path)
+    return xray.Dataset(dict((name, f.extract(name)) for name in variables))
+
+
+def summarize_files(paths, variables, read=read_gdx, percentiles=PERCENTILES, k=DEFAULT_K,
+                    seed=None, processes=None):
+    """Summarize the runs in many files, in worker processes.
+
+    read - function(path, variables) returning a run as a Dataset; by
+        default read_gdx
+    processes - worker processes, each summarizing a share of the files;
+        all CPUs with None, and none with 0
+
+    The workers' summaries are merged. Returns the Dataset of
+    EnsembleSummary.result.
+    """
+    paths = list(paths)
+    if processes == 0:
+        summary = _summarize_share((paths, read, variables, k, seed))
+    else:
+        n = processes or os.cpu_count()
+        # Different seeds, so that the workers do not compact in lockstep
+        jobs = [(paths[i::n], read, variables, k, None if seed is None else seed + i) for i in range(n)]
+        with ProcessPoolExecutor(max_workers=n) as executor:
+            summaries = list(executor.map(_summarize_share, [job for job in jobs if job[0]]))
+        summary = summaries[0]
+        for other in summaries[1:]:
+            summary.merge(other)
+    return summary.result(percentiles)
+
+
+def main():
+    parser = ArgumentParser(description='Summarize an ensemble of GDX files by percentiles.')
+    parser.add_argument('output', help='CSV file written')
+    parser.add_argument('files', nargs='+', help='GDX files, one per run')
+    parser.add_argument('--variables', nargs='+', required=True, help='variables summarized')
+    parser.add_argument('--percentiles', nargs='+', type=float, default=PERCENTILES)
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help='values kept per sketch level')
+    parser.add_argument('--processes', type=int, default=None, help='0 to summarize in this process')
+    args = parser.parse_args()
+    summary = summarize_files(args.files, args.variables, percentiles=args.percentiles, k=args.k,
+                              processes=args.processes)
+    summary.to_dataframe().to_csv(args.output)
+    print('Summarized %d runs to %s' % (summary.attrs['runs'], args.output))
+
+
+if __name__ == '__main__':
+    main()
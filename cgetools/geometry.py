@@ -0,0 +1,237 @@
+"""Build the map geometry files from a Natural Earth shapefile archive.
+
+The shapefile records are read straight from the .zip, as a stream: the
+.shp outlines and .dbf attributes of each record are parsed together and
+only the records kept are held in memory, so the archive is never unpacked.
+This works for the simplified and full 10 m admin-1 archives, and for any
+other polygon shapefile, e.g. of prefectures.
+
+    python -m cgetools.geometry data/ne_10m_admin_1_states_provinces_simplified.zip \\
+        data/province_map_data_simplified
+
+writes province_map_data_simplified.hdf, .json and .topo.json.
+"""
+from argparse import ArgumentParser
+from collections import OrderedDict
+import io
+import json
+from os.path import basename, dirname, join, splitext
+import struct
+import zipfile
+
+import pandas as pd
+
+from .topology import build_topology, decode_topology, simplify_topology
+
+
+__all__ = ['build_geometry', 'iter_shapefile', 'join_codes', 'read_features']
+
+
+DATA_DIR = join(dirname(__file__), 'data')
+
+# Natural Earth names that differ from the English names in unified.csv
+NAME_ALIASES = {
+    'Xizang': 'Tibet',
+    'Inner Mongol': 'Inner Mongolia',
+}
+
+# Polygon, PolygonZ and PolygonM shapes; other types are not map regions
+POLYGON_TYPES = (5, 15, 25)
+
+
+def _read(stream, n):
+    data = stream.read(n)
+    if len(data) != n:
+        raise EOFError('Shapefile ended after %d of %d bytes' % (len(data), n))
+    return data
+
+
+def _read_dbf_header(stream):
+    """The number of records and the fields (name, type, size) of a .dbf."""
+    _, n_records, header_size, _ = struct.unpack('<4sIHH20x', _read(stream, 32))
+    fields = []
+    for _ in range((header_size - 33) // 32):
+        name, kind, size = struct.unpack('<11sc4xB15x', _read(stream, 32))
+        fields.append((name.split(b'\0')[0].decode('ascii'), kind.decode('ascii'), size))
+    # The rest of the header: the 0x0D terminator, maybe more padding
+    _read(stream, header_size - 32 - 32 * len(fields))
+    return n_records, fields
+
+
+def _parse_value(raw, kind, encoding):
+    text = raw.decode(encoding, errors='replace').strip(' \0')
+    if kind in 'NF':
+        if not text or text.startswith('*'):
+            return None
+        number = float(text)
+        return int(number) if number.is_integer() and '.' not in text else number
+    if kind == 'L':
+        return text in ('Y', 'y', 'T', 't') if text not in ('', '?') else None
+    return text
+
+
+def _parse_rings(content):
+    """The rings of a polygon record's content, as lists of (x, y)."""
+    shape_type = struct.unpack('<i', content[:4])[0]
+    if shape_type not in POLYGON_TYPES:
+        return []
+    n_parts, n_points = struct.unpack('<2i', content[36:44])
+    parts = struct.unpack('<%di' % n_parts, content[44:44 + 4 * n_parts]) + (n_points,)
+    start = 44 + 4 * n_parts
+    coordinates = struct.unpack('<%dd' % (2 * n_points), content[start:start + 16 * n_points])
+    points = list(zip(coordinates[0::2], coordinates[1::2]))
+    return [points[i:j] for i, j in zip(parts, parts[1:])]
+
+
+def iter_shapefile(archive, predicate=None, layer=None, encoding='utf-8'):
+    """Yield (attributes, rings) of each record of a shapefile in a zip.
+
+    archive - path of the .zip
+    predicate - function of a record's attributes; only records for which it
+        is true are yielded, and only their outlines are parsed
+    layer - name of the shapefile within it, without extension; by default
+        its only .shp
+    encoding - of the text attributes, unless given by the layer's .cpg
+
+    The rings are lists of (x, y) points.
+    """
+    with zipfile.ZipFile(archive) as z:
+        names = z.namelist()
+        if layer is None:
+            layers = [splitext(name)[0] for name in names if name.lower().endswith('.shp')]
+            if len(layers) != 1:
+                raise ValueError('Give the layer, one of %s' % ', '.join(map(basename, layers)))
+            layer = layers[0]
+        elif layer + '.shp' not in names:
+            layer = next(splitext(name)[0] for name in names
+                         if basename(splitext(name)[0]) == layer)
+        if layer + '.cpg' in names:
+            encoding = z.read(layer + '.cpg').decode('ascii').strip() or encoding
+
+        with z.open(layer + '.shp') as shp, z.open(layer + '.dbf') as dbf:
+            shp = io.BufferedReader(shp, 1 << 16)
+            dbf = io.BufferedReader(dbf, 1 << 16)
+            _read(shp, 100)
+            n_records, fields = _read_dbf_header(dbf)
+            for _ in range(n_records):
+                record = _read(dbf, 1 + sum(size for _, _, size in fields))
+                _, length = struct.unpack('>2i', _read(shp, 8))
+                content = _read(shp, 2 * length)
+                if record[:1] == b'*':
+                    continue  # deleted
+                attributes = {}
+                offset = 1
+                for name, kind, size in fields:
+                    attributes[name] = _parse_value(record[offset:offset + size], kind, encoding)
+                    offset += size
+                if predicate is None or predicate(attributes):
+                    yield attributes, _parse_rings(content)
+
+
+def read_features(archive, predicate=None, layer=None, encoding='utf-8'):
+    """Read the records of a shapefile in a zip as a frame.
+
+    predicate - records kept, as for `iter_shapefile`
+
+    Returns a frame of the attributes, with the outlines in 'xs' and 'ys'
+    columns: the rings separated by NaN, as used by `build_map`.
+    """
+    rows = []
+    nan = float('nan')
+    for attributes, rings in iter_shapefile(archive, predicate, layer, encoding):
+        xs, ys = [], []
+        for ring in rings:
+            if xs:
+                xs.append(nan)
+                ys.append(nan)
+            xs.extend(x for x, _ in ring)
+            ys.extend(y for _, y in ring)
+        attributes.update(xs=xs, ys=ys)
+        rows.append(attributes)
+    return pd.DataFrame(rows)
+
+
+def join_codes(features, name_field='woe_name', level=1, aliases=NAME_ALIASES,
+               codes_file=join(DATA_DIR, 'unified.csv')):
+    """Join features to the GB/T 2260 codes of unified.csv by English name.
+
+    level - 1 for provinces, 2 for prefectures
+    aliases - {name in the features: name_en in unified.csv}
+
+    Returns the code, name and alpha columns of unified.csv with the 'xs'
+    and 'ys' of the features, sorted by English name. Features without a
+    code are left out.
+    """
+    codes = pd.read_csv(codes_file)
+    codes = codes[codes.level == level][['code', 'name_zh', 'name_en', 'alpha']]
+    if level == 1:
+        codes = codes.dropna(subset=['alpha'])
+    features = features[[name_field, 'xs', 'ys']].copy()
+    features['name_en'] = features[name_field].replace(aliases)
+    joined = codes.merge(features.drop(name_field, axis=1), on='name_en')
+    return joined.sort_values('name_en').reset_index(drop=True)
+
+
+def build_geometry(archive, output, tolerance=None, decimals=3, layer=None,
+                   predicate=None, processes=None, **join_options):
+    """Build the geometry files of a map from a shapefile archive.
+
+    archive - a Natural Earth zip, e.g. ne_10m_admin_1_states_provinces.zip
+    output - path of the files without extension: <output>.hdf and .json
+        with the outlines as used by `build_map`, and <output>.topo.json with
+        their shared-arc topology (see cgetools.topology)
+    tolerance - in degrees, to simplify the outlines; None keeps them all
+    decimals - decimals of a degree kept
+    predicate - records kept, by their attributes; China's admin-1 units
+        except the Paracel Islands by default
+    processes - worker processes simplifying the borders; 0 for none
+    join_options - for `join_codes`
+
+    Returns the frame written.
+    """
+    if predicate is None:
+        def predicate(attributes):
+            return attributes.get('admin') == 'China' and attributes.get('woe_name') != 'Paracel Islands'
+    features = read_features(archive, predicate, layer)
+    data = join_codes(features, **join_options)
+
+    # The borders are simplified as arcs shared by neighbours, so that they
+    # stay joined; each worker takes a share of the arcs.
+    outlines = OrderedDict(zip(data['code'], zip(data['xs'], data['ys'])))
+    topology = build_topology(outlines, decimals)
+    if tolerance:
+        topology = simplify_topology(topology, tolerance, processes)
+    outlines = decode_topology(topology)
+    data['xs'] = [outlines[code][0] for code in data['code']]
+    data['ys'] = [outlines[code][1] for code in data['code']]
+
+    data.to_hdf(output + '.hdf', 'df')
+    data.to_json(output + '.json')
+    topology['objects'] = OrderedDict(
+        (alpha if isinstance(alpha, str) else str(code), topology['objects'][code])
+        for code, alpha in zip(data['code'], data['alpha'])
+    )
+    with open(output + '.topo.json', 'w') as f:
+        json.dump(topology, f, separators=(',', ':'))
+    return data
+
+
+def main():
+    parser = ArgumentParser(description='Build map geometry files from a shapefile archive.')
+    parser.add_argument('archive', help='Natural Earth .zip')
+    parser.add_argument('output', help='path of the output files, without extension')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='simplify the outlines, in degrees')
+    parser.add_argument('--decimals', type=int, default=3, help='decimals of a degree kept')
+    parser.add_argument('--layer', default=None, help='shapefile within the archive')
+    parser.add_argument('--level', type=int, default=1, help='1 for provinces, 2 for prefectures')
+    parser.add_argument('--name-field', default='woe_name', help='English name attribute')
+    parser.add_argument('--processes', type=int, default=None, help='0 to simplify in this process')
+    args = parser.parse_args()
+    data = build_geometry(args.archive, args.output, args.tolerance, args.decimals, args.layer,
+                          processes=args.processes, level=args.level, name_field=args.name_field)
+    print('Wrote %d regions to %s.hdf, .json and .topo.json' % (len(data), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,44 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from os.path import dirname, join
+import threading
 
 from bokeh.embed import file_html
 from bokeh.models import Callback, ColumnDataSource, HoverTool, Patches, Plot, \
-    Range1d, Select, TapTool
+    Range1d, Select, Slider, TapTool, Text, Toggle
 from bokeh import palettes
-from bokeh.plotting import vplot
+from bokeh.plotting import hplot, vplot
 from bokeh.resources import Resources
-from IPython.display import display_html
+from IPython.display import HTML, display, display_html
 from jinja2 import Template
+import json
+
 import pandas as pd
 import numpy as np
 
-from .constants import PLOT_FORMATS
+from .classify import classify, get_breaks
+from .constants import PLOT_FORMATS, DARK_GRAY, NODATA_COLOR
+from .precision import COORDINATE_DECIMALS, round_significant
+from .projection import get_plot_height, get_ranges, project_outlines
+from .topology import build_topology, decode_topology
+from .warehouse import Selection
 
 
-__all__ = ['color_data', 'live_map',]
+__all__ = ['animated_map', 'color_data', 'iter_live_maps', 'live_map',
+           'live_map_async', 'live_maps', 'render_live_map', 'share_borders']
 
 
 DATA_DIR = join(dirname(__file__), 'data')
+ASSETS_DIR = join(dirname(__file__), 'assets')
+
+# Palette index of missing values, as given by cgetools.classify.classify
+NODATA = -1
 
 
-def get_map_df():
+def get_map_df(decimals=None):
+    # decimals - if given, the outlines are rebuilt from their shared-arc
+    #   topology at that precision, so that neighbours share their borders
     map_data = pd.read_json(join(DATA_DIR, 'province_map_data.json'))
 
     def convert_none_to_np_nan(r):
@@ -29,13 +47,38 @@ def get_map_df():
         return r
 
     map_data = map_data.apply(convert_none_to_np_nan, axis=1)
+    if decimals is not None:
+        map_data = share_borders(map_data, decimals)
+    return map_data
+
+
+def share_borders(map_data, decimals=COORDINATE_DECIMALS['simplified']):
+    """Rebuild the 'xs' and 'ys' outlines from their shared-arc topology.
+
+    The points are snapped to `decimals` and neighbours share their borders
+    point for point; see cgetools.topology.
+    """
+    outlines = OrderedDict(zip(map_data['alpha'], zip(map_data['xs'], map_data['ys'])))
+    outlines = decode_topology(build_topology(outlines, decimals))
+    for i, axis in enumerate(('xs', 'ys')):
+        map_data[axis] = [np.array(outlines[alpha][i]) for alpha in map_data['alpha']]
     return map_data
 
 
 def color_data(data, columns_to_colorize, data_min=None, data_max=None,
-               palette=palettes.Blues9):
+               palette=palettes.Blues9, scheme=None):
     # data - the data frame which you are adding colored values to
     # columns_to_colorize - a list of strings which select the columns
+    # scheme - a classification scheme of cgetools.classify, e.g. 'jenks' or
+    #   'quantile', for skewed data; None for equal bins from data_min to
+    #   data_max. The breaks are computed across all the columns at once.
+
+    if scheme is not None:
+        breaks = get_breaks(data[columns_to_colorize].values, len(palette), scheme)
+        for column_name in columns_to_colorize:
+            classes = classify(data[column_name].values, breaks)
+            data['%s_color' % column_name] = _palette_colors(classes, palette)
+        return data, (breaks[0], breaks[-1])
 
     if data_min is None:
         data_min = np.floor(np.amin(data[columns_to_colorize].values))
@@ -57,10 +100,16 @@ def color_data(data, columns_to_colorize, data_min=None, data_max=None,
 
 
 def build_map(data, variables, years=None, plot_width=800,
-                         x_range=[70, 140], y_range=[10, 60], title=""):
-    #aspect_ratio = (x_range[1] - x_range[0]) / (y_range[1] - y_range[0])
-    #plot_height = int(plot_width / aspect_ratio)
-    plot_height = plot_width
+                         x_range=[70, 140], y_range=[10, 60], title="", projection=None):
+    # projection - a name in cgetools.projection.PROJECTIONS, e.g. 'albers':
+    #   the outlines are projected, and the ranges and height fit them
+    if projection is not None:
+        data = data.copy()
+        data['xs'], data['ys'] = project_outlines(data['xs'], data['ys'], projection)
+        x_range, y_range = get_ranges(data['xs'], data['ys'])
+        plot_height = get_plot_height(plot_width, x_range, y_range)
+    else:
+        plot_height = plot_width
     x_range = Range1d(x_range[0], x_range[1])
     y_range = Range1d(y_range[0], y_range[1])
 
@@ -124,10 +173,196 @@ def build_map(data, variables, years=None, plot_width=800,
     return layout
 
 
-def live_map(gdx_file, variable, verbose=False):
+def _palette_indices(values, data_min, data_max, n_colors):
+    # The bins of color_data, as indices into the palette; NODATA for missing
+    # values, and the first bin for all when the range is empty
+    values = np.asarray(values, dtype=float)
+    indices = np.full(values.shape, NODATA, dtype=int)
+    present = ~np.isnan(values)
+    if data_max > data_min:
+        bins = np.floor((values[present] - data_min) / ((data_max - data_min) / n_colors))
+        indices[present] = np.clip(bins, 0, n_colors - 1)
+    else:
+        indices[present] = 0
+    return indices
+
+
+def _palette_colors(indices, palette):
+    return [NODATA_COLOR if i == NODATA else palette[i] for i in indices]
+
+
+# Shared by the slider and play button callbacks: show the frame of a year.
+# The per-frame values and palette indices are in the frames source, one
+# column per year, and only copied into the map source's active columns.
+_SHOW_FRAME = """
+    var years = %(years)s,
+        palette = %(palette)s,
+        nodata = %(nodata)s;
+
+    function show_frame(year) {
+        var data = source.get('data'),
+            frame = 0,
+            i;
+        while (frame + 1 < years.length && years[frame + 1] <= year) {
+            frame++;
+        }
+        year = years[frame];
+        var values = frames.get('data')['v' + year],
+            colors = frames.get('data')['c' + year];
+        for (i = 0; i < values.length; i++) {
+            data['active_value'][i] = values[i];
+            data['active_color'][i] = colors[i] < 0 ? nodata : palette[colors[i]];
+            data['active_year'][i] = year;
+        }
+        label.get('data')['text'][0] = String(year);
+        label.trigger('change');
+        source.trigger('change');
+        return year;
+    }
+"""
+
+
+def animated_map(data, palette=palettes.Blues9, data_min=None, data_max=None,
+                 plot_width=800, x_range=[70, 140], y_range=[10, 60], title="",
+                 interval=500, scheme=None, projection=None):
+    """Map of region x time data, with a year slider and a play button.
+
+    data - data frame indexed by province alpha code, one column per year
+    interval - milliseconds per frame when playing
+    scheme - classification scheme of the colors, as for color_data
+    projection - as for build_map: the outlines are projected, and the
+        ranges and height fit them
+
+    The outlines are embedded once; each frame only adds a value and a
+    palette index per region.
+    """
+    years = sorted(int(year) for year in data.columns)
+    data = data.rename(columns=dict((c, int(c)) for c in data.columns))[years]
+
+    map_data = get_map_df(decimals=COORDINATE_DECIMALS['simplified'])
+    map_data = map_data[['alpha', 'name_en', 'name_zh', 'xs', 'ys']].merge(
+        data, left_on='alpha', right_index=True)
+    if projection is not None:
+        map_data['xs'], map_data['ys'] = project_outlines(map_data['xs'], map_data['ys'], projection)
+        x_range, y_range = get_ranges(map_data['xs'], map_data['ys'])
+        plot_height = get_plot_height(plot_width, x_range, y_range)
+    else:
+        plot_height = plot_width
+    values = map_data[years].values.astype(float)
+    # Colors are binned across all frames, so they compare between years
+    if scheme is not None:
+        breaks = get_breaks(values, len(palette), scheme)
+        indices = classify(values, breaks)
+    else:
+        if data_min is None:
+            data_min = np.floor(np.nanmin(values))
+        if data_max is None:
+            data_max = np.ceil(np.nanmax(values))
+        indices = _palette_indices(values, data_min, data_max, len(palette))
+    values = round_significant(values)
+
+    frames = ColumnDataSource()
+    for i, year in enumerate(years):
+        frames.add(values[:, i].tolist(), 'v%d' % year)
+        frames.add(indices[:, i].tolist(), 'c%d' % year)
+
+    last = years[-1]
+    source = ColumnDataSource(dict(
+        xs=map_data['xs'].tolist(),
+        ys=map_data['ys'].tolist(),
+        alpha=map_data['alpha'].tolist(),
+        name_en=map_data['name_en'].tolist(),
+        name_zh=map_data['name_zh'].tolist(),
+        active_year=[last] * len(map_data),
+        active_value=values[:, -1].tolist(),
+        active_color=_palette_colors(indices[:, -1], palette),
+    ))
+
+    plot = Plot(
+        x_range=Range1d(x_range[0], x_range[1]),
+        y_range=Range1d(y_range[0], y_range[1]),
+        title=title,
+        plot_width=plot_width,
+        plot_height=plot_height,
+        **PLOT_FORMATS)
+    renderer = plot.add_glyph(source, Patches(
+        xs='xs',
+        ys='ys',
+        fill_color='active_color',
+        line_color='#000000'
+        ))
+    # The year in the top left corner, whatever the units of the ranges
+    width, height = x_range[1] - x_range[0], y_range[1] - y_range[0]
+    label = ColumnDataSource(dict(x=[x_range[0] + 0.03 * width], y=[y_range[1] - 0.1 * height],
+                                  text=[str(last)]))
+    plot.add_glyph(label, Text(x='x', y='y', text='text', text_color=DARK_GRAY,
+                               text_font_size='20pt'))
+    tooltip = """<span class='tooltip-text year'>@active_year</span>
+        <span class='tooltip-text country'>@alpha @name_zh @name_en</span>
+        <span class='tooltip-text value'>@active_value</span>"""
+    plot.add_tools(HoverTool(tooltips=tooltip, renderers=[renderer]))
+
+    show_frame = _SHOW_FRAME % dict(years=json.dumps(years),
+                                    palette=json.dumps(list(palette)),
+                                    nodata=json.dumps(NODATA_COLOR))
+    slider_callback = Callback(code=show_frame + """
+        show_frame(slider.get('value'));
+        """)
+    play_callback = Callback(code=show_frame + """
+        var year = show_frame(slider.get('value'));
+        clearInterval(play._timer);
+        if (play.get('active')) {
+            // Start over from the first year when at the end
+            if (year === years[years.length - 1]) {
+                year = show_frame(years[0]);
+                slider.set('value', year);
+            }
+            play._timer = setInterval(function() {
+                year = show_frame(years[years.indexOf(year) + 1]);
+                slider.set('value', year);
+                if (year === years[years.length - 1]) {
+                    clearInterval(play._timer);
+                    play.set('active', false);
+                }
+            }, %d);
+        }
+        """ % interval)
+    slider = Slider(title="Year", start=years[0], end=last, value=last, step=1,
+                    callback=slider_callback)
+    play = Toggle(label="Play / pause", active=False, callback=play_callback)
+    for callback in (slider_callback, play_callback):
+        callback.args = {
+            'slider': slider,
+            'play': play,
+            'source': source,
+            'frames': frames,
+            'label': label,
+            }
+
+    return vplot(plot, hplot(play, slider))
+
+
+def _extract_warehouse_data(selection, variable):
+    data = selection.extract(variable).to_series().unstack('t')
+    years = [str(t) for t in data.columns]
+    data.columns = years
+    return data, years, years, int(years[-1]), selection.description(variable)
+
+
+def _extract_live_map_data(gdx_file, variable):
+    """Read a variable from the GDX file as a frame by region, with its title.
+
+    gdx_file may also be a run and case of a results warehouse, from
+    cgetools.warehouse.Warehouse.select.
+
+    Returns (data, columns, years, t_max, title).
+    """
+    if isinstance(gdx_file, Selection):
+        return _extract_warehouse_data(gdx_file, variable)
     # Read the indicated variable(s) from the GDX file
     data = gdx_file.extract(variable)
     # Truncate unused years
+    t_max = None
     if 't' in data.coords:
         t_max = int(gdx_file.extract('t_max'))
         years = list(filter(lambda t: int(t) <= t_max, gdx_file.set('t')))
@@ -146,39 +381,169 @@ def live_map(gdx_file, variable, verbose=False):
     else:
         data = data.to_dataframe()
 
+    # Plot title: description of the variable to be plotted
+    title = gdx_file[variable].attrs['_gdx_description']
+    return data, columns, years, t_max, title
+
+
+_map_data = None
+_map_data_lock = threading.Lock()
+
+
+def _get_live_map_data():
+    # Read once: PyTables is not safe to use from several threads
+    global _map_data
+    with _map_data_lock:
+        if _map_data is None:
+            map_data = pd.read_hdf(join(DATA_DIR, 'province_map_data_simplified.hdf'), 'df')
+            _map_data = share_borders(map_data)
+    return _map_data.copy()
+
+
+def _render_live_map(data, columns, years, t_max, title, verbose=False):
     # Load map coordinates, merge, and colorize
-    map_data = pd.read_hdf(join(DATA_DIR, 'province_map_data.hdf'), 'df')
+    map_data = _get_live_map_data()
     if verbose:
         print(data)
     all_data = map_data.merge(data, left_on='alpha', right_index=True)
     colored_data, data_range = color_data(all_data, columns)
+    # Colors come from the full values; the embedded ones only need the
+    # digits a tooltip shows
+    for column in columns:
+        colored_data[column] = round_significant(colored_data[column])
 
     if years is not None:
         colored_data['active_year'] = t_max
         colored_data['active_value'] = colored_data[str(t_max)]
         colored_data['active_color'] = colored_data['%s_color' % t_max]
 
-    # Plot title: description of the variable to be plotted
-    TITLE = gdx_file[variable].attrs['_gdx_description']
-
     # Build the map
     map_box = build_map(colored_data, columns, years)
 
     # Output the map
     # Open our custom HTML template
-    with open(join(DATA_DIR, 'map_template.jinja'), 'r') as f:
+    with open(join(ASSETS_DIR, 'map_template.jinja'), 'r') as f:
         template = Template(f.read())
 
     resources = Resources(mode='inline')
     # Update these to change the text
     template_variables = {
-        'title': TITLE,
+        'title': title,
         'narrative': 'Data range: {}–{}'.format(data_range[0], data_range[1]),
-        'tooltip_css': open(join(DATA_DIR, 'tooltip.css')).read(),
+        'tooltip_css': open(join(ASSETS_DIR, 'tooltip.css')).read(),
         'bokeh_min_js': resources.js_raw[0],
         }
 
-    # Use inline resources, render the html and open
-    html = file_html(map_box, resources, TITLE, template=template,
+    # Use inline resources, render the html
+    return file_html(map_box, resources, title, template=template,
                      template_variables=template_variables)
-    display_html(html, raw=True)
+
+
+def render_live_map(gdx_file, variable, verbose=False):
+    """The HTML of the map of a variable in a GDX file."""
+    extracted = _extract_live_map_data(gdx_file, variable)
+    return _render_live_map(*extracted, verbose=verbose)
+
+
+def live_map(gdx_file, variable, verbose=False):
+    display_html(render_live_map(gdx_file, variable, verbose), raw=True)
+
+
+# Concurrent maps. Extraction and rendering run in a thread pool; a GDX file
+# is read by one thread at a time. Maps are registered under a key, by
+# default the file and variable, so that re-running a cell cancels the maps
+# that the previous run has not finished.
+MAX_WORKERS = 4
+
+_executor = None
+_gdx_locks = {}
+_locks_lock = threading.Lock()
+_tasks = {}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+def _gdx_lock(gdx_file):
+    with _locks_lock:
+        return _gdx_locks.setdefault(id(gdx_file), threading.Lock())
+
+
+def _extract_locked(gdx_file, variable):
+    with _gdx_lock(gdx_file):
+        return _extract_live_map_data(gdx_file, variable)
+
+
+async def _live_map_task(gdx_file, variable, verbose):
+    loop = asyncio.get_event_loop()
+    executor = _get_executor()
+    extracted = await loop.run_in_executor(
+        executor, _extract_locked, gdx_file, variable)
+    # A cancelled task stops here, before rendering
+    return await loop.run_in_executor(
+        executor, lambda: _render_live_map(*extracted, verbose=verbose))
+
+
+def live_map_async(gdx_file, variable, key=None, verbose=False):
+    """Render the map of a variable in a GDX file, without blocking.
+
+    Returns an asyncio task whose result is the map's HTML. A task still
+    registered under the same key (by default the file name and variable) is
+    cancelled, as when the cell that started it is re-run.
+    """
+    key = key or (getattr(gdx_file, 'filename', id(gdx_file)), variable)
+    previous = _tasks.get(key)
+    if previous is not None and not previous.done():
+        previous.cancel()
+    task = asyncio.ensure_future(_live_map_task(gdx_file, variable, verbose))
+    _tasks[key] = task
+    task.add_done_callback(
+        lambda t: _tasks.pop(key) if _tasks.get(key) is t else None)
+    return task
+
+
+def iter_live_maps(gdx_file, variables, verbose=False):
+    """Start the maps of several variables; iterate over them as they finish.
+
+    Yields awaitables of (variable, html), in order of completion, e.g.:
+
+        for next_map in iter_live_maps(gdx_file, ['GDP', 'CO2_emi']):
+            variable, html = await next_map
+    """
+    async def labelled(variable):
+        html = await live_map_async(gdx_file, variable, verbose=verbose)
+        return variable, html
+
+    return asyncio.as_completed([labelled(v) for v in variables])
+
+
+def live_maps(gdx_file, variables, verbose=False):
+    """Show the maps of several variables, each as soon as it is rendered.
+
+    Placeholders are displayed at once and replaced by the maps. Returns the
+    asyncio task doing the work; when the notebook's event loop is running,
+    the cell finishes straight away and the kernel stays responsive.
+    """
+    handles = dict(
+        (v, display(HTML('<p>Rendering map of {}…</p>'.format(v)),
+                    display_id=True))
+        for v in variables)
+
+    async def show():
+        for next_map in iter_live_maps(gdx_file, variables, verbose):
+            try:
+                variable, html = await next_map
+            except asyncio.CancelledError:
+                continue
+            handles[variable].update(HTML(html))
+
+    loop = asyncio.get_event_loop()
+    if loop.is_running():
+        return asyncio.ensure_future(show())
+    task = loop.create_task(show())
+    loop.run_until_complete(task)
+    return task
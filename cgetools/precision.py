@@ -0,0 +1,73 @@
+"""Precision policy for the values and coordinates embedded in maps and charts.
+
+Model output is stored with full float64 precision, e.g. 30.6075734375,
+while a tooltip or a color shows three or four digits. Rounding to the
+digits that can be shown makes the serialized data several times smaller.
+"""
+import numpy as np
+import pandas as pd
+
+
+__all__ = ['digits_by_variable', 'round_significant', 'snap_coordinates']
+
+
+# Significant digits kept for each short unit, as in the 'unit_short' column
+# of variables.csv (written by crem_presentation/data/pre.py)
+UNIT_DIGITS = {
+    '%': 3,
+    '10⁶': 4,
+    '10⁹ USD': 4,
+    '2007 USD/t': 3,
+    'Mt': 4,
+    'Mtce': 4,
+    'μg/m³': 3,
+}
+DEFAULT_DIGITS = 4
+
+# Decimals of a degree kept for each tier of map geometry: the simplified
+# outlines have no detail finer than about a kilometre.
+COORDINATE_DECIMALS = {
+    'simplified': 2,
+    'detailed': 3,
+}
+# The same for projected geometry, in decimals of a metre: a kilometre grid
+PROJECTED_DECIMALS = {
+    'simplified': -3,
+    'detailed': -2,
+}
+
+
+def digits_by_variable(var_info, unit_digits=UNIT_DIGITS, default=DEFAULT_DIGITS):
+    """Significant digits of each variable, from the variables.csv table.
+
+    var_info - data frame indexed by variable, with a 'unit_short' column
+    """
+    return dict((variable, unit_digits.get(unit, default))
+                for variable, unit in var_info['unit_short'].items())
+
+
+def round_significant(values, digits=DEFAULT_DIGITS):
+    """Round to a number of significant digits; NaN and inf are kept.
+
+    Returns the same type as given for a pandas Series, an array otherwise.
+    """
+    array = np.asarray(values, dtype=float)
+    finite = np.isfinite(array) & (array != 0)
+    magnitude = np.zeros(array.shape, dtype=int)
+    magnitude[finite] = np.floor(np.log10(np.abs(array[finite]))).astype(int)
+    decimals = digits - 1 - magnitude
+    # Scale by exact powers of ten, so that the result is the double nearest
+    # the rounded decimal and serializes as a short number.
+    scale = 10.0 ** np.abs(decimals)
+    rounded = np.where(decimals >= 0,
+                       np.round(array * scale) / scale,
+                       np.round(array / scale) * scale)
+    rounded = np.where(finite, rounded, array)
+    if isinstance(values, pd.Series):
+        return pd.Series(rounded, index=values.index, name=values.name)
+    return rounded
+
+
+def snap_coordinates(values, tier='simplified'):
+    """Snap longitudes or latitudes to the grid of a geometry tier."""
+    return np.round(np.asarray(values, dtype=float), COORDINATE_DECIMALS[tier])
@@ -0,0 +1,139 @@
+"""Map projections of region outlines.
+
+Maps plotted in longitude and latitude stretch northern China; these
+projections give true areas (Albers) or shapes (Lambert conformal) over
+China, or match web map tiles (Web Mercator). The formulas are those of
+the sphere, which is within a fraction of a percent of the ellipsoid at map
+scales, and work on whole arrays: all the outlines of a map are projected
+in one call.
+
+Coordinates are in metres, so plot ranges come from the projected bounds
+(`get_ranges`) rather than from degrees.
+"""
+from os.path import exists, getmtime, splitext
+
+import numpy as np
+
+
+__all__ = ['PROJECTIONS', 'albers', 'get_plot_height', 'get_ranges',
+           'lambert_conformal', 'project', 'project_cached',
+           'project_outlines', 'web_mercator']
+
+
+EARTH_RADIUS = 6371008.8  # metres, the mean radius
+WEB_MERCATOR_RADIUS = 6378137.0
+
+# Central meridian and standard parallels commonly used for maps of China
+CHINA_PARAMETERS = dict(lon0=105, lat0=0, lat1=25, lat2=47)
+
+
+def albers(lon, lat, lon0=105, lat0=0, lat1=25, lat2=47):
+    "Albers equal-area conic projection."
+    lon, lat = np.radians(lon), np.radians(lat)
+    lon0, lat0, lat1, lat2 = np.radians([lon0, lat0, lat1, lat2])
+    n = (np.sin(lat1) + np.sin(lat2)) / 2
+    c = np.cos(lat1) ** 2 + 2 * n * np.sin(lat1)
+    rho0 = EARTH_RADIUS * np.sqrt(c - 2 * n * np.sin(lat0)) / n
+    rho = EARTH_RADIUS * np.sqrt(c - 2 * n * np.sin(lat)) / n
+    theta = n * (lon - lon0)
+    return rho * np.sin(theta), rho0 - rho * np.cos(theta)
+
+
+def lambert_conformal(lon, lat, lon0=105, lat0=0, lat1=25, lat2=47):
+    "Lambert conformal conic projection."
+    lon, lat = np.radians(lon), np.radians(lat)
+    lon0, lat0, lat1, lat2 = np.radians([lon0, lat0, lat1, lat2])
+
+    def t(phi):
+        return np.tan(np.pi / 4 + phi / 2)
+
+    n = np.log(np.cos(lat1) / np.cos(lat2)) / np.log(t(lat2) / t(lat1))
+    f = np.cos(lat1) * t(lat1) ** n / n
+    rho0 = EARTH_RADIUS * f / t(lat0) ** n
+    rho = EARTH_RADIUS * f / t(lat) ** n
+    theta = n * (lon - lon0)
+    return rho * np.sin(theta), rho0 - rho * np.cos(theta)
+
+
+def web_mercator(lon, lat):
+    "Web Mercator projection, as used by web map tiles."
+    lon, lat = np.radians(lon), np.radians(lat)
+    return WEB_MERCATOR_RADIUS * lon, WEB_MERCATOR_RADIUS * np.log(np.tan(np.pi / 4 + lat / 2))
+
+
+PROJECTIONS = {
+    'albers': (albers, CHINA_PARAMETERS),
+    'lambert': (lambert_conformal, CHINA_PARAMETERS),
+    'mercator': (web_mercator, {}),
+}
+
+
+def project(lon, lat, projection='albers', **parameters):
+    """Project arrays of longitudes and latitudes; NaN stays NaN.
+
+    projection - a name in PROJECTIONS; parameters override its defaults
+    """
+    function, defaults = PROJECTIONS[projection]
+    arguments = dict(defaults, **parameters)
+    return function(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float), **arguments)
+
+
+def _flatten(xs, ys):
+    lengths = np.array([len(x) for x in xs], dtype=int)
+    flat_xs = np.concatenate([np.asarray(x, dtype=float) for x in xs]) if len(xs) else np.empty(0)
+    flat_ys = np.concatenate([np.asarray(y, dtype=float) for y in ys]) if len(ys) else np.empty(0)
+    return flat_xs, flat_ys, lengths
+
+
+def _split(values, lengths):
+    return np.split(values, np.cumsum(lengths)[:-1])
+
+
+def project_outlines(xs, ys, projection='albers', **parameters):
+    """Project the outlines of a map, e.g. its 'xs' and 'ys' columns.
+
+    All the outlines are projected as one array. Returns (xs, ys), lists of
+    arrays with the NaN part separators kept.
+    """
+    flat_xs, flat_ys, lengths = _flatten(xs, ys)
+    px, py = project(flat_xs, flat_ys, projection, **parameters)
+    return _split(px, lengths), _split(py, lengths)
+
+
+def project_cached(source_path, xs, ys, projection='albers', **parameters):
+    """Project outlines read from a geometry file, with a cache next to it.
+
+    The projected coordinates are kept in <source>.<projection>.proj.npz and
+    reused while it is newer than the source file. Returns as for
+    `project_outlines`.
+    """
+    name = projection + ''.join('.%s%g' % item for item in sorted(parameters.items()))
+    cache_path = '%s.%s.proj.npz' % (splitext(source_path)[0], name)
+    flat_xs, flat_ys, lengths = _flatten(xs, ys)
+    if exists(cache_path) and getmtime(cache_path) >= getmtime(source_path):
+        with np.load(cache_path) as cached:
+            if np.array_equal(cached['lengths'], lengths):
+                return _split(cached['xs'], lengths), _split(cached['ys'], lengths)
+    px, py = project(flat_xs, flat_ys, projection, **parameters)
+    try:
+        np.savez(cache_path, xs=px, ys=py, lengths=lengths)
+    except OSError:
+        pass  # e.g. a read-only install; the projection is still returned
+    return _split(px, lengths), _split(py, lengths)
+
+
+def get_ranges(xs, ys, padding=0.02):
+    """Plot ranges ([x0, x1], [y0, y1]) that fit the outlines.
+
+    padding - margin on each side, as a fraction of the larger extent
+    """
+    flat_xs, flat_ys, _ = _flatten(xs, ys)
+    x0, x1 = np.nanmin(flat_xs), np.nanmax(flat_xs)
+    y0, y1 = np.nanmin(flat_ys), np.nanmax(flat_ys)
+    margin = padding * max(x1 - x0, y1 - y0)
+    return [float(x0 - margin), float(x1 + margin)], [float(y0 - margin), float(y1 + margin)]
+
+
+def get_plot_height(plot_width, x_range, y_range):
+    "The plot height that keeps the ranges to scale."
+    return int(round(plot_width * (y_range[1] - y_range[0]) / (x_range[1] - x_range[0])))
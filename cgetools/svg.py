@@ -0,0 +1,128 @@
+"""Static SVG choropleth maps, rendered without Bokeh.
+
+The province outlines are projected onto the pixel grid of the image in
+Python, so the SVG shows at once: as a placeholder until the interactive map
+has loaded, or for print and PDF. The input is the map data used by
+`build_map`: a frame with 'xs' and 'ys' outlines (NaN-separated polygons)
+and color columns as written by `color_data`.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+
+__all__ = ['render_svg', 'render_svgs']
+
+
+def _get_size(width, height, x_range, y_range):
+    if height is None:
+        aspect_ratio = (x_range[1] - x_range[0]) / (y_range[1] - y_range[0])
+        height = int(width / aspect_ratio)
+    return width, height
+
+
+def _format(values, precision):
+    # Shortest text for the rounded values: no trailing zeros, no '-0'
+    text = ['%.*f' % (precision, v + 0.0) for v in values]
+    if precision:
+        text = [t.rstrip('0').rstrip('.') for t in text]
+    return [t if t not in ('-0', '') else '0' for t in text]
+
+
+def _rings(xs, ys):
+    "Split NaN-separated outlines into arrays of points."
+    points = np.column_stack([np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)])
+    breaks = np.flatnonzero(np.isnan(points).any(axis=1))
+    for ring in np.split(points, breaks):
+        ring = ring[~np.isnan(ring).any(axis=1)]
+        if len(ring) >= 3:
+            yield ring
+
+
+def project_paths(data, width=800, height=None, x_range=(70, 140), y_range=(10, 60), precision=1):
+    """SVG path data of each row's outline, in pixels.
+
+    Points are rounded to `precision` decimals of a pixel; points that round
+    onto the previous one are dropped, and all but the first point of each
+    polygon are relative moves, which are shorter.
+    """
+    width, height = _get_size(width, height, x_range, y_range)
+    x_scale = width / (x_range[1] - x_range[0])
+    y_scale = height / (y_range[1] - y_range[0])
+    paths = []
+    for xs, ys in zip(data['xs'], data['ys']):
+        path = []
+        for ring in _rings(xs, ys):
+            px = np.round((ring[:, 0] - x_range[0]) * x_scale, precision)
+            py = np.round((y_range[1] - ring[:, 1]) * y_scale, precision)
+            dx = np.round(np.diff(px), precision)
+            dy = np.round(np.diff(py), precision)
+            moved = (dx != 0) | (dy != 0)
+            if moved.sum() < 2:
+                continue  # smaller than a pixel
+            start = _format([px[0], py[0]], precision)
+            steps = ' '.join('%s %s' % step for step in zip(_format(dx[moved], precision),
+                                                              _format(dy[moved], precision)))
+            path.append(('M%s %sl%sz' % (start[0], start[1], steps)).replace(' -', '-'))
+        paths.append(''.join(path))
+    return paths
+
+
+def _assemble(paths, colors, titles, width, height, line_color, line_width, css_class):
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 %d %d" width="%d" height="%d"%s>'
+        % (width, height, width, height, ' class="%s"' % css_class if css_class else ''),
+        '<g stroke="%s" stroke-width="%s" stroke-linejoin="round">' % (line_color, line_width),
+    ]
+    for i, path in enumerate(paths):
+        if not path:
+            continue
+        if titles is None:
+            parts.append('<path fill="%s" d="%s"/>' % (colors[i], path))
+        else:
+            parts.append('<path fill="%s" d="%s"><title>%s</title></path>'
+                         % (colors[i], path, escape(str(titles[i]))))
+    parts.append('</g></svg>')
+    return ''.join(parts)
+
+
+def _assemble_job(job):
+    return _assemble(*job)
+
+
+def render_svg(data, color_column, width=800, height=None, x_range=(70, 140), y_range=(10, 60),
+               line_color='#000000', line_width=0.5, title_column=None, precision=1, css_class=None):
+    """Render one choropleth as an SVG string.
+
+    data - the map data frame, with 'xs', 'ys' and the color column
+    color_column - the column of fill colors, e.g. '2010_color'
+    title_column - optional column shown as each region's tooltip
+    height - defaults to keeping the aspect ratio of the ranges
+    """
+    return render_svgs(data, [color_column], width, height, x_range, y_range, line_color,
+                       line_width, title_column, precision, css_class, processes=0)[color_column]
+
+
+def render_svgs(data, color_columns, width=800, height=None, x_range=(70, 140), y_range=(10, 60),
+                line_color='#000000', line_width=0.5, title_column=None, precision=1, css_class=None,
+                processes=None):
+    """Render a choropleth per color column; return {color column: SVG string}.
+
+    The outlines are projected once for the whole batch, and the maps are
+    written by a pool of `processes` worker processes (all CPUs by default,
+    none with 0, e.g. when already running in a worker).
+    """
+    width, height = _get_size(width, height, x_range, y_range)
+    paths = project_paths(data, width, height, x_range, y_range, precision)
+    titles = list(data[title_column]) if title_column else None
+    jobs = [
+        (paths, list(data[column]), titles, width, height, line_color, line_width, css_class)
+        for column in color_columns
+    ]
+    if processes == 0 or len(jobs) < 2:
+        svgs = [_assemble_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            svgs = list(executor.map(_assemble_job, jobs))
+    return dict(zip(color_columns, svgs))
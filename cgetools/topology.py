@@ -0,0 +1,227 @@
+"""Shared-arc topology of region outlines, similar to TopoJSON.
+
+Outlines as used by `build_map` store every border between two regions
+twice, once in each region's 'xs' and 'ys'. A topology stores each border
+once, as an arc, and each region as rings of references to arcs. The
+coordinates are quantized to integers on a grid and delta-encoded, which
+makes them short in JSON.
+
+Layout of a topology, as a JSON-ready dict:
+
+- 'translate': [x, y] of the grid origin; 'scale': the grid step in degrees
+- 'arcs': a flat list [x0, y0, dx1, dy1, ...] per arc, in grid steps
+- 'objects': {name: [ring, ...]}, each ring a list of arc indices; ~i
+  (that is -i - 1) refers to arc i reversed
+
+Neighbouring regions refer to the same arcs, so simplifying arc by arc
+(`simplify_topology`) never opens gaps or overlaps between them.
+"""
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+
+
+__all__ = ['build_topology', 'decode_topology', 'simplify_topology']
+
+
+def _split_rings(xs, ys):
+    "Split NaN- or None-separated outlines into lists of points."
+    ring = []
+    for x, y in zip(xs, ys):
+        if x is None or y is None or math.isnan(x) or math.isnan(y):
+            if ring:
+                yield ring
+            ring = []
+        else:
+            ring.append((x, y))
+    if ring:
+        yield ring
+
+
+def _quantize_ring(ring, translate, scale):
+    points = []
+    for x, y in ring:
+        point = (int(round((x - translate[0]) / scale)), int(round((y - translate[1]) / scale)))
+        if not points or point != points[-1]:
+            points.append(point)
+    # Rings are handled as cycles, without repeating the first point
+    while len(points) > 1 and points[-1] == points[0]:
+        points.pop()
+    return points if len(points) >= 3 else None
+
+
+def _find_junctions(rings):
+    """Points where outlines meet or part: those with more than one pair of
+    neighbours, over all the rings they are on."""
+    neighbours = defaultdict(set)
+    for ring in rings:
+        n = len(ring)
+        for i, point in enumerate(ring):
+            neighbours[point].add(frozenset((ring[i - 1], ring[(i + 1) % n])))
+    return set(point for point, pairs in neighbours.items() if len(pairs) > 1)
+
+
+def _encode_arc(points):
+    flat = list(points[0])
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        flat.extend((x1 - x0, y1 - y0))
+    return flat
+
+
+def _decode_arc(flat):
+    x, y = flat[0], flat[1]
+    points = [(x, y)]
+    for i in range(2, len(flat), 2):
+        x += flat[i]
+        y += flat[i + 1]
+        points.append((x, y))
+    return points
+
+
+def build_topology(outlines, decimals=2):
+    """Build the topology of outlines.
+
+    outlines - {name: (xs, ys)} with NaN- or None-separated polygons, as in
+        the 'xs' and 'ys' columns of the map data; an OrderedDict keeps the
+        order of the objects
+    decimals - decimals of a degree kept; points closer than that are merged,
+        which also closes slivers between neighbours
+    """
+    scale = 10.0 ** -decimals
+    finite = [
+        (x, y) for xs, ys in outlines.values() for ring in _split_rings(xs, ys) for x, y in ring
+    ]
+    translate = [min(x for x, _ in finite), min(y for _, y in finite)]
+    # Round the origin to the grid, so that decoded points are on it too
+    translate = [round(math.floor(v / scale) * scale, decimals) for v in translate]
+
+    rings = OrderedDict()
+    for name, (xs, ys) in outlines.items():
+        quantized = (_quantize_ring(ring, translate, scale) for ring in _split_rings(xs, ys))
+        rings[name] = [ring for ring in quantized if ring]
+    junctions = _find_junctions([ring for parts in rings.values() for ring in parts])
+
+    arcs = []
+    index = {}
+
+    def add_arc(points):
+        key = tuple(points)
+        if key in index:
+            return index[key]
+        if key[::-1] in index:
+            return ~index[key[::-1]]
+        index[key] = len(arcs)
+        arcs.append(points)
+        return index[key]
+
+    objects = OrderedDict()
+    for name, parts in rings.items():
+        objects[name] = []
+        for ring in parts:
+            cuts = [i for i, point in enumerate(ring) if point in junctions]
+            if not cuts:
+                # A ring shared with no other: one closed arc, starting from
+                # its least point so that a duplicate ring is found
+                start = ring.index(min(ring))
+                ring = ring[start:] + ring[:start]
+                objects[name].append([add_arc(ring + ring[:1])])
+                continue
+            start = cuts[0]
+            ring = ring[start:] + ring[:start] + [ring[start]]
+            cuts = [i - start for i in cuts] + [len(ring) - 1]
+            objects[name].append([add_arc(ring[i:j + 1]) for i, j in zip(cuts, cuts[1:])])
+
+    return {
+        'translate': translate,
+        'scale': scale,
+        'arcs': [_encode_arc(points) for points in arcs],
+        'objects': objects,
+    }
+
+
+def decode_topology(topology, names=None):
+    """The outlines of a topology: OrderedDict {name: (xs, ys)}.
+
+    The polygons of an object are separated by NaN, as in the 'xs' and 'ys'
+    columns of the map data; each ring repeats its first point at the end.
+    """
+    tx, ty = topology['translate']
+    scale = topology['scale']
+    decimals = max(0, int(round(-math.log10(scale))))
+    arcs = [_decode_arc(flat) for flat in topology['arcs']]
+    outlines = OrderedDict()
+    for name in names or topology['objects']:
+        xs, ys = [], []
+        for refs in topology['objects'][name]:
+            points = []
+            for ref in refs:
+                arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+                points.extend(arc[1:] if points else arc)
+            if len(points) < 4:
+                continue  # simplified away
+            if xs:
+                xs.append(float('nan'))
+                ys.append(float('nan'))
+            xs.extend(round(tx + x * scale, decimals) for x, _ in points)
+            ys.extend(round(ty + y * scale, decimals) for _, y in points)
+        outlines[name] = (xs, ys)
+    return outlines
+
+
+def _douglas_peucker(points, tolerance):
+    "Indices of the points kept, always including both ends."
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x0, y0), (x1, y1) = points[first], points[last]
+        dx, dy = x1 - x0, y1 - y0
+        length = math.hypot(dx, dy)
+        farthest, distance = None, tolerance
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if length:
+                d = abs(dy * (x - x0) - dx * (y - y0)) / length
+            else:
+                d = math.hypot(x - x0, y - y0)  # a closed arc
+            if d > distance:
+                farthest, distance = i, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack.extend([(first, farthest), (farthest, last)])
+    return [i for i, k in enumerate(keep) if k]
+
+
+def _simplify_arcs(job):
+    arcs, step = job
+    simplified = []
+    for flat in arcs:
+        points = _decode_arc(flat)
+        simplified.append(_encode_arc([points[i] for i in _douglas_peucker(points, step)]))
+    return simplified
+
+
+def simplify_topology(topology, tolerance, processes=0):
+    """Simplify each arc with the Douglas-Peucker algorithm.
+
+    tolerance - in degrees. The ends of the arcs, where borders meet, stay in
+    place, so neighbours keep sharing their borders.
+    processes - worker processes sharing the arcs; all CPUs with None
+    """
+    step = tolerance / topology['scale']
+    arcs = topology['arcs']
+    if processes == 0:
+        simplified = _simplify_arcs((arcs, step))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            # Interleaved shares, as arc lengths are far from even
+            n = processes or os.cpu_count()
+            shares = executor.map(_simplify_arcs, [(arcs[i::n], step) for i in range(n)])
+            simplified = [None] * len(arcs)
+            for i, share in enumerate(shares):
+                simplified[i::n] = share
+    result = dict(topology)
+    result['arcs'] = simplified
+    return result
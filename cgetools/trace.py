@@ -0,0 +1,228 @@
+"""Tracing of the stages of a data pipeline, e.g. crem_presentation/data/pre.py.
+
+    >>> tracer = Tracer('trace.jsonl')
+    >>> with tracer.stage('CO2_emi', case='bau') as stage:
+    ...     co2 = stage.output(compute_co2())
+    >>> print(tracer.summary())
+
+Each stage records its wall and CPU time, the peak resident memory (RSS) of
+the process when it ends and how much it raised it, and the shape and bytes
+of the outputs it notes. Records are appended to a JSON lines file as each
+stage ends, so a long run can be followed as it goes, or inspected after a
+crash. The summary table aggregates them by stage, slowest first.
+
+Stages may be nested; a record names its parent stage. A script or notebook
+can instead mark where each stage begins, without indenting it:
+
+    >>> tracer.mark('CO2_emi')
+    >>> co2 = tracer.output(compute_co2())
+    >>> tracer.mark('PM25')  # ends the CO2_emi stage
+    >>> tracer.end()
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+__all__ = ['Tracer', 'describe', 'peak_rss']
+
+
+def peak_rss():
+    "Peak resident memory of this process, in bytes; None if unknown."
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes, except on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+def describe(obj):
+    """Type, shape and bytes of an array, DataArray, Dataset or DataFrame.
+
+    The shape of a Dataset is given by dimension.
+    """
+    shape = getattr(obj, 'shape', None)
+    if shape is None and hasattr(obj, 'dims'):
+        shape = dict((str(dim), int(size)) for dim, size in obj.dims.items())
+    elif shape is not None:
+        shape = [int(size) for size in shape]
+    nbytes = getattr(obj, 'nbytes', None)
+    if nbytes is None and hasattr(obj, 'memory_usage'):
+        nbytes = obj.memory_usage(index=True).sum()
+    return OrderedDict([
+        ('type', type(obj).__name__),
+        ('shape', shape),
+        ('bytes', None if nbytes is None else int(nbytes)),
+    ])
+
+
+class Stage(object):
+    """A stage being traced, as given by Tracer.stage."""
+
+    def __init__(self, name, case):
+        self.name = name
+        self.case = case
+        self.outputs = []
+
+    def output(self, obj, name=None):
+        "Note an output of the stage, by its shape and size; returns it."
+        description = describe(obj)
+        if name is not None:
+            description['name'] = name
+        self.outputs.append(description)
+        return obj
+
+
+class Tracer(object):
+    """Records of the stages of a run.
+
+    path - of the JSON lines file written, one line per stage; None to keep
+        the records in memory only. An existing file is replaced.
+    echo - print a line as each stage ends
+    """
+
+    def __init__(self, path=None, echo=False):
+        self.path = path
+        self.echo = echo
+        self.records = []
+        self._stack = []
+        # The stage begun by mark(), entered by hand
+        self._marked = None
+        if path is not None:
+            open(path, 'w').close()
+
+    @contextmanager
+    def stage(self, name, case=None, **fields):
+        """Trace the block as a stage of the given name and case.
+
+        fields - more items for the record, e.g. the input file
+        """
+        stage = Stage(name, case)
+        parent = self._stack[-1].name if self._stack else None
+        self._stack.append(stage)
+        start = time.time()
+        peak_before = peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        error = None
+        try:
+            yield stage
+        except BaseException as e:
+            error = '%s: %s' % (type(e).__name__, e)
+            raise
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = peak_rss()
+            self._stack.pop()
+            record = OrderedDict([
+                ('stage', name),
+                ('case', case),
+                ('parent', parent),
+                ('start', start),
+                ('wall', wall),
+                ('cpu', cpu),
+                ('peak_rss', peak),
+                ('peak_rss_increase', None if peak is None else peak - peak_before),
+                ('outputs', stage.outputs),
+            ])
+            record.update(fields)
+            if error:
+                record['error'] = error
+            self._add(record)
+
+    def output(self, obj, name=None):
+        "Note an output of the innermost stage being traced, if any; returns it."
+        if self._stack:
+            self._stack[-1].output(obj, name)
+        return obj
+
+    def mark(self, name, case=None, **fields):
+        """End the stage begun by the last mark, if any, and begin another.
+
+        The stage lasts until the next mark, or end().
+        """
+        self.end()
+        self._marked = self.stage(name, case, **fields)
+        self._marked.__enter__()
+
+    def end(self):
+        "End the stage begun by the last mark, if any."
+        if self._marked is not None:
+            marked, self._marked = self._marked, None
+            marked.__exit__(None, None, None)
+
+    def trace(self, name=None, case=None):
+        "Decorator tracing each call of a function as a stage."
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or function.__name__, case):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _add(self, record):
+        self.records.append(record)
+        if self.path is not None:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+        if self.echo:
+            print('%s%s%s: %.2f s' % ('  ' * len(self._stack), record['stage'],
+                                      '' if record['case'] is None else ' [%s]' % record['case'],
+                                      record['wall']))
+
+    def summary(self, by_case=False):
+        """A table of the stages, slowest first.
+
+        Gives for each stage (and case, with by_case) the number of times
+        it ran, the total and longest wall time, the CPU time, the peak RSS
+        at its end and the most it raised it, and the bytes of its outputs.
+        Shares are of the total wall time of the top-level stages.
+        """
+        groups = OrderedDict()
+        for record in self.records:
+            key = (record['stage'], record['case']) if by_case else record['stage']
+            groups.setdefault(key, []).append(record)
+        total = sum(r['wall'] for r in self.records if r['parent'] is None)
+
+        def megabytes(values):
+            values = [v for v in values if v is not None]
+            return '%.1f' % (max(values) / 2.0 ** 20) if values else '-'
+
+        row = '%-40s %5s %9s %6s %9s %9s %9s %9s %9s'
+        rows = [row % ('stage', 'n', 'wall s', '%', 'max s', 'cpu s', 'peak MB', '+MB', 'out MB')]
+        for key, records in sorted(groups.items(), key=lambda item: -sum(r['wall'] for r in item[1])):
+            if by_case:
+                label = key[0] if key[1] is None else '%s [%s]' % key
+            else:
+                label = key
+            wall = sum(r['wall'] for r in records)
+            out_bytes = sum(o['bytes'] or 0 for r in records for o in r['outputs'])
+            rows.append(row % (
+                label[:40],
+                len(records),
+                '%.2f' % wall,
+                '%.0f' % (100 * wall / (total or 1.0)),
+                '%.2f' % max(r['wall'] for r in records),
+                '%.2f' % sum(r['cpu'] for r in records),
+                megabytes(r['peak_rss'] for r in records),
+                megabytes(r['peak_rss_increase'] for r in records),
+                '%.1f' % (out_bytes / 2.0 ** 20),
+            ))
+        rows.append('Total wall time of the top-level stages: %.2f s' % total)
+        return '\n'.join(rows)
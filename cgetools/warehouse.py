@@ -0,0 +1,216 @@
+"""A results warehouse for model runs, in SQLite.
+
+Each model release is loaded under a run name, so that releases can be
+compared without keeping their GDX files and CSV directories around:
+
+    >>> w = Warehouse('results.sqlite')
+    >>> w.load('2015-11', data)                     # case × r × t Dataset
+    >>> w.load('2015-11', national, region='China')  # case × t Dataset
+    >>> w.query('CO2_emi', runs=['2015-10', '2015-11'], regions=['China'])
+
+Values are stored one per row, clustered by variable, case, region, year
+and run, so that a query reads little more than the rows it returns.
+Queries return xray.DataArrays with 'run', 'case', 'r' and 't' dimensions.
+"""
+from contextlib import closing
+import sqlite3
+import threading
+
+import pandas as pd
+import xray
+
+
+__all__ = ['Selection', 'Warehouse']
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS run (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS variable (
+    name TEXT PRIMARY KEY,
+    "desc" TEXT,
+    unit_long TEXT,
+    unit_short TEXT
+);
+CREATE TABLE IF NOT EXISTS value (
+    variable TEXT NOT NULL,
+    "case" TEXT NOT NULL,
+    region TEXT NOT NULL,
+    t INTEGER NOT NULL,
+    run INTEGER NOT NULL REFERENCES run (id),
+    value REAL,
+    PRIMARY KEY (variable, "case", region, t, run)
+) WITHOUT ROWID;
+"""
+
+# Dimensions of the data loaded, and their columns
+DIMS = (('case', '"case"'), ('r', 'region'), ('t', 't'))
+
+
+class Warehouse(object):
+    """Model results of several runs in one SQLite database.
+
+    path - of the database file, created if missing; ':memory:' for a
+        temporary one
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        # Shared by the threads of cgetools.map.live_map_async, one at a
+        # time: every use of the connection holds the lock, so that a query
+        # never runs inside another thread's load
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def runs(self):
+        "Names of the runs, in the order they were added."
+        with self._lock:
+            return [name for name, in self.connection.execute('SELECT name FROM run ORDER BY id')]
+
+    def variables(self):
+        "Data frame of the variables, with their description and units."
+        with self._lock:
+            return pd.read_sql('SELECT * FROM variable ORDER BY name', self.connection, index_col='name')
+
+    def _run_id(self, name, create=False, description=None):
+        # Called with the lock held
+        row = self.connection.execute('SELECT id FROM run WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            raise KeyError('No run named %r' % name)
+        return self.connection.execute('INSERT INTO run (name, description) VALUES (?, ?)',
+                                       (name, description)).lastrowid
+
+    def drop_run(self, name):
+        "Delete a run and all its values."
+        with self._lock, self.connection:
+            run = self._run_id(name)
+            self.connection.execute('DELETE FROM value WHERE run = ?', (run,))
+            self.connection.execute('DELETE FROM run WHERE id = ?', (run,))
+
+    def load(self, run, data, region=None, case=None, description=None):
+        """Load the variables of a Dataset under a run, in one transaction.
+
+        data - xray.Dataset with the dimension 't', and maybe 'case' and 'r';
+            variables with other dimensions or without years are skipped
+        region, case - the label of data without an 'r' or 'case' dimension,
+            e.g. 'China' for national data
+
+        Values already loaded for the same keys are replaced. Returns the
+        number of values loaded.
+        """
+        dims = [dim for dim, _ in DIMS]
+        counter = [0]
+
+        def rows(run_id, name, variable):
+            series = variable.to_series().dropna()
+            index = series.index
+            labels = []
+            for dim, default in (('case', case), ('r', region)):
+                if dim in variable.dims:
+                    labels.append(index.get_level_values(dim).astype(str))
+                else:
+                    labels.append([default] * len(series))
+            labels.append([int(t) for t in index.get_level_values('t')])
+            counter[0] += len(series)
+            return zip([name] * len(series), labels[0], labels[1], labels[2], [run_id] * len(series),
+                       series.values.tolist())
+
+        with self._lock, self.connection:
+            run_id = self._run_id(run, create=True, description=description)
+            for name, variable in data.data_vars.items():
+                if 't' not in variable.dims or not set(variable.dims) <= set(dims) \
+                        or variable.dtype.kind not in 'biuf' \
+                        or (case is None and 'case' not in variable.dims) \
+                        or (region is None and 'r' not in variable.dims):
+                    continue
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO variable VALUES (?, ?, ?, ?)',
+                    [name] + [variable.attrs.get(key) for key in ('desc', 'unit_long', 'unit_short')])
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO value (variable, "case", region, t, run, value) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows(run_id, name, variable))
+        return counter[0]
+
+    def query(self, variable, runs=None, cases=None, regions=None, years=None):
+        """The values of a variable, as a DataArray over run × case × r × t.
+
+        runs, cases, regions, years - lists of labels to select; all by default
+
+        Missing combinations are NaN.
+        """
+        sql = ['SELECT run.name, "case", region, t, value FROM value JOIN run ON run.id = value.run '
+               'WHERE variable = ?']
+        parameters = [variable]
+        for column, labels in (('run.name', runs), ('"case"', cases), ('region', regions), ('t', years)):
+            if labels is not None:
+                labels = list(labels)
+                sql.append('AND %s IN (%s)' % (column, ', '.join('?' * len(labels))))
+                parameters.extend(int(l) if column == 't' else l for l in labels)
+        with self._lock, closing(self.connection.execute(' '.join(sql), parameters)) as cursor:
+            rows = cursor.fetchall()
+        if not rows:
+            raise KeyError('No values of %r for this selection' % variable)
+        frame = pd.DataFrame(rows, columns=['run', 'case', 'r', 't', 'value'])
+        array = xray.DataArray.from_series(frame.set_index(['run', 'case', 'r', 't'])['value'])
+        array.name = variable
+        return array
+
+    def compare(self, variable, run, baseline_run, **selection):
+        "Differences of a variable between two runs, as for `query`."
+        values = self.query(variable, runs=[run, baseline_run], **selection)
+        return values.sel(run=run) - values.sel(run=baseline_run)
+
+    def dataset(self, run, variables=None, cases=None, regions=None):
+        """Variables of one run as a Dataset over case × r × t.
+
+        variables - names; by default all. Those without values for the
+            selection are left out.
+        cases, regions - lists of labels to select; all by default
+        """
+        if variables is None:
+            variables = list(self.variables().index)
+        arrays = {}
+        for name in variables:
+            try:
+                array = self.query(name, runs=[run], cases=cases, regions=regions)
+            except KeyError:
+                continue
+            arrays[name] = array.sel(run=run).drop('run')
+        return xray.Dataset(arrays)
+
+    def select(self, run, case):
+        "One case of a run, as a data source for cgetools.map.live_map."
+        return Selection(self, run, case)
+
+
+class Selection(object):
+    """One case of one run in a warehouse."""
+
+    def __init__(self, warehouse, run, case):
+        self.warehouse = warehouse
+        self.run = run
+        self.case = case
+
+    def extract(self, variable):
+        "The values of a variable, as a DataArray over r × t."
+        values = self.warehouse.query(variable, runs=[self.run], cases=[self.case])
+        return values.sel(run=self.run, case=self.case).drop(['run', 'case'])
+
+    def description(self, variable):
+        return self.warehouse.variables().loc[variable, 'desc']
@@ -10,6 +10,8 @@ from os.path import join
 
 GDX_DIR = join('..', '..', '..', 'crem', 'gdx')
 OUT_DIR = join('..', '..', '..', 'cecp-cop21-data')
+# Name of this release in the results warehouse, OUT_DIR/warehouse.sqlite
+RELEASE = '2015-11'
 GDX_DIR
 
 
@@ -43,12 +45,19 @@ from collections import OrderedDict
 from os import makedirs as mkdir
 from os.path import join
 
+from cgetools.aggregate import aggregate
+from cgetools.delta import delta
+from cgetools.trace import Tracer
+from cgetools.warehouse import Warehouse
 import gdx
 from numpy import nan
 from openpyxl import load_workbook
 import pandas as pd
 import xray
 
+# Time, memory and output size of each stage below, one JSON line per stage
+tracer = Tracer(join(OUT_DIR, 'pre-trace.jsonl'))
+
 FILES = [
     ('bau', 'result_urban_exo.gdx'),
     ('3', 'result_cint_n_3.gdx'),
@@ -63,6 +72,7 @@ FILES = [
 raw = OrderedDict()
 extra = dict()
 for case, fn in FILES:
+    tracer.mark('load GDX', case=case)
     raw[case] = gdx.File(join(GDX_DIR, fn))
     extra[case] = gdx.File(join(GDX_DIR, fn.replace('.gdx', '_extra.gdx')))
 
@@ -83,12 +93,20 @@ def label(variable, desc, unit_long, unit_short):
     """Add some descriptive attributes to an xray.DataArray."""
     arrays[variable].attrs.update({'desc': desc, 'unit_long': unit_long,
                                    'unit_short': unit_short})
+    tracer.output(arrays[variable], variable)
+
+
+def extract(files, case, name):
+    """Extract a variable from the GDX file of a case, traced per case."""
+    with tracer.stage('extract ' + name, case=case) as stage:
+        return stage.output(files[case].extract(name))
 
 
 # Cell:
 
 # GDP
-temp = [raw[case].extract('gdp_ref') for case in cases]
+tracer.mark('GDP')
+temp = [extract(raw, case, 'gdp_ref') for case in cases]
 arrays['GDP'] = xray.concat(temp, dim=cases).sel(rs=CREM.set('r'))                     .rename({'rs': 'r'})
 label('GDP', 'Gross domestic product',
       'billions of U.S. dollars, constant at 2007', '10⁹ USD')
@@ -98,7 +116,8 @@ arrays['GDP_aagr'] = ((arrays['GDP'][:,:,1:].values / arrays['GDP'][:,:,:-1])
 label('GDP_aagr', 'Gross domestic product, average annual growth rate',
       'percent', '%')
 
-arrays['GDP_delta'] = (arrays['GDP'] / arrays['GDP'].sel(case='bau') - 1) * 100
+arrays['GDP_delta'] = delta(xray.Dataset({'GDP': arrays['GDP']}), ['GDP'],
+                            scenarios=cases, baseline='bau')[1]['GDP']
 label('GDP_delta', 'Change in gross domestic product relative to BAU',
       'percent', '%')
 
@@ -106,10 +125,11 @@ label('GDP_delta', 'Change in gross domestic product relative to BAU',
 # Cell:
 
 # CO2 emissions
+tracer.mark('CO2 emissions')
 temp = []
 for case in cases:
-    temp.append(raw[case].extract('sectem').sum('g') +
-        raw[case].extract('houem'))
+    temp.append(extract(raw, case, 'sectem').sum('g') +
+        extract(raw, case, 'houem'))
 arrays['CO2_emi'] = xray.concat(temp, dim=cases)
 label('CO2_emi', 'Annual CO₂ emissions',
       'millions of tonnes of CO₂', 'Mt')
@@ -118,9 +138,10 @@ label('CO2_emi', 'Annual CO₂ emissions',
 # Cell:
 
 # Air pollutant emissions
+tracer.mark('air pollutant emissions')
 temp = []
 for case in cases:
-    temp.append(raw[case].extract('urban').sum('*'))
+    temp.append(extract(raw, case, 'urban').sum('*'))
 temp = xray.concat(temp, dim=cases).sel(rs=CREM.set('r')).rename({'rs': 'r'})
 for u in temp['urb']:
     if u in ['PM10', 'PM25']:
@@ -135,9 +156,10 @@ for u in temp['urb']:
 # Cell:
 
 # CO₂ price
+tracer.mark('CO2 price')
 temp = []
 for case in cases:
-    temp.append(extra[case].extract('ptcarb_t'))
+    temp.append(extract(extra, case, 'ptcarb_t'))
 arrays['CO2_price'] = xray.concat(temp, dim=cases)
 label('CO2_price', 'Price of CO₂ emissions permit',
       '2007 US dollars per tonne CO₂', '2007 USD/t')
@@ -146,9 +168,10 @@ label('CO2_price', 'Price of CO₂ emissions permit',
 # Cell:
 
 # Consumption
+tracer.mark('consumption')
 temp = []
 for case in cases:
-    temp.append(extra[case].extract('cons_t'))
+    temp.append(extract(extra, case, 'cons_t'))
 arrays['cons'] = xray.concat(temp, dim=cases)
 label('cons', 'Household consumption',
       'billions of U.S. dollars, constant at 2007', '10⁹ USD')
@@ -157,9 +180,10 @@ label('cons', 'Household consumption',
 # Cell:
 
 # Primary energy
+tracer.mark('primary energy')
 temp = []
 for case in cases:
-    temp.append(extra[case].extract('pe_t'))
+    temp.append(extract(extra, case, 'pe_t'))
 temp = xray.concat(temp, dim=cases)
 temp = temp.where(temp < 1e300).fillna(0)
 e_name = {
@@ -205,11 +229,12 @@ label('penergy_nonfossil_share',
 # Cell:
 
 # Reported share of NHW
+tracer.mark('non-fossil share')
 temp1 = []
 temp2 = []
 for case in cases:
-    temp1.append(extra[case].extract('nhw_share'))
-    temp2.append(extra[case].extract('nhw_share_CN')) 
+    temp1.append(extract(extra, case, 'nhw_share'))
+    temp2.append(extract(extra, case, 'nhw_share_CN')) 
 arrays['energy_nonfossil_share'] = 100 * xray.concat(temp1, dim=cases)
 label('energy_nonfossil_share',
       'Share of non-fossil sources in final energy',
@@ -220,10 +245,11 @@ nhw_share = 100 * xray.concat(temp2, dim=cases)
 # Cell:
 
 # Population
+tracer.mark('population')
 temp = []
 for case in cases:
-    temp.append(raw[case].extract('pop2007').sel(g='c') *
-                raw[case].extract('pop') * 1e-2)
+    temp.append(extract(raw, case, 'pop2007').sel(g='c') *
+                extract(raw, case, 'pop') * 1e-2)
 arrays['pop'] = xray.concat(temp, dim=cases).drop('g').sel(rs=CREM.set('r'))                     .rename({'rs': 'r'})
 label('pop', 'Population', 'millions', '10⁶')
 
@@ -231,9 +257,10 @@ label('pop', 'Population', 'millions', '10⁶')
 # Cell:
 
 # Share of coal in provincial GDP
+tracer.mark('coal share')
 temp = []
 for case in cases:
-    temp.append(raw['bau'].extract('sect_prod'))
+    temp.append(extract(raw, 'bau', 'sect_prod'))
 sect_prod = xray.concat(temp, dim=cases).sel(rs=CREM.set('r'), g='COL')                 .drop('g').rename({'rs': 'r'})
 arrays['COL_share'] = (sect_prod / arrays['GDP']) * 100
 label('COL_share', 'Share of coal production in provincial GDP',
@@ -246,6 +273,7 @@ label('COL_share', 'Share of coal production in provincial GDP',
 # Cell:
 
 # Open the workbook and worksheet
+tracer.mark('PM2.5 (XLSX)')
 wb = load_workbook(join(GDX_DIR,'pm.xlsx'), read_only=True)
 
 cols = {
@@ -260,7 +288,6 @@ cols = {
     '2030_cint4_lessGDP': ('4_lo', '2030'),
     '2030_cint5_lessGDP': ('5_lo', '2030'),
     }
-pm_extra = {}
 for ws in wb:
     # Read the table in to a list of lists
     temp = []
@@ -291,12 +318,11 @@ for ws in wb:
         arrays['PM25_exposure'] = da
         label('PM25_exposure', 'Population-weighted exposure to PM2.5',
               'micrograms per cubic metre', 'μg/m³')
-    else:
-        pm_extra[ws.title] = da
 
 
 # Cell:
 
+tracer.mark('PM2.5 exposed share')
 df = pd.DataFrame([
     ['bau', '2010', 66.37],
     ['bau', '2030', 84.78],
@@ -322,6 +348,7 @@ PM25_exposed_frac
 # Cell:
 
 # Combine all variables into a single xray.Dataset and truncate time
+tracer.mark('combine')
 data = xray.Dataset(arrays).sel(t=time)
 
 data['scenarios'] = xray.DataArray([
@@ -353,25 +380,47 @@ data.merge(d, join='outer', inplace=True)
 # fill in PM data for missing cases
 for nh3_case, base_case in zip(nh3_cases, base_cases):
     data.PM25_conc.loc[nh3_case,:,:] = data.PM25_conc.loc[base_case,:,:]
-
-
-# Compute national totals and averages
-national = data.sum('r')
-national['penergy_nonfossil_share'] = (national['energy_nonfossil'] /
-                                       national['energy_total']) * 100
+tracer.output(data, 'data')
+
+
+# Compute macro-regional and national totals and averages. Variables not
+# listed are summed.
+tracer.mark('aggregate')
+def GDP_aagr(agg):
+    return ((agg['GDP'][:,:,1:].values / agg['GDP'][:,:,:-1])
+            ** (1 / CREM.extract('lp')) - 1) * 100
+
+rules = {
+    'GDP_aagr': GDP_aagr,
+    'GDP_delta': lambda agg: delta(agg, ['GDP'], scenarios=agg['case'].values, baseline='bau')[1]['GDP'],
+    'penergy_nonfossil_share': ('ratio', 'energy_nonfossil', 'energy_total', 100),
+    # Reported by the model for the whole country only (below); there is
+    # no final energy to weight the provincial shares with
+    'energy_nonfossil_share': lambda agg: nan * agg['energy_total'],
+    'COL_share': ('mean', 'GDP'),
+    'PM25_exposure': ('mean', 'pop'),
+    # Unweighted average across provincial averages
+    'PM25_conc': ('mean', None),
+    }
+regional = aggregate(data, rules)
+tracer.output(regional, 'regional')
+national = regional.sel(r='China').drop('r')
+# Variables without a regional dimension, e.g. CO2_price, are national
+for name, variable in data.data_vars.items():
+    if 'r' not in variable.dims:
+        national[name] = variable
+# Reported by the model for the whole country
 national['energy_nonfossil_share'] = nhw_share
 national['PM25_exposed_frac'] = PM25_exposed_frac
-# Unweighted average across provincial averages
-national['PM25_exposure'] = pm_extra['region_pop_average']                             .sel(r='Whole China').drop('r')
-national['PM25_conc'] = pm_extra['region_actual_average'].sel(r='Whole China')                                                         .drop('r')
-    
-for var in [national.PM25_exposure, national.PM25_conc]:
+
+for var in [national.PM25_exposure, national.PM25_conc,
+            regional.PM25_exposure, regional.PM25_conc]:
     # interpolate PM data for missing years
-    var.loc[:,'2007'] = var.loc[:,'2010']
-    increment = (var.loc[:,'2030'] - var.loc[:,'2010']) / 4
-    var.loc[:,'2015'] = var.loc[:,'2010'] + increment
-    var.loc[:,'2020'] = var.loc[:,'2010'] + 2 * increment
-    var.loc[:,'2025'] = var.loc[:,'2010'] + 3 * increment
+    var.loc[...,'2007'] = var.loc[...,'2010']
+    increment = (var.loc[...,'2030'] - var.loc[...,'2010']) / 4
+    var.loc[...,'2015'] = var.loc[...,'2010'] + increment
+    var.loc[...,'2020'] = var.loc[...,'2010'] + 2 * increment
+    var.loc[...,'2025'] = var.loc[...,'2010'] + 3 * increment
 
 
 # ## 4. Output data
@@ -379,6 +428,7 @@ for var in [national.PM25_exposure, national.PM25_conc]:
 # Cell:
 
 # Output a file with scenario information
+tracer.mark('write info')
 data['scenarios'].to_dataframe().to_csv(join(OUT_DIR, 'scenarios.csv'),
                                         header=['description'],
                                         quoting=csv.QUOTE_ALL)
@@ -407,9 +457,12 @@ var_info.to_csv(join(OUT_DIR, 'variables.csv'), index_label='Variable',
 for r in CREM.set('r'):
     mkdir(join(OUT_DIR, r), exist_ok=True)
 mkdir(join(OUT_DIR, 'national'), exist_ok=True)
+for r in regional.r.values[:-1]:
+    mkdir(join(OUT_DIR, r), exist_ok=True)
 
 # Serialize to CSV
 for c in map(lambda x: x.values, data.case):
+    tracer.mark('write CSV', case=str(c))
     # Provincial data
     for r in CREM.set('r'):
         data.sel(case=c, r=r).drop(['case', 'r', 'scenarios']).to_dataframe()             .to_csv(join(OUT_DIR, r, '{}.csv'.format(c)))
@@ -419,3 +472,28 @@ for c in map(lambda x: x.values, data.case):
     # National data
     national.sel(case=c).drop(['case', 'scenarios']).to_dataframe()             .to_csv(join(OUT_DIR, 'national', '{}.csv'.format(c)))
 
+    # East, Center and West
+    for r in regional.r.values[:-1]:
+        regional.sel(case=c, r=r).drop(['case', 'r']).to_dataframe()                 .to_csv(join(OUT_DIR, r, '{}.csv'.format(c)))
+
+
+# Load the same data into the results warehouse, under this release's name,
+# so that it can be queried and compared with other releases.
+
+# Cell:
+
+tracer.mark('warehouse')
+with Warehouse(join(OUT_DIR, 'warehouse.sqlite')) as warehouse:
+    if RELEASE in warehouse.runs():
+        warehouse.drop_run(RELEASE)
+    n = warehouse.load(RELEASE, data.drop('scenarios'))
+    n += warehouse.load(RELEASE, regional.sel(r=regional.r.values[:-1]))
+    n += warehouse.load(RELEASE, national.drop('scenarios'), region='China')
+print('Loaded %d values as run %s' % (n, RELEASE))
+
+
+# Cell:
+
+# Stages by wall time; the records are in OUT_DIR/pre-trace.jsonl
+tracer.end()
+print(tracer.summary())
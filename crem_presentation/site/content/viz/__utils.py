@@ -1,20 +1,70 @@
 # -*- coding: utf-8 -*- #
-from bokeh.models import LinearAxis, Range1d, Grid, FixedTicker, NumeralTickFormatter, Plot
+import json
+
+from bokeh.embed import components as bokeh_components
+from bokeh.models import (
+    LinearAxis, Range1d, Grid, FixedTicker, NumeralTickFormatter, Plot, ColumnDataSource, CustomJS
+)
 
 from jinja2 import Environment, FileSystemLoader
 
+from cgetools.projection import get_plot_height
+
 from .constants import AXIS_FORMATS, PLOT_FORMATS, grey, dark_grey
+from . import _slices, _tracking
 
 from os.path import join
 
 env = Environment(loader=FileSystemLoader(join('theme', 'templates', 'viz')))
 
 
-def get_map_plot(plot_width):
-    x_range = [73, 135]
-    y_range = [18, 54]
-    aspect_ratio = (x_range[1] - x_range[0]) / (y_range[1] - y_range[0])
-    plot_height = int(plot_width / aspect_ratio)
+def _json_size(values):
+    return len(json.dumps(values, default=lambda o: o.tolist()))
+
+
+def get_payload_breakdown(references):
+    """Serialized bytes of the data sources among the models, by kind of data.
+
+    Legend sources are marked with a _payload_kind of 'legend'; other columns
+    are geometry (xs/ys), colors (*_color) or values.
+    """
+    breakdown = dict(geometry=0, values=0, colors=0, legend=0)
+    for model in references:
+        if not isinstance(model, ColumnDataSource):
+            continue
+        for name, column in model.data.items():
+            if getattr(model, '_payload_kind', None) == 'legend':
+                kind = 'legend'
+            elif name in ('xs', 'ys'):
+                kind = 'geometry'
+            elif name == 'color' or name.endswith('_color'):
+                kind = 'colors'
+            else:
+                kind = 'values'
+            breakdown[kind] += _json_size(column)
+    return breakdown
+
+
+def components(plot_objects, wrap_plot_info=False):
+    # bokeh.embed.components, recording the size of the document and what it leaves out
+    references = set()
+    for plot_object in plot_objects.values():
+        references.update(plot_object.references())
+    for model in references:
+        if isinstance(model, ColumnDataSource):
+            if hasattr(model, '_geometry_bytes'):
+                _tracking.record_bytes_saved('geometry', model._geometry_bytes)
+            _slices.strip(model)
+    script, div = bokeh_components(plot_objects, wrap_plot_info=wrap_plot_info)
+    payload = get_payload_breakdown(references)
+    # Whatever is not data is the description of the models themselves
+    payload['models'] = max(len(script.encode('utf-8')) - sum(payload.values()), 0)
+    _tracking.record_components(len(references), script, payload)
+    return script, div
+
+
+def get_map_plot(plot_width, x_range, y_range):
+    plot_height = get_plot_height(plot_width, x_range, y_range)
     x_range = Range1d(x_range[0], x_range[1])
     y_range = Range1d(y_range[0], y_range[1])
     map_params = dict(
@@ -74,3 +124,76 @@ def get_js_array(list_of_keys):
     dictionary_of_keys = dict(zip(list_of_keys, list_of_keys))
     js_array = str(dictionary_of_keys).replace("'", "")
     return js_array
+
+
+HIGHLIGHT_CODE = '''
+    var renderers = %(renderers)s,
+        groups = %(groups)s,
+        variants = %(variants)s,
+        selected = cb_obj.get('value').replace(/(,$)/g, '').split(','),
+        repaint = {};
+
+    // With lazy data, fetch the lines of the scenarios shown (see slices.js)
+    if (Bokeh.custom.load_slices) {
+        Bokeh.custom.load_slices(selected);
+    }
+
+    Object.keys(groups).forEach(function(key) {
+        var members = groups[key],
+            scenario = key.split(',')[0],
+            variant = key.split(',')[1],
+            on = selected.indexOf(scenario) > -1 && (variants.length < 2 || selected.indexOf(variant) > -1),
+            alpha = on ? %(highlighted)s : %(dimmed)s,
+            // The lines of a group always share their alpha: the
+            // {value: ...} spec of the model, or a number once set below
+            current = renderers[members[0][0]].get('glyph').get('line_alpha');
+        if (current !== null && typeof current === 'object') {
+            current = current.value;
+        }
+        if (current === alpha) {
+            return;
+        }
+        members.forEach(function(member) {
+            var glyph = renderers[member[0]].get('glyph');
+            // Silent, so that each line does not ask for a repaint; the
+            // property event keeps the view's cached alpha current.
+            glyph.set('line_alpha', alpha, {silent: true});
+            glyph.trigger('change:line_alpha', glyph, alpha);
+            repaint[member[1]] = glyph;
+        });
+    });
+    // One repaint per plot that has changed lines
+    Object.keys(repaint).forEach(function(plot) {
+        repaint[plot].trigger('change');
+    });
+'''
+
+
+def get_highlight_callback(groups, highlighted_alpha=0.8, dimmed_alpha=0.1):
+    """A TextInput callback that highlights groups of line renderers.
+
+    groups maps (scenario, variant) to the [(plot, line renderer)] of the
+    group. The input value is a comma separated list of scenarios and, when
+    there is more than one variant, of the variants to show, as written by
+    _scenario_selectors.html. Only the groups whose highlight changes are
+    updated, and each plot is repainted once.
+    """
+    args = {}
+    plot_names = {}
+    index = {}
+    for (scenario, variant), members in sorted(groups.items()):
+        key = '%s,%s' % (scenario, variant)
+        index[key] = []
+        for plot, renderer in members:
+            plot_name = plot_names.setdefault(plot.ref['id'], 'plot%d' % len(plot_names))
+            renderer_name = '%s_%s_%s' % (plot_name, scenario, variant)
+            args[renderer_name] = renderer
+            index[key].append([renderer_name, plot_name])
+    code = HIGHLIGHT_CODE % dict(
+        renderers=get_js_array(list(args)),
+        groups=json.dumps(index, sort_keys=True),
+        variants=json.dumps(sorted(set(variant for _, variant in groups))),
+        highlighted=highlighted_alpha,
+        dimmed=dimmed_alpha,
+    )
+    return CustomJS(code=code, args=args)
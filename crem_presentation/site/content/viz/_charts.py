@@ -1,26 +1,78 @@
 # -*- coding: utf-8 -*- #
+import numpy as np
+
 from bokeh.models import (
-    Plot, Range1d, Line, Text, Circle, HoverTool, ColumnDataSource
+    Plot, Range1d, Line, Patch, Text, Circle, HoverTool, ColumnDataSource, TextInput
 )
 from bokeh.core.properties import value
 
-from ._data import get_national_data, get_lo_national_data, get_pm25_national_data
-from .__utils import get_y_range, get_year_range, add_axes
-from .constants import scenarios_colors, names, scenarios_no_bau, scenarios, energy_mix_columns
+from ._data import get_national_frame, get_national_column, get_significant_digits, round_to_precision
+from . import _slices
+from .__utils import get_y_range, get_year_range, add_axes, get_highlight_callback
+from .constants import scenarios_colors, names, scenarios_no_bau, scenarios, energy_mix_columns, file_names
 from .constants_styling import PLOT_FORMATS, deselected_alpha, dark_grey
 
+# Years that are model results for PM2.5; the national values in between are
+# interpolated, so only these get markers.
+pm25_marker_years = [2010, 2030]
 
-def get_national_scenario_line_plot(parameter=None, y_ticks=None, plot_width=600, grid=True, end_factor=10, y_range=None, include_bau=True):
-    assert parameter
-    assert y_ticks
 
-    sources, data = get_national_data(parameter, include_bau)
-    return _get_national_scenario_line_plot(sources, data, parameter, y_ticks, plot_width, grid, end_factor, y_range, include_bau)
+def get_national_source(parameters, include_lo=False):
+    """One source for all the national charts of a page.
+
+    Holds a column per scenario and parameter (see _data.get_national_column)
+    against a single 't' column, so that every line of the page shares it.
+    With lazy data, each of those columns is a slice national/<case>/<parameter>.
+    """
+    df = get_national_frame(parameters, include_lo)
+    if 'PM25_exposure' in parameters:
+        modelled = df['t'].isin(pm25_marker_years)
+        df['PM25_exposure_marker_size'] = modelled * 4
+        df['PM25_exposure_hit_size'] = modelled * 20
+    slices = {}
+    for lo in ([False, True] if include_lo else [False]):
+        for scenario in scenarios:
+            case = file_names[scenario] + ('_lo' if lo else '')
+            for parameter in parameters:
+                slices[get_national_column(scenario, parameter, lo)] = ('national/%s/%s' % (case, parameter), scenario)
+    return _slices.mark(ColumnDataSource(data=df.to_dict('list')), 't', slices)
+
 
+def add_hover(plot, source, columns, tooltips, size, labels=None):
+    """One invisible hit target and HoverTool for all the lines of a plot.
+
+    The points of the columns are gathered, long rather than wide, in a
+    source of their own, so that one tooltip on its 'y' (and 'label') column
+    serves every line. size is a number, or a column of the source.
+    """
+    t = list(source.data['t'])
+    data = dict(t=[], y=[], label=[], size=[])
+    for column, label in zip(columns, labels or columns):
+        data['t'].extend(t)
+        data['y'].extend(source.data[column])
+        data['label'].extend([label] * len(t))
+        data['size'].extend(source.data[size] if size in source.data else [size] * len(t))
+    hit_target = Circle(x='t', y='y', size='size', line_color=None, fill_color=None)
+    hit_renderer = plot.add_glyph(ColumnDataSource(data=data), hit_target)
+    plot.add_tools(HoverTool(tooltips=tooltips, renderers=[hit_renderer]))
+
+
+def get_national_scenario_line_plot(source, parameter=None, y_ticks=None, plot_width=600, grid=True, end_factor=None, y_range=None, include_bau=True):
+    assert parameter
+    assert y_ticks
 
-def _get_national_scenario_line_plot(sources, data, parameter=None, y_ticks=None, plot_width=600, grid=True, end_factor=None, y_range=None, include_bau=True):
+    if include_bau:
+        sc = scenarios
+    else:
+        sc = scenarios_no_bau
+    columns = [get_national_column(scenario, parameter) for scenario in sc]
     if not y_range:
-        y_range = get_y_range(data)
+        y_range = get_y_range(np.concatenate([source.data[column] for column in columns]))
+
+    # Sizes given by a column mark only some of the years
+    marker_size, hit_size = 4, 20
+    if '%s_marker_size' % parameter in source.data:
+        marker_size, hit_size = '%s_marker_size' % parameter, '%s_hit_size' % parameter
 
     plot = Plot(
         x_range=get_year_range(end_factor),
@@ -29,51 +81,36 @@ def _get_national_scenario_line_plot(sources, data, parameter=None, y_ticks=None
         **PLOT_FORMATS
     )
     plot = add_axes(plot, y_ticks, color=dark_grey, grid=grid)
-    hit_renderers = []
     line_renderers = {}
-    if include_bau:
-        sc = scenarios
-    else:
-        sc = scenarios_no_bau
-    for scenario in sc:
-        source = sources[scenario]
+    for scenario, column in zip(sc, columns):
         line = Line(
-            x='t', y=parameter, line_color=scenarios_colors[scenario],
+            x='t', y=column, line_color=scenarios_colors[scenario],
             line_width=2, line_cap='round', line_join='round'
         )
         circle = Circle(
-            x='t', y=parameter, size=4,
+            x='t', y=column, size=marker_size,
             line_color=scenarios_colors[scenario], line_width=0.5, line_alpha=deselected_alpha,
             fill_color=scenarios_colors[scenario], fill_alpha=0.6
         )
-        # invisible circle used for hovering
-        hit_target = Circle(
-            x='t', y=parameter, size=20,
-            line_color=None, fill_color=None
-        )
         scenario_label = Text(
-            x=value(source.data['t'][-1] + 0.8), y=value(source.data[parameter][-1] * 0.98), text=value(names[scenario]),
+            x=value(source.data['t'][-1] + 0.8), y=value(source.data[column][-1] * 0.98), text=value(names[scenario]),
             text_color=scenarios_colors[scenario], text_font_size="8pt",
         )
 
-        hit_renderer = plot.add_glyph(source, hit_target)
-        hit_renderers.append(hit_renderer)
         line_renderer = plot.add_glyph(source, line)
         line_renderers[scenario] = line_renderer
         plot.add_glyph(source, circle)
         plot.add_glyph(scenario_label)
 
-    plot.add_tools(HoverTool(tooltips="@%s{0,0} (@t)" % parameter, renderers=hit_renderers))
+    add_hover(plot, source, columns, "@y{0,0} (@t)", hit_size)
     return (plot, line_renderers)
 
 
-def add_lo_economic_growth_lines(plot, parameter):
-    sources, _ = get_lo_national_data(parameter)
+def add_lo_economic_growth_lines(plot, source, parameter):
     line_renderers = {}
     for scenario in scenarios:
-        source = sources[scenario]
         line = Line(
-            x='t', y=parameter, line_color=scenarios_colors[scenario],
+            x='t', y=get_national_column(scenario, parameter, lo=True), line_color=scenarios_colors[scenario],
             line_width=2, line_cap='round', line_join='round', line_dash='dashed'
         )
         line_renderer = plot.add_glyph(source, line)
@@ -81,12 +118,26 @@ def add_lo_economic_growth_lines(plot, parameter):
     return (plot, line_renderers)
 
 
-def get_pm25_national_plot(plot_width=600, end_factor=None, grid=True):
-    sources, data = get_pm25_national_data()
+def get_scenario_highlighter(charts):
+    """The TextInput that the scenario selectors set to highlight lines.
+
+    charts is a list of (plot, line_renderers, lo_line_renderers) as returned
+    by the plot functions and add_lo_economic_growth_lines; lo_line_renderers
+    may be None. The lines are grouped by scenario and growth variant.
+    """
+    groups = {}
+    for plot, line_renderers, lo_line_renderers in charts:
+        for variant, renderers in (('norm', line_renderers), ('lo', lo_line_renderers or {})):
+            for scenario, renderer in renderers.items():
+                groups.setdefault((scenario, variant), []).append((plot, renderer))
+    return TextInput(callback=get_highlight_callback(groups))
+
+
+def get_pm25_national_plot(source, plot_width=600, end_factor=None, grid=True):
     y_ticks = [30, 40, 50, 60, 70]
     y_range = Range1d(30, 72)
-    pm25, line_renderers = _get_national_scenario_line_plot(
-        sources, data, 'PM25_exposure',
+    pm25, line_renderers = get_national_scenario_line_plot(
+        source, 'PM25_exposure',
         y_ticks=y_ticks, plot_width=plot_width, grid=grid, end_factor=end_factor, y_range=y_range
     )
     # Add Targets
@@ -102,19 +153,19 @@ def get_pm25_national_plot(plot_width=600, end_factor=None, grid=True):
     return (pm25, line_renderers)
 
 
-def get_co2_national_plot(plot_width=600, end_factor=None, grid=True, include_bau=True):
-    sources, data = get_national_data('CO2_emi', include_bau)
+def get_co2_national_plot(source, plot_width=600, end_factor=None, grid=True, include_bau=True):
     y_ticks = [7000, 10000, 13000, 16000]
     y_range = Range1d(7000, 16500)
-    return _get_national_scenario_line_plot(
-        sources, data, 'CO2_emi',
+    return get_national_scenario_line_plot(
+        source, 'CO2_emi',
         y_ticks=y_ticks, plot_width=plot_width, grid=grid,
         end_factor=end_factor, y_range=y_range, include_bau=include_bau
     )
 
 
-def get_nonfossil(plot_width=750, end_factor=5, grid=True, include_bau=False):
+def get_nonfossil(source, plot_width=750, end_factor=5, grid=True, include_bau=False):
     plot, line_renderers = get_national_scenario_line_plot(
+        source,
         parameter='energy_nonfossil_share',
         y_ticks=[10, 15, 20, 25],
         plot_width=plot_width,
@@ -135,7 +186,7 @@ def get_nonfossil(plot_width=750, end_factor=5, grid=True, include_bau=False):
     return (plot, line_renderers)
 
 
-def get_energy_mix_by_scenario(df, scenario, plot_width=700):
+def get_energy_mix_by_scenario(source, scenario, plot_width=700):
     plot = Plot(
         x_range=get_year_range(end_factor=15),
         y_range=Range1d(0, 4300),
@@ -143,11 +194,11 @@ def get_energy_mix_by_scenario(df, scenario, plot_width=700):
         **PLOT_FORMATS
     )
     plot = add_axes(plot, [0, 2000, 4000], color=scenarios_colors[scenario])
-    source = ColumnDataSource(df)
 
+    columns = []
     for energy_mix_column in energy_mix_columns.keys():
         energy_name = energy_mix_columns[energy_mix_column]
-        parameter = '%s_%s' % (scenario, energy_mix_column)
+        parameter = get_national_column(scenario, energy_mix_column)
         line = Line(
             x='t', y=parameter, line_color='black',
             line_width=2, line_cap='round', line_join='round', line_alpha=0.8
@@ -155,19 +206,70 @@ def get_energy_mix_by_scenario(df, scenario, plot_width=700):
         circle = Circle(
             x='t', y=parameter, size=4, fill_color='black', fill_alpha=0.6
         )
-        # invisible circle used for hovering
-        hit_target = Circle(
-            x='t', y=parameter, size=10, line_color=None, fill_color=None
-        )
+        columns.append(parameter)
         scenario_label = Text(
             x=value(source.data['t'][-1] + 2), y=value(source.data[parameter][-1] - 200),
             text=value(energy_name), text_color='grey', text_font_size='8pt',
         )
 
-        hit_renderer = plot.add_glyph(source, hit_target)
-        plot.add_tools(HoverTool(tooltips="%s - @%s{0,0} (@t)" % (energy_name, parameter), renderers=[hit_renderer]))
         plot.add_glyph(source, line)
         plot.add_glyph(source, circle)
         plot.add_glyph(scenario_label)
 
+    add_hover(plot, source, columns, "@label - @y{0,0} (@t)", 10,
+              labels=list(energy_mix_columns.values()))
+    return plot
+
+
+def get_ensemble_band_plot(summary, y_ticks, color=dark_grey, bands=((5, 95), (25, 75)), plot_width=600,
+                           end_factor=None, grid=True, y_range=None):
+    """Percentile bands and median line of a variable over an ensemble of runs.
+
+    summary is one variable of a cgetools.ensemble summary, with only its
+    'stat' and 't' dimensions left, e.g. summary['CO2_emi'].sel(r='BJ').
+    bands are (lower, upper) percentiles in the summary, widest first; the
+    inner bands are drawn darker.
+    """
+    df = summary.to_series().unstack('stat')
+    df.index = df.index.astype(int)
+    df = df.sort_index()
+    df.index.name = 't'
+    df = df.reset_index()
+    digits = get_significant_digits(summary.name)
+    for column in df.columns:
+        if column != 't':
+            round_to_precision(df, column, digits)
+    t = df['t'].tolist()
+    if not y_range:
+        y_range = get_y_range(df[['p%g' % p for band in bands for p in band]].values)
+
+    plot = Plot(
+        x_range=get_year_range(end_factor),
+        y_range=y_range,
+        plot_width=plot_width,
+        **PLOT_FORMATS
+    )
+    plot = add_axes(plot, y_ticks, color=dark_grey, grid=grid)
+    for i, (lower, upper) in enumerate(bands):
+        # The band's outline: along its lower edge, then back along the upper
+        outline = ColumnDataSource(data=dict(
+            x=t + t[::-1], y=df['p%g' % lower].tolist() + df['p%g' % upper].tolist()[::-1]
+        ))
+        plot.add_glyph(outline, Patch(
+            x='x', y='y', fill_color=color, fill_alpha=0.15 * (i + 1), line_color=None
+        ))
+
+    source = ColumnDataSource(data=df.to_dict('list'))
+    median = Line(
+        x='t', y='p50', line_color=color,
+        line_width=2, line_cap='round', line_join='round'
+    )
+    hit_target = Circle(x='t', y='p50', size=20, line_color=None, fill_color=None)
+    hit_renderer = plot.add_glyph(source, hit_target)
+    lower, upper = bands[0]
+    plot.add_tools(HoverTool(
+        tooltips="@p50{0,0} (@t); %g–%g%%: @p%g{0,0} – @p%g{0,0}" % (lower, upper, lower, upper),
+        renderers=[hit_renderer]
+    ))
+    plot.add_glyph(source, median)
     return plot
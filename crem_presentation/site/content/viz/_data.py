@@ -1,54 +1,129 @@
 # -*- coding: utf-8 -*- #
+from collections import OrderedDict
+import json
+
 import pandas as pd
 import numpy as np
+import xray
 
 from bokeh.models import ColumnDataSource
+from cgetools import classify, delta, precision, projection, topology
+from cgetools.warehouse import Warehouse
 from matplotlib import pyplot
 from matplotlib.colors import rgb2hex
 from .constants import (
-    provinces, scenarios, scenarios_no_bau, file_names, energy_mix_columns, map_legend_x
+    provinces, scenarios, file_names, map_projection
 )
+from . import _slices, _tracking
 
+import os
 from os.path import join
 DATA_DIR = join('..', '..', '..', 'cecp-cop21-data')
 
-def get_lo_national_data(parameter):
-    return _get_national_data(parameter, join(DATA_DIR, 'national', '%s_lo.csv'), include_bau=True)
+PROVINCE_MAP_FILE = join('content', 'viz', '__province_map_data_simplified.hdf')
+
+_significant_digits = None
+_province_topology = None
+_provincial_deltas = {}
+# (Warehouse, run) read instead of the CSV files; see use_warehouse
+_warehouse = None
+# Frames read from disk, while memoize_reads is on: {(filename, options):
+# ((mtime, size), frame)}. Kept when dev_server.py reloads this module.
+try:
+    _reads
+except NameError:
+    _reads = None
+
+
+def memoize_reads(on=True):
+    """Keep the frames read by read_csv and read_hdf in memory, for as long
+    as their file is unchanged. For the long-lived dev_server.py."""
+    global _reads
+    _reads = {} if on else None
+
+
+def clear_caches():
+    "Forget the data derived from the files, e.g. once one of them changed."
+    global _significant_digits, _province_topology
+    _significant_digits = None
+    _province_topology = None
+    _provincial_deltas.clear()
+
+
+def use_warehouse(path, run):
+    """Read the model data from a run in a results warehouse (see
+    cgetools.warehouse) instead of the CSV files; None for the CSV files."""
+    global _warehouse
+    if path is None:
+        _warehouse = None
+    elif _warehouse is None or (_warehouse[0].path, _warehouse[1]) != (path, run):
+        _warehouse = (Warehouse(path), run)
+    else:
+        return
+    _provincial_deltas.clear()
+
+
+def read_case(region, case, columns):
+    """The data of one region in one case, as in DATA_DIR/<region>/<case>.csv:
+    a 't' column and a column per variable. 'national' is the whole country."""
+    if _warehouse is None:
+        return read_csv(join(DATA_DIR, region, '%s.csv' % case), usecols=['t'] + list(columns))
+    warehouse, run = _warehouse
+    _tracking.record_read(warehouse.path)
+    region = 'China' if region == 'national' else region
+    data = warehouse.dataset(run, columns, cases=[case], regions=[region])
+    return data.sel(case=case, r=region).drop(['case', 'r']).to_dataframe().reset_index()
+
+
+def get_significant_digits(parameter):
+    """Significant digits embedded for a parameter, by its unit in variables.csv."""
+    global _significant_digits
+    filename = join(DATA_DIR, 'variables.csv')
+    if _significant_digits is None:
+        _significant_digits = precision.digits_by_variable(read_csv(filename, index_col='Variable'))
+    else:
+        # Still a dependency of the viz being rendered
+        _tracking.record_read(filename)
+    return _significant_digits.get(parameter, precision.DEFAULT_DIGITS)
 
 
-def get_national_data(parameter, include_bau):
-    return _get_national_data(parameter, join(DATA_DIR, 'national', '%s.csv'), include_bau)
+def round_to_precision(df, key, digits):
+    """Round a value column in place, recording the bytes this saves."""
+    before = len(json.dumps(df[key].tolist()))
+    df[key] = precision.round_significant(df[key], digits)
+    _tracking.record_bytes_saved('precision', before - len(json.dumps(df[key].tolist())))
 
 
-def get_pm25_national_data():
-    filepath = join(DATA_DIR, 'national', '%s.csv')
-    parameter = 'PM25_exposure'
-    read_props = dict(usecols=['t', parameter])
-    sources = {}
-    data = []
-    for scenario in scenarios:
-        df = get_df_and_strip_2007_15_20_25(filepath % file_names[scenario], read_props)
-        sources[scenario] = ColumnDataSource(df)
-        data.extend(sources[scenario].data[parameter])
-    data = np.array(data)
-    return (sources, data)
+def get_national_column(scenario, parameter, lo=False):
+    if lo:
+        return '%s_lo_%s' % (scenario, parameter)
+    return '%s_%s' % (scenario, parameter)
 
 
-def get_energy_mix_for_all_scenarios():
-    usecols = ['t']
-    usecols.extend(energy_mix_columns)
-    read_props = dict(usecols=usecols)
-    all_scenarios = pd.DataFrame()
-    for scenario in scenarios:
-        df = get_df_and_strip_2007(join(DATA_DIR, 'national', '%s.csv') % file_names[scenario], read_props)
-        all_scenarios['t'] = df['t']
-        for energy_mix_column in energy_mix_columns:
-            all_scenarios['%s_%s' % (scenario, energy_mix_column)] = df[energy_mix_column]
-    return all_scenarios
+def get_national_frame(parameters, include_lo=False):
+    """National data of every scenario in one wide frame, reading each CSV once.
 
+    Has a 't' column, and a column per scenario and parameter named by
+    get_national_column; with include_lo, also the low growth variants.
+    """
+    variants = [('%s', False)]
+    if include_lo:
+        variants.append(('%s_lo', True))
+    digits = dict((parameter, get_significant_digits(parameter)) for parameter in parameters)
+    frame = pd.DataFrame()
+    for case, lo in variants:
+        for scenario in scenarios:
+            df = strip_2007(read_case('national', case % file_names[scenario], parameters))
+            frame['t'] = df['t'].values
+            for parameter in parameters:
+                column = get_national_column(scenario, parameter, lo)
+                frame[column] = df[parameter].values
+                round_to_precision(frame, column, digits[parameter])
+    return frame
 
-def get_co2_2030_4_vs_bau_change_by_province(prefix, cmap_name='Blues', df=None):
-    return get_dataframe_of_2030_4_vs_bau_change_in_provincial_data(prefix, cmap_name, 'CO2_emi', df=df)
+
+def get_co2_change_by_province(prefix, scenario, baseline, year, cmap_name='Blues', df=None):
+    return get_dataframe_of_change_in_provincial_data(prefix, cmap_name, 'CO2_emi', scenario, baseline, year, df=df)
 
 
 def get_coal_share_in_2010_by_province(prefix, cmap_name='Blues', df=None):
@@ -56,23 +131,22 @@ def get_coal_share_in_2010_by_province(prefix, cmap_name='Blues', df=None):
 
 
 def get_population_in_2010_by_province(prefix, cmap_name='Blues', df=None):
-    return get_dataframe_of_specific_provincial_data(prefix, cmap_name, 'pop', 2010, df=df)
+    return get_dataframe_of_specific_provincial_data(prefix, cmap_name, 'pop', 2010, df=df, scheme='jenks')
 
 
 def get_gdp_in_2010_by_province(prefix, cmap_name='Blues', df=None):
-    return get_dataframe_of_specific_provincial_data(prefix, cmap_name, 'GDP', 2010, df=df)
+    return get_dataframe_of_specific_provincial_data(prefix, cmap_name, 'GDP', 2010, df=df, scheme='jenks')
 
 
 def get_2030_pm25_exposure_by_province(prefix, cmap_name='Blues', df=None):
     return get_dataframe_of_specific_provincial_data(prefix, cmap_name, 'PM25_exposure', 2030, df=df)
 
 
-def get_pm25_2030_4_vs_bau_change_by_province(prefix, cmap_name='Blues', df=None):
-    return get_dataframe_of_2030_4_vs_bau_change_in_provincial_data(prefix, cmap_name, 'PM25_conc', df=df)
+def get_pm25_change_by_province(prefix, scenario, baseline, year, cmap_name='Blues', df=None):
+    return get_dataframe_of_change_in_provincial_data(prefix, cmap_name, 'PM25_conc', scenario, baseline, year, df=df)
 
 
 def _get_dataframe_of_specific_provincial_data(prefix, parameter, row_index, df=None):
-    read_props = dict(usecols=['t', parameter])
     key_value = '%s_val' % prefix
     key_color = '%s_color' % prefix
 
@@ -86,27 +160,30 @@ def _get_dataframe_of_specific_provincial_data(prefix, parameter, row_index, df=
         df = null_df
     # Populate the values
     for province in province_list:
-        four = get_df_and_strip_2007(join(DATA_DIR, '%s', '4.csv') % province, read_props)
+        four = strip_2007(read_case(province, '4', [parameter]))
         four = four.set_index('t')
         df[key_value][province] = four[parameter][row_index]
 
     return (df, key_value, key_color)
 
 
-def get_dataframe_of_specific_provincial_data(prefix, cmap_name, parameter, row_index, df=None, boost_factor=None):
+def get_dataframe_of_specific_provincial_data(prefix, cmap_name, parameter, row_index, df=None, boost_factor=None,
+                                              scheme=None):
     if df is not None:
         assert isinstance(df, pd.DataFrame)
     df, key_value, key_color = _get_dataframe_of_specific_provincial_data(prefix, parameter, row_index, df)
-    df, legend_data = normalize_and_color(df, key_value, key_color, cmap_name, boost_factor)
+    df, legend_data = normalize_and_color(df, key_value, key_color, cmap_name, boost_factor, scheme)
+    round_to_precision(df, key_value, get_significant_digits(parameter))
     df.loc['XZ', key_value] = 'No Data'
     df.loc['XZ', key_color] = 'white'
     return (df, legend_data)
 
 
-def get_dataframe_of_2030_4_vs_bau_change_in_provincial_data(prefix, cmap_name, parameter, df=None):
+def get_dataframe_of_change_in_provincial_data(prefix, cmap_name, parameter, scenario, baseline, year, df=None):
+    """The change in a parameter from the baseline case to the scenario case
+    in one year, by province: absolute and in percent."""
     if df is not None:
         assert isinstance(df, pd.DataFrame)
-    read_props = dict(usecols=['t', parameter])
     key_value = '%s_val' % prefix
     key_color = '%s_color' % prefix
     key_percent = '%s_percent' % prefix
@@ -121,41 +198,49 @@ def get_dataframe_of_2030_4_vs_bau_change_in_provincial_data(prefix, cmap_name,
         df = null_df
 
     # Populate the values
-    for province in province_list:
-        four = get_df_and_strip_2007(join(DATA_DIR, '%s', '4.csv') % province, read_props)
-        bau = get_df_and_strip_2007(join(DATA_DIR, '%s', 'bau.csv') % province, read_props)
-        df[key_value][province], df[key_percent][province] = get_2030_4_vs_bau_delta(four, bau, parameter)
+    deltas = get_provincial_deltas([scenario, baseline], [parameter])
+    absolute, percent = deltas.get([parameter], [scenario], baseline)
+    df[key_value] = absolute[parameter].sel(case=scenario, t=year).to_series()
+    df[key_percent] = percent[parameter].sel(case=scenario, t=year).to_series()
 
     df, legend_data = normalize_and_color(df, key_value, key_color, cmap_name)
+    round_to_precision(df, key_value, get_significant_digits(parameter))
+    round_to_precision(df, key_percent, precision.UNIT_DIGITS['%'])
     df.loc['XZ', key_value] = 'No Data'
     df.loc['XZ', key_color] = 'white'
     return (df, legend_data)
 
 
-def _get_national_data(parameter, filepath, include_bau):
-    read_props = dict(usecols=['t', parameter])
-    sources = {}
-    data = []
-    if include_bau:
-        sc = scenarios
+def read_provincial_dataset(cases, variables):
+    """Some variables of the provincial data of some cases, as one
+    case × r × t Dataset."""
+    if _warehouse is not None:
+        warehouse, run = _warehouse
+        _tracking.record_read(warehouse.path)
+        return warehouse.dataset(run, list(variables), cases=list(cases), regions=list(provinces))
+    frames = OrderedDict()
+    for case in cases:
+        for province in provinces:
+            frames[(case, province)] = read_csv(join(DATA_DIR, province, '%s.csv' % case),
+                                                usecols=['t'] + list(variables), index_col='t')
+    return xray.Dataset.from_dataframe(pd.concat(frames, names=['case', 'r']))
+
+
+def get_provincial_deltas(cases, variables):
+    """Differences between some variables of the provincial data of some
+    cases (see cgetools.delta), read once per process."""
+    key = (tuple(sorted(cases)), tuple(sorted(variables)))
+    if key not in _provincial_deltas:
+        _provincial_deltas[key] = delta.Deltas(read_provincial_dataset(*key))
     else:
-        sc = scenarios_no_bau
-    for scenario in sc:
-        df = get_df_and_strip_2007(filepath % file_names[scenario], read_props)
-        sources[scenario] = ColumnDataSource(df)
-        data.extend(sources[scenario].data[parameter])
-    data = np.array(data)
-    return (sources, data)
-
-
-def get_2030_4_vs_bau_delta(four, bau, parameter):
-    four = four.set_index('t')
-    bau = bau.set_index('t')
-    four = four[parameter][2030]
-    bau = bau[parameter][2030]
-    absolute = four - bau
-    percent = ((four - bau) / bau) * 100
-    return (absolute, percent)
+        # Still dependencies of the viz being rendered
+        if _warehouse is not None:
+            _tracking.record_read(_warehouse[0].path)
+        else:
+            for case in key[0]:
+                for province in provinces:
+                    _tracking.record_read(join(DATA_DIR, province, '%s.csv' % case))
+    return _provincial_deltas[key]
 
 
 def build_legend_data(df, key_value, sign, colormap, boost_factor):
@@ -170,22 +255,55 @@ def build_legend_data(df, key_value, sign, colormap, boost_factor):
     norm_map = norm_vals.apply(colormap)
     norm_hex = norm_map.apply(rgb2hex)
     df = pd.DataFrame({'vals': vals * sign, 'color': norm_hex}, dtype=str)
-    df['x'] = (df.index / 4) + map_legend_x
+    df['x'] = df.index / 99.0
     return df
 
 
-def normalize_and_color(df, key_value, key_color, cmap_name, boost_factor=None):
+def classed_colors(values, breaks, colormap, sign=1):
+    """Hex colors of the classes of the values, evenly spaced on the colormap.
+
+    The lightest end of the colormap is left out, so that no class reads as
+    the white of missing data.
+    """
+    classes = classify.classify(values, breaks)
+    n_classes = len(breaks) - 1
+    position = (classes + 0.5) / n_classes
+    if sign < 0:
+        position = 1 - position
+    return [rgb2hex(colormap(0.2 + 0.8 * p)) for p in position]
+
+
+def build_classed_legend_data(df, key_value, breaks, colormap, sign):
+    vals = pd.Series(np.linspace(breaks[0], breaks[-1], num=100))
+    colors = classed_colors(vals.values, breaks, colormap, sign)
+    df = pd.DataFrame({'vals': vals.round(), 'color': colors}, dtype=str)
+    df['x'] = df.index / 99.0
+    return df
+
+
+def normalize_and_color(df, key_value, key_color, cmap_name, boost_factor=None, scheme=None, n_classes=7):
+    """Color the values by their norm or, given a scheme, by their class.
+
+    scheme - a classification scheme of cgetools.classify, e.g. 'jenks', for
+    skewed data such as GDP and population, which scaling by the norm washes
+    out to a few dark provinces on a pale map.
+    """
     if not boost_factor:
         boost_factor = 2
     sign = 1
     if df[key_value].max() <= 0:
         sign = -1
+    colormap = pyplot.get_cmap(cmap_name)
+    if scheme is not None:
+        breaks = classify.get_breaks(df[key_value].values, n_classes, scheme)
+        df[key_color] = classed_colors(df[key_value].values, breaks, colormap, sign)
+        legend_data = build_classed_legend_data(df, key_value, breaks, colormap, sign)
+        return (df, legend_data)
     norm_array = df[key_value].copy()
     if key_value == 'col_2010_val':
         norm_array = norm_array.dropna()
     norm_array = norm_array * sign / (np.linalg.norm(norm_array))
     norm_array = norm_array * boost_factor
-    colormap = pyplot.get_cmap(cmap_name)
     norm_map = norm_array.apply(colormap)
     norm_hex = norm_map.apply(rgb2hex)
     df[key_color] = norm_hex
@@ -193,26 +311,105 @@ def normalize_and_color(df, key_value, key_color, cmap_name, boost_factor=None):
     return (df, legend_data)
 
 
-def convert_provincial_dataframe_to_map_datasource(df):
-    province_info = pd.read_hdf(join('content', 'viz', '__province_map_data_simplified.hdf'), 'df')
-    province_info = province_info.set_index('alpha')
+def get_province_topology():
+    """Shared-arc topology of the simplified province outlines (see
+    cgetools.topology), projected and quantized to the precision they carry."""
+    global _province_topology
+    if _province_topology is None:
+        province_info = read_hdf(PROVINCE_MAP_FILE, 'df')
+        xs, ys = projection.project_cached(PROVINCE_MAP_FILE, province_info['xs'], province_info['ys'],
+                                           map_projection)
+        outlines = OrderedDict(zip(province_info['alpha'], zip(xs, ys)))
+        _province_topology = topology.build_topology(outlines, precision.PROJECTED_DECIMALS['simplified'])
+    else:
+        # Still a dependency of the viz being rendered
+        _tracking.record_read(PROVINCE_MAP_FILE)
+    return _province_topology
+
+
+def read_province_info():
+    """The simplified province outlines, decoded from the province topology
+    so that neighbours share their borders point for point."""
+    province_info = read_hdf(PROVINCE_MAP_FILE, 'df')
+    outlines = topology.decode_topology(get_province_topology())
+    for i, axis in enumerate(('xs', 'ys')):
+        province_info[axis] = [np.array(outlines[alpha][i]) for alpha in province_info['alpha']]
+    return province_info
+
+
+def get_map_ranges():
+    "Plot ranges ([x0, x1], [y0, y1]) of the province maps, in projected metres."
+    outlines = topology.decode_topology(get_province_topology())
+    xs, ys = zip(*outlines.values())
+    return projection.get_ranges(xs, ys)
+
+
+def get_province_geometry():
+    """The province topology, for the shared geometry asset.
+
+    Internal borders are stored once, so this is about half the size of the
+    outlines; theme/static/js/geometry.js decodes it in the browser.
+    """
+    return get_province_topology()
+
+
+def _strip_geometry(source):
+    # The outlines are attached in the browser from the shared geometry asset
+    # (see theme/static/js/geometry.js), so only the empty columns are embedded.
+    n = len(source.data['xs'])
+    source._geometry_bytes = sum(
+        len(json.dumps([np.asarray(v, dtype=float).tolist() for v in source.data[axis]]))
+        for axis in ('xs', 'ys')
+    )
+    source.data['xs'] = [[] for _ in range(n)]
+    source.data['ys'] = [[] for _ in range(n)]
+    source.tags = ['province_geometry']
+    return source
+
+
+def convert_provincial_dataframe_to_map_datasource(df, shared_geometry=True):
+    province_info = read_province_info().set_index('alpha')
 
     map_df = pd.concat([df, province_info], axis=1)
+    map_df['alpha'] = map_df.index
     df = map_df[map_df.index != 'XZ']
     tibet_df = map_df[map_df.index == 'XZ']
-    return (ColumnDataSource(df), ColumnDataSource(tibet_df))
+    sources = (ColumnDataSource(df), ColumnDataSource(tibet_df))
+    if shared_geometry:
+        sources = tuple(_strip_geometry(source) for source in sources)
+    # With lazy data, the values and colors of each map are a slice
+    # provincial/<prefix>/<kind>, loaded when the map is scrolled into view
+    slices = dict(
+        (column, ('provincial/%s/%s' % tuple(column.rsplit('_', 1)), None))
+        for column in df.columns if column.endswith(('_val', '_color', '_percent'))
+    )
+    _slices.mark(sources[0], 'alpha', slices)
+    return sources
 
 
-def get_df_and_strip_2007(filename, read_props):
-    df = pd.read_csv(filename, **read_props)
-    df = df[df.t != 2007]
-    return df
+def _read(reader, filename, **read_props):
+    _tracking.record_read(filename)
+    if _reads is None:
+        return reader(filename, **read_props)
+    stat = os.stat(filename)
+    key = (filename, repr(sorted(read_props.items())))
+    entry = _reads.get(key)
+    if entry is None or entry[0] != (stat.st_mtime, stat.st_size):
+        entry = _reads[key] = ((stat.st_mtime, stat.st_size), reader(filename, **read_props))
+    # A copy, as the callers may modify the frame
+    return entry[1].copy()
 
 
-def get_df_and_strip_2007_15_20_25(filename, read_props):
-    df = pd.read_csv(filename, **read_props)
-    df = df[(df.t == 2010) | (df.t == 2030)]
-    return df
+def read_csv(filename, **read_props):
+    return _read(pd.read_csv, filename, **read_props)
+
+
+def read_hdf(filename, key):
+    return _read(pd.read_hdf, filename, key=key)
+
+
+def strip_2007(df):
+    return df[df.t != 2007]
 
 
 # Handle specially because of outlier value
@@ -239,8 +436,9 @@ def get_gdp_delta_in_2030_by_province(prefix, df=None):
     legend_vals = pd.Series(np.linspace(dmin, dmax, num=100))
     legend_hex = _normalize_gdp_delta(legend_vals, dmin, dmax)
     legend_data = pd.DataFrame({'vals': legend_vals, 'color': legend_hex}, dtype=str)
-    legend_data['x'] = (legend_data.index / 4) + map_legend_x
+    legend_data['x'] = legend_data.index / 99.0
 
+    round_to_precision(df, key_value, get_significant_digits('GDP_delta'))
     df.loc['XZ', key_value] = 'No Data'
     df.loc['XZ', key_color] = 'white'
     df.loc['SX', key_color] = '#A81625'
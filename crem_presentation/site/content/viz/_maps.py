@@ -1,21 +1,28 @@
 # -*- coding: utf-8 -*- #
+import pandas as pd
 from bokeh.models import HoverTool, Patches, ColumnDataSource, Rect, Text
-from .constants import map_legend_x, map_legend_y
+from cgetools.svg import render_svgs
+
+from .constants import (
+    map_legend_x, map_legend_y, map_legend_width, map_legend_height, map_legend_text_y
+)
 from ._data import (
+    get_map_ranges,
+    read_province_info,
     convert_provincial_dataframe_to_map_datasource,
     get_coal_share_in_2010_by_province,
     get_population_in_2010_by_province,
     get_gdp_delta_in_2030_by_province,
     get_gdp_in_2010_by_province,
-    get_co2_2030_4_vs_bau_change_by_province,
+    get_co2_change_by_province,
     get_2030_pm25_exposure_by_province,
-    get_pm25_2030_4_vs_bau_change_by_province,
+    get_pm25_change_by_province,
 )
 from .__utils import get_map_plot
 
 
-def get_co2_2030_4_vs_bau_change_map(plot_width=600, df=None):
-    df, legend_data = get_co2_2030_4_vs_bau_change_by_province(prefix='co2_change', cmap_name='Oranges', df=df)
+def get_co2_change_map(scenario, baseline, year, plot_width=600, df=None):
+    df, legend_data = get_co2_change_by_province('co2_change', scenario, baseline, year, cmap_name='Oranges', df=df)
     source, tibet_source = convert_provincial_dataframe_to_map_datasource(df)
     m = _get_provincial_map(plot_width, source, tibet_source, legend_data, fill_color='co2_change_color', tooltip_text='Change in CO₂: @co2_change_val{0} Mt (@co2_change_percent{0}%)')
     return (m, df, source)
@@ -28,8 +35,8 @@ def get_col_2010_map(plot_width=600, df=None):
     return (m, df, source)
 
 
-def get_pm25_2030_4_vs_bau_change_map(plot_width=600, df=None):
-    df, legend_data = get_pm25_2030_4_vs_bau_change_by_province(prefix='pm25_change', cmap_name='Greens', df=df)
+def get_pm25_change_map(scenario, baseline, year, plot_width=600, df=None):
+    df, legend_data = get_pm25_change_by_province('pm25_change', scenario, baseline, year, cmap_name='Greens', df=df)
     source, tibet_source = convert_provincial_dataframe_to_map_datasource(df)
     m = _get_provincial_map(plot_width, source, tibet_source, legend_data, fill_color='pm25_change_color', tooltip_text='Change in PM2.5: @pm25_change_val{0.0} μg/m³ (@pm25_change_percent{0}%)')
     return (m, df, source)
@@ -67,7 +74,14 @@ def _get_provincial_map(
     plot_width, source, tibet_source, legend_data, fill_color,
     line_color='black', line_width=0.5, tooltip_text=''
 ):
-    p_map = get_map_plot(plot_width)
+    x_range, y_range = get_map_ranges()
+    p_map = get_map_plot(plot_width, x_range, y_range)
+    width = x_range[1] - x_range[0]
+    height = y_range[1] - y_range[0]
+
+    def to_map(fx, fy):
+        # From fractions of the map's width and height to map coordinates
+        return x_range[0] + fx * width, y_range[0] + fy * height
     provinces = Patches(
         xs='xs',
         ys='ys',
@@ -87,32 +101,42 @@ def _get_provincial_map(
     )
     tr = p_map.add_glyph(tibet_source, tibet)
 
-    # Add legend
+    # Add legend, its x given along it from 0 to 1
+    legend_data = legend_data.copy()
+    legend_data['x'] = to_map(map_legend_x + legend_data['x'] * map_legend_width, 0)[0]
     legend_source = ColumnDataSource(legend_data)
+    legend_source._payload_kind = 'legend'
+    start_x, legend_y = to_map(map_legend_x, map_legend_y)
+    end_x, text_y = to_map(map_legend_x + map_legend_width, map_legend_text_y)
     rect = Rect(
         x='x',
-        y=map_legend_y,
-        height=1,
-        width=0.3,
+        y=legend_y,
+        height=map_legend_height * height,
+        # A little wider than the steps between them, so there are no gaps
+        width=1.2 * map_legend_width * width / 99,
         fill_color='color',
         line_color=None,
     )
     p_map.add_glyph(legend_source, rect)
     # Add start val
     text_start = [legend_data.vals[0][:-2]]
+    text_start_source = ColumnDataSource(
+        dict(x=[start_x], y=[text_y], text=text_start)
+    )
+    text_start_source._payload_kind = 'legend'
     p_map.add_glyph(
-        ColumnDataSource(
-            dict(x=[map_legend_x], y=[map_legend_y - 3.5], text=text_start)
-        ), Text(x='x', y='y', text='text', text_font_size='7pt', text_align='left')
+        text_start_source, Text(x='x', y='y', text='text', text_font_size='7pt', text_align='left')
     )
     # Add end val
     text_end = [legend_data.vals[99][:-2]]  # Note the 99 is dependent on legend having 100 points
     if len(text_end[0]) > 5:
         text_end = [legend_data.vals[99][0:5]]
+    text_end_source = ColumnDataSource(
+        dict(x=[end_x], y=[text_y], text=text_end)
+    )
+    text_end_source._payload_kind = 'legend'
     p_map.add_glyph(
-        ColumnDataSource(
-            dict(x=[map_legend_x + 25], y=[map_legend_y - 3.5], text=text_end)
-        ), Text(x='x', y='y', text='text', text_font_size='8pt', text_align='right')
+        text_end_source, Text(x='x', y='y', text='text', text_font_size='8pt', text_align='right')
     )
 
     # Add hovers
@@ -123,3 +147,28 @@ def _get_provincial_map(
     p_map.add_tools(HoverTool(tooltips=tibet_tooltips, renderers=[tr]))
 
     return p_map
+
+
+def get_map_placeholders(df, fill_colors, plot_width=600):
+    """Static SVGs of the maps, for the plot divs until BokehJS has drawn them.
+
+    fill_colors maps the plot names to their fill color columns in df; the
+    SVGs are returned under the same names.
+    """
+    province_info = read_province_info().set_index('alpha')
+    alphas = [alpha for alpha in df.index if alpha in province_info.index]
+    data = pd.DataFrame(dict(
+        xs=province_info.loc[alphas, 'xs'].values,
+        ys=province_info.loc[alphas, 'ys'].values,
+    ))
+    columns = sorted(set(fill_colors.values()))
+    for column in columns:
+        data[column] = df.loc[alphas, column].values
+    # Pixel precision is plenty for a placeholder. The vizzes are already
+    # rendered in worker processes, so the batch is rendered in this one.
+    x_range, y_range = get_map_ranges()
+    svgs = render_svgs(
+        data, columns, width=plot_width, x_range=x_range, y_range=y_range,
+        precision=0, css_class='map-placeholder', processes=0,
+    )
+    return dict((name, svgs[column]) for name, column in fill_colors.items())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*- #
+# Data loaded on demand, with VIZ_LAZY_DATA. Marked columns of the data
+# sources are left out of the pages and written as JSON slices, one per
+# variable and scenario, named after their content so that browsers can cache
+# them for good. theme/static/js/slices.js fetches a source's slices once one
+# of its plots is scrolled into view, or those of a scenario once it is
+# highlighted.
+import hashlib
+import json
+import math
+
+from . import _tracking
+
+TAG = 'lazy_data'
+
+_enabled = False
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def mark(source, index, slices):
+    """Mark columns of a source to be loaded on demand, when enabled.
+
+    index - the column the slices are aligned on, e.g. 't' or 'alpha'
+    slices - {column: (name, scenario)}: the name of the column's slice, a
+        path such as 'national/4/CO2_emi', and the scenario whose highlight
+        loads it, or None
+    """
+    source._slices = (index, slices)
+    return source
+
+
+def _to_json_list(values):
+    # JSON has no NaN; missing values are null
+    values = values.tolist() if hasattr(values, 'tolist') else list(values)
+    return [None if isinstance(v, float) and math.isnan(v) else v for v in values]
+
+
+def strip(source):
+    """Move the marked columns of a source out to slices.
+
+    The columns are left in place, as long as before, with NaN for numbers
+    and null for text (no fill color). Tags the source with the slice of
+    each column, for slices.js.
+    """
+    if not _enabled or not hasattr(source, '_slices'):
+        return
+    index_column, slices = source._slices
+    index = _to_json_list(source.data[index_column])
+    entries = {}
+    for column, (name, scenario) in sorted(slices.items()):
+        values = _to_json_list(source.data[column])
+        text = json.dumps(dict(index=index, values=values), separators=(',', ':'))
+        path = '%s.%s.json' % (name, hashlib.sha1(text.encode('utf-8')).hexdigest()[:12])
+        _tracking.record_slice(path, text)
+        _tracking.record_bytes_saved('lazy', len(json.dumps(values)))
+        numeric = all(v is None or isinstance(v, (int, float)) for v in values)
+        source.data[column] = [float('nan') if numeric else None] * len(values)
+        entries[column] = [path, scenario]
+    source.tags = list(source.tags) + [TAG, dict(index=index_column, slices=entries)]
+    del source._slices
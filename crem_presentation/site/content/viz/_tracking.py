@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*- #
+# Book-keeping of the viz currently being rendered: the files it reads from
+# disk, the Bokeh documents it embeds, the bytes kept out of its page and the
+# data slices it leaves to be loaded on demand (see _slices). The
+# pelican plugin resets it before each render and collects the report after.
+from copy import deepcopy
+
+_report = {}
+
+
+def reset():
+    _report.clear()
+    _report.update(reads=[], csv_reads=0, bytes_saved={}, models=0, script_bytes=0, payload={},
+                   slices={})
+
+
+def record_read(filename):
+    if filename.endswith('.csv'):
+        _report['csv_reads'] += 1
+    if filename not in _report['reads']:
+        _report['reads'].append(filename)
+
+
+def record_bytes_saved(kind, n_bytes):
+    saved = _report['bytes_saved']
+    saved[kind] = saved.get(kind, 0) + n_bytes
+
+
+def record_slice(path, text):
+    _report['slices'][path] = text
+
+
+def record_components(n_models, script, payload):
+    _report['models'] += n_models
+    _report['script_bytes'] += len(script.encode('utf-8'))
+    for kind, n_bytes in payload.items():
+        _report['payload'][kind] = _report['payload'].get(kind, 0) + n_bytes
+
+
+def get_report():
+    return deepcopy(_report)
+
+
+reset()
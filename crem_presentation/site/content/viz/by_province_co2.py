@@ -1,14 +1,13 @@
 # -*- coding: utf-8 -*- #
-from bokeh.embed import components
 from bokeh.models import Patches
 
-from ._maps import get_co2_2030_4_vs_bau_change_map, get_col_2010_map
-from .__utils import env
+from ._maps import get_co2_change_map, get_col_2010_map, get_map_placeholders
+from .__utils import components, env
 
 from os.path import join
 
 def render():
-    co2_map, df, _ = get_co2_2030_4_vs_bau_change_map()
+    co2_map, df, _ = get_co2_change_map('4', 'bau', 2030)
     col_map, df, source = get_col_2010_map(df=df)
 
     # Optimize the data sources
@@ -17,6 +16,8 @@ def render():
             gr.data_source = source
             break
 
+    placeholders = get_map_placeholders(df, dict(co2_map='co2_change_color', col_map='col_2010_color'))
+
     template = env.get_template('by_province_co2.html')
     script, div = components(dict(co2_map=co2_map, col_map=col_map), wrap_plot_info=False)
-    return template.render(plot_script=script, plot_div=div)
+    return template.render(plot_script=script, plot_div=div, placeholders=placeholders)
@@ -1,16 +1,16 @@
 # -*- coding: utf-8 -*- #
-from bokeh.embed import components
 from bokeh.models import Patches
 
 from ._maps import (
     get_provincial_pop_2010_map,
     get_col_2010_map,
     get_gdp_2010_map,
-    get_co2_2030_4_vs_bau_change_map,
-    get_pm25_2030_4_vs_bau_change_map,
+    get_co2_change_map,
+    get_pm25_change_map,
     get_gdp_delta_in_2030_map,
+    get_map_placeholders,
 )
-from .__utils import env
+from .__utils import components, env
 
 from os.path import join
 
@@ -18,8 +18,8 @@ def render():
     pop_map, df, _ = get_provincial_pop_2010_map()
     col_map, df, _ = get_col_2010_map(df=df)
     gdp_map, df, _ = get_gdp_2010_map(df=df)
-    co2_delta_map, df, _ = get_co2_2030_4_vs_bau_change_map(df=df)
-    exp_delta_map, df, _ = get_pm25_2030_4_vs_bau_change_map(df=df)
+    co2_delta_map, df, _ = get_co2_change_map('4', 'bau', 2030, df=df)
+    exp_delta_map, df, _ = get_pm25_change_map('4', 'bau', 2030, df=df)
     gdp_delta_map, df, source = get_gdp_delta_in_2030_map(df=df)
 
     # Optimize the data sources
@@ -29,6 +29,15 @@ def render():
                 gr.data_source = source
                 break
 
+    placeholders = get_map_placeholders(df, dict(
+        pop_map='pop_2010_color',
+        col_map='col_2010_color',
+        gdp_map='gdp_2010_color',
+        co2_delta_map='co2_change_color',
+        exp_delta_map='pm25_change_color',
+        gdp_delta_map='gdpdelta_change_color',
+    ))
+
     template = env.get_template('by_province_comparison.html')
     script, div = components(
         dict(
@@ -41,4 +50,4 @@ def render():
         ),
         wrap_plot_info=False
     )
-    return template.render(plot_script=script, plot_div=div)
+    return template.render(plot_script=script, plot_div=div, placeholders=placeholders)
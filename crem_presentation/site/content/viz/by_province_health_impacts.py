@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*- #
-from bokeh.embed import components
 from bokeh.models import Patches
 
 from ._maps import (
-    get_pm25_2030_4_vs_bau_change_map,
+    get_pm25_change_map,
     get_2030_pm25_exposure_map,
+    get_map_placeholders,
 )
-from .__utils import env
+from .__utils import components, env
 
 from os.path import join
 
 def render():
-    pm25_map, df, _ = get_pm25_2030_4_vs_bau_change_map()
+    pm25_map, df, _ = get_pm25_change_map('4', 'bau', 2030)
     exposure_map, df, source = get_2030_pm25_exposure_map(df=df)
 
     # Optimize the data sources
@@ -20,9 +20,13 @@ def render():
             gr.data_source = source
             break
 
+    placeholders = get_map_placeholders(
+        df, dict(pm25_map='pm25_change_color', exposure_map='pm25exposure_2030_color')
+    )
+
     template = env.get_template('by_province_health_impacts.html')
     script, div = components(
         dict(pm25_map=pm25_map, exposure_map=exposure_map),
         wrap_plot_info=False
     )
-    return template.render(plot_script=script, plot_div=div)
+    return template.render(plot_script=script, plot_div=div, placeholders=placeholders)
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*- #
+from cgetools.aggregate import MACRO_REGIONS
+
 from .constants_styling import *
 
 scenarios = ['three', 'four', 'five', 'bau']
@@ -25,42 +27,8 @@ scenarios_colors = {
     'bau': grey
 }
 
-west = 'West'
-center = 'Center'
-east = 'East'
-
-provinces = {
-    'BJ': east,
-    'TJ': east,
-    'HE': center,
-    'SX': center,
-    'NM': center,
-    'LN': center,
-    'JL': center,
-    'HL': center,
-    'SH': east,
-    'JS': east,
-    'ZJ': east,
-    'AH': center,
-    'FJ': east,
-    'JX': center,
-    'SD': east,
-    'HA': center,
-    'HB': center,
-    'HN': center,
-    'GD': east,
-    'GX': center,
-    'HI': east,
-    'CQ': center,
-    'SC': center,
-    'GZ': center,
-    'YN': west,
-    'SN': west,
-    'GS': west,
-    'QH': west,
-    'NX': west,
-    'XJ': west,
-}
+# Province alpha codes, by East/Center/West
+provinces = MACRO_REGIONS
 
 energy_mix_columns = {
     'OIL_energy': 'Oil',
@@ -69,5 +37,13 @@ energy_mix_columns = {
     'energy_nonfossil': 'Non-fossil',
 }
 
-map_legend_x = 73
-map_legend_y = 53.5
+# Maps are drawn in this projection (see cgetools.projection), and their
+# ranges fit the projected provinces
+map_projection = 'albers'
+# Legend position and size, as fractions of the map's width and height from
+# its bottom left: the north west of the map is empty
+map_legend_x = 0.0
+map_legend_y = 0.975
+map_legend_width = 0.4
+map_legend_height = 0.025
+map_legend_text_y = 0.92
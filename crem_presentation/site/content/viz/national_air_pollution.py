@@ -1,10 +1,8 @@
 # -*- coding: utf-8 -*- #
-from bokeh.embed import components
-from bokeh.models import CustomJS, TextInput
-
-from .constants import scenarios
-from ._charts import get_pm25_national_plot, get_co2_national_plot
-from .__utils import get_js_array, env
+from ._charts import (
+    get_national_source, get_pm25_national_plot, get_co2_national_plot, get_scenario_highlighter
+)
+from .__utils import components, env
 
 
 def render():
@@ -25,38 +23,13 @@ def render():
 def get():
     plot_width = 900
     end_factor = 5
-    ap_plot, ap_line_renderers = get_pm25_national_plot(plot_width=plot_width,
+    source = get_national_source(['CO2_emi', 'PM25_exposure'])
+    ap_plot, ap_line_renderers = get_pm25_national_plot(source, plot_width=plot_width,
                                                         end_factor=end_factor)
-    co2_plot, co2_line_renderers = get_co2_national_plot(plot_width=plot_width,
+    co2_plot, co2_line_renderers = get_co2_national_plot(source, plot_width=plot_width,
                                                          end_factor=end_factor)
-    prefixed_line_renderers = {}
-    for key in scenarios:
-        prefixed_line_renderers['ap_%s' % key] = ap_line_renderers[key]
-        prefixed_line_renderers['co2_%s' % key] = co2_line_renderers[key]
-
-    line_array = get_js_array(prefixed_line_renderers.keys())
-    code = '''
-        var lines = %s,
-            value = cb_obj.get('value'),
-            highlight,
-            glyph;
-
-        value = value.replace(/(,$)/g, '');
-        highlight = value.split(',');
-        Bokeh.$.each(lines, function(key, line) {
-            glyph = line.get('glyph');
-            glyph.set('line_alpha', 0.1);
-        });
-        Bokeh.$.each(highlight, function(i, key) {
-            function set_alpha(line) {
-                glyph = line.get('glyph');
-                glyph.set('line_alpha', 0.8);
-            }
-            set_alpha(lines['ap_' + key]);
-            set_alpha(lines['co2_' + key]);
-        });
-    ''' % line_array
-
-    callback = CustomJS(code=code, args=prefixed_line_renderers)
-    text = TextInput(callback=callback)
+    text = get_scenario_highlighter([
+        (ap_plot, ap_line_renderers, None),
+        (co2_plot, co2_line_renderers, None),
+    ])
     return (co2_plot, ap_plot, text)
@@ -1,18 +1,17 @@
 # -*- coding: utf-8 -*- #
-from bokeh.embed import components
 
-from ._data import get_energy_mix_for_all_scenarios
-from ._charts import get_energy_mix_by_scenario, get_nonfossil
-from .__utils import env
+from .constants import energy_mix_columns
+from ._charts import get_national_source, get_energy_mix_by_scenario, get_nonfossil
+from .__utils import components, env
 
 from os.path import join
 
 def render():
-    df = get_energy_mix_for_all_scenarios()
-    three = get_energy_mix_by_scenario(df, 'three')
-    four = get_energy_mix_by_scenario(df, 'four')
-    five = get_energy_mix_by_scenario(df, 'five')
-    nonfossil, _ = get_nonfossil(include_bau=True, end_factor=15)
+    source = get_national_source(list(energy_mix_columns) + ['energy_nonfossil_share'])
+    three = get_energy_mix_by_scenario(source, 'three')
+    four = get_energy_mix_by_scenario(source, 'four')
+    five = get_energy_mix_by_scenario(source, 'five')
+    nonfossil, _ = get_nonfossil(source, include_bau=True, end_factor=15)
     template = env.get_template('national_energy_mix.html')
     script, div = components(
         dict(three=three, four=four, five=five, nonfossil=nonfossil),
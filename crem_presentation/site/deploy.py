@@ -0,0 +1,300 @@
+"""Incremental, content-addressed publishing of the built site.
+
+The target keeps a manifest of the content hash of every file published.
+A deploy hashes the output directory (in parallel threads), compares it with
+the manifest of the last deploy, and transfers only the files that changed,
+in batches. Assets go first, then the pages, so that a page is never live
+before the assets it refers to; files gone from the output are deleted last,
+once no published page refers to them.
+
+    python deploy.py output /var/www/site                   # local directory
+    python deploy.py output user@host:/var/www/site --port 22
+
+A local directory target stands in for the server when testing. --full
+sends every file, whatever the manifest says, e.g. after the server's files
+were changed by other means; the files gone from the output are still
+deleted. --dry-run prints the plan only.
+
+Works with Python 2 too, so that fabfile.py can import it.
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from shlex import quote
+except ImportError:  # Python 2
+    from pipes import quote
+
+# Kept on the target, next to the published files
+MANIFEST = '.deploy-manifest.json'
+
+# Files transferred per rsync run or copied between progress lines
+BATCH_SIZE = 200
+
+# Pages and the server configuration are switched after the assets
+PAGE_SUFFIXES = ('.html', '.html.gz', '.html.br', '.htaccess')
+
+IGNORED = ('.DS_Store', MANIFEST)
+
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def walk(root):
+    "Files under root, as '/' separated relative paths."
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename in IGNORED:
+                continue
+            path = os.path.relpath(os.path.join(dirpath, filename), root)
+            yield path.replace(os.sep, '/')
+
+
+def hash_tree(root, threads=None):
+    """{path: SHA-1} of the files under root.
+
+    hashlib releases the GIL on large buffers, so threads hash in parallel.
+    """
+    paths = list(walk(root))
+    # One thread per CPU by default
+    pool = ThreadPool(threads)
+    try:
+        digests = pool.map(lambda path: file_digest(os.path.join(root, path)), paths)
+    finally:
+        pool.close()
+    return dict(zip(paths, digests))
+
+
+def is_page(path):
+    return path.endswith(PAGE_SUFFIXES)
+
+
+class Plan(object):
+    """The files a deploy transfers and deletes, from the hashes of the
+    output and of the last deploy.
+
+    full - transfer every file, changed or not
+    """
+
+    def __init__(self, hashes, published, full=False):
+        changed = sorted(path for path, digest in hashes.items()
+                         if full or published.get(path) != digest)
+        self.assets = [path for path in changed if not is_page(path)]
+        self.pages = [path for path in changed if is_page(path)]
+        self.removed = sorted(set(published) - set(hashes))
+        self.unchanged = len(hashes) - len(changed)
+
+    def __bool__(self):
+        return bool(self.assets or self.pages or self.removed)
+
+    __nonzero__ = __bool__
+
+
+def batches(paths, size):
+    for start in range(0, len(paths), size):
+        yield paths[start:start + size]
+
+
+class LocalTarget(object):
+    """A directory on this machine, e.g. to test a deploy."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def read_manifest(self):
+        try:
+            with io.open(os.path.join(self.path, MANIFEST), encoding='utf-8') as f:
+                return json.load(f)['files']
+        except (IOError, OSError, ValueError, KeyError):
+            return {}
+
+    def write_manifest(self, files):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        _write_atomically(os.path.join(self.path, MANIFEST), _manifest_bytes(files))
+
+    def upload(self, root, paths):
+        for path in paths:
+            destination = os.path.join(self.path, *path.split('/'))
+            directory = os.path.dirname(destination)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # Readers of the target see the old file or the new one, never
+            # part of it
+            shutil.copy2(os.path.join(root, path), destination + '.tmp')
+            _replace(destination + '.tmp', destination)
+
+    def remove(self, paths):
+        for path in paths:
+            destination = os.path.join(self.path, *path.split('/'))
+            if os.path.exists(destination):
+                os.remove(destination)
+            # Prune the directories left empty
+            directory = os.path.dirname(destination)
+            while directory != self.path.rstrip(os.sep) and os.path.isdir(directory) \
+                    and not os.listdir(directory):
+                os.rmdir(directory)
+                directory = os.path.dirname(directory)
+
+
+class RsyncTarget(object):
+    """A directory on a server, reached with rsync and ssh.
+
+    host - e.g. 'user@host'
+    ssh_options - more options for ssh, e.g. ['-o', 'GSSAPIDelegateCredentials yes']
+    """
+
+    def __init__(self, host, path, port=None, ssh_options=()):
+        self.host = host
+        self.path = path.rstrip('/')
+        self.ssh = ['ssh'] + (['-p', str(port)] if port else []) + list(ssh_options)
+
+    def __str__(self):
+        return '%s:%s' % (self.host, self.path)
+
+    def _remote(self, command, data=None):
+        process = subprocess.Popen(self.ssh + [self.host, command], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
+        out, _ = process.communicate(data)
+        return process.returncode, out
+
+    def read_manifest(self):
+        status, out = self._remote('cat %s' % quote(self.path + '/' + MANIFEST))
+        if status != 0:
+            return {}
+        try:
+            return json.loads(out.decode('utf-8'))['files']
+        except (ValueError, KeyError):
+            return {}
+
+    def write_manifest(self, files):
+        manifest = quote(self.path + '/' + MANIFEST)
+        status, _ = self._remote('mkdir -p %s && cat > %s.tmp && mv %s.tmp %s' % (
+            quote(self.path), manifest, manifest, manifest), _manifest_bytes(files))
+        if status != 0:
+            raise RuntimeError('Could not write the manifest to %s' % self)
+
+    def upload(self, root, paths):
+        # --ignore-times: the listed files changed, whatever their size and
+        # mtime; rsync still sends only the changed blocks
+        process = subprocess.Popen(
+            ['rsync', '--archive', '--compress', '--ignore-times', '--files-from=-',
+             '--rsh', ' '.join(quote(arg) for arg in self.ssh),
+             root.rstrip('/') + '/', '%s:%s/' % (self.host, self.path)],
+            stdin=subprocess.PIPE)
+        process.communicate(''.join(path + '\n' for path in paths).encode('utf-8'))
+        if process.returncode != 0:
+            raise RuntimeError('rsync to %s failed with status %d' % (self, process.returncode))
+
+    def remove(self, paths):
+        status, _ = self._remote('cd %s && xargs -0 rm -f --' % quote(self.path),
+                                 b'\0'.join(path.encode('utf-8') for path in paths))
+        if status != 0:
+            raise RuntimeError('Could not delete files on %s' % self)
+
+
+def _manifest_bytes(files):
+    text = json.dumps(dict(files=files, published=time.time()), indent=0, sort_keys=True)
+    return text.encode('utf-8')
+
+
+def _replace(source, destination):
+    try:
+        os.replace(source, destination)
+    except AttributeError:  # Python 2
+        if os.name == 'nt' and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def _write_atomically(path, data):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    _replace(path + '.tmp', path)
+
+
+def parse_target(spec, port=None, ssh_options=()):
+    "A LocalTarget, or an RsyncTarget for specs like 'user@host:/path'."
+    host, sep, path = spec.partition(':')
+    # 'C:\...' is a local path on Windows
+    if sep and len(host) > 1 and '/' not in host and '\\' not in host:
+        return RsyncTarget(host, path, port, ssh_options)
+    return LocalTarget(spec)
+
+
+def deploy(root, target, full=False, batch_size=BATCH_SIZE, threads=None, dry_run=False):
+    """Publish the files under root to the target; return the Plan.
+
+    full - send every file, not only those changed since the last deploy
+    """
+    start = time.time()
+    hashes = hash_tree(root, threads)
+    # Read even for a full deploy: the files it lists and the output no
+    # longer has are deleted
+    published = target.read_manifest()
+    plan = Plan(hashes, published, full)
+    size = sum(os.path.getsize(os.path.join(root, path)) for path in plan.assets + plan.pages)
+    print('%d files to send (%.1f MB), %d to delete, %d unchanged; hashed in %.1f s' % (
+        len(plan.assets) + len(plan.pages), size / 2.0 ** 20, len(plan.removed), plan.unchanged,
+        time.time() - start))
+    if dry_run:
+        for label, paths in (('send', plan.assets + plan.pages), ('delete', plan.removed)):
+            for path in paths:
+                print('  %s %s' % (label, path))
+        return plan
+    if not plan and published:
+        return plan
+
+    # The manifest records what was published, even if a step fails midway,
+    # so that the next deploy resumes from there
+    state = dict(published)
+    try:
+        for phase, paths in (('assets', plan.assets), ('pages', plan.pages)):
+            done = 0
+            for batch in batches(paths, batch_size):
+                target.upload(root, batch)
+                state.update((path, hashes[path]) for path in batch)
+                done += len(batch)
+                print('  %s: %d/%d' % (phase, done, len(paths)))
+        for batch in batches(plan.removed, batch_size):
+            target.remove(batch)
+            for path in batch:
+                state.pop(path, None)
+    finally:
+        target.write_manifest(state)
+    print('Published to %s in %.1f s' % (target, time.time() - start))
+    return plan
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish the changed files of the built site.')
+    parser.add_argument('root', help='output directory of the site')
+    parser.add_argument('target', help='local directory, or user@host:/path')
+    parser.add_argument('--port', type=int, help='ssh port of the server')
+    parser.add_argument('--ssh-option', action='append', default=[], metavar='OPTION',
+                        help="option for ssh -o, e.g. 'GSSAPIDelegateCredentials yes'")
+    parser.add_argument('--full', action='store_true', help='send every file')
+    parser.add_argument('--dry-run', action='store_true', help='print the plan only')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--threads', type=int, help='hashing threads (default: one per CPU)')
+    args = parser.parse_args()
+    ssh_options = [arg for option in args.ssh_option for arg in ('-o', option)]
+    deploy(args.root, parse_target(args.target, args.port, ssh_options), full=args.full,
+           batch_size=args.batch_size, threads=args.threads, dry_run=args.dry_run)
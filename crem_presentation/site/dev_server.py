@@ -0,0 +1,312 @@
+"""A warm development worker: rebuilds the site as its sources change, and
+reloads the pages in the browser.
+
+Unlike `pelican -r`, pelican runs in this one long-lived process
+(VIZ_PROCESSES = 0), so bokeh, pandas and matplotlib are imported once, the
+data files read are kept in memory while unchanged (_data.memoize_reads),
+and the rendered vizzes are kept from one build to the next
+(VIZ_KEEP_RENDERS). On a change, only the vizzes it affects are rendered
+again:
+
+- a module under content/viz: it and the modules importing it are reloaded,
+  and the vizzes using any of them re-rendered;
+- a template under theme/templates/viz: the vizzes using it, or a template
+  including it;
+- a module of cgetools: every loaded cgetools and viz module is reloaded,
+  and every viz re-rendered;
+- a data file: the vizzes that read it, from their render reports.
+
+Other changes, e.g. to the pages or the theme, only rebuild the pages. The
+output is served as by preview_server.py, and the open pages reload once the
+build is written (LIVE_RELOAD). Changes to pelicanconf.py or the plugins
+need a restart.
+
+Usage: python dev_server.py [port]
+"""
+import argparse
+import ast
+import importlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+from pelican import Pelican
+from pelican.log import init as init_logging
+from pelican.settings import read_settings
+
+import preview_server
+
+logger = logging.getLogger(__name__)
+
+VIZ_PACKAGE = 'content.viz'
+VIZ_DIR = os.path.join('content', 'viz')
+VIZ_TEMPLATES_DIR = os.path.join('theme', 'templates', 'viz')
+CGETOOLS_DIR = os.path.join('..', '..', 'cgetools')
+RESTART_FILES = ('pelicanconf.py', 'plugins')
+
+# Seconds between scans of the watched files
+POLL_INTERVAL = 0.5
+# Editor swap files, caches and the like
+IGNORED = re.compile(r'(__pycache__|\.pyc$|\.tmp$|\.swp$|~$|\.proj\.npz$|^\.#)')
+
+TEMPLATE_NAME = re.compile(r'get_template\(\s*[\'"]([^\'"]+)[\'"]')
+TEMPLATE_INCLUDE = re.compile(r'{%-?\s*(?:include|extends|import|from)\s+[\'"]([^\'"]+)[\'"]')
+
+
+def scan(roots):
+    "{absolute path: (mtime, size)} of the files under the roots."
+    files = {}
+    for root in roots:
+        if os.path.isfile(root):
+            stat = os.stat(root)
+            files[os.path.abspath(root)] = (stat.st_mtime, stat.st_size)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not IGNORED.search(d)]
+            for filename in filenames:
+                if IGNORED.search(filename):
+                    continue
+                path = os.path.abspath(os.path.join(dirpath, filename))
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # removed since listed
+                files[path] = (stat.st_mtime, stat.st_size)
+    return files
+
+
+def changes(before, after):
+    return set(path for path in set(before) | set(after) if before.get(path) != after.get(path))
+
+
+def is_under(path, directory):
+    return path.startswith(os.path.abspath(directory) + os.sep)
+
+
+class VizSources(object):
+    """The modules and templates each viz depends on, from the sources.
+
+    The viz modules import each other relatively (from ._data import ...);
+    content/viz/__init__.py names the module of each viz, and each module
+    names its template.
+    """
+
+    def __init__(self):
+        self.imports = {}
+        self.templates = {}
+        for filename in os.listdir(VIZ_DIR):
+            if filename.endswith('.py'):
+                module = filename[:-3]
+                with open(os.path.join(VIZ_DIR, filename), encoding='utf-8') as f:
+                    source = f.read()
+                self.imports[module] = self._sibling_imports(source, filename)
+                self.templates[module] = set(TEMPLATE_NAME.findall(source))
+        self.includes = {}
+        for filename in os.listdir(VIZ_TEMPLATES_DIR):
+            with open(os.path.join(VIZ_TEMPLATES_DIR, filename), encoding='utf-8') as f:
+                self.includes[filename] = set(TEMPLATE_INCLUDE.findall(f.read()))
+        # The module of each viz, from the render_<viz> functions
+        self.vizzes = {}
+        with open(os.path.join(VIZ_DIR, '__init__.py'), encoding='utf-8') as f:
+            for node in ast.parse(f.read()).body:
+                if isinstance(node, ast.FunctionDef) and node.name.startswith('render_'):
+                    modules = self._sibling_imports(node, '__init__.py')
+                    self.vizzes[node.name[len('render_'):]] = modules
+
+    @staticmethod
+    def _sibling_imports(source, filename):
+        tree = ast.parse(source, filename) if isinstance(source, str) else source
+        modules = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.level == 1:
+                if node.module:
+                    modules.add(node.module.split('.')[0])
+                else:
+                    modules.update(alias.name for alias in node.names)
+        return modules
+
+    def closure(self, modules):
+        "The modules and all they import, directly or not."
+        seen = set()
+        stack = list(modules)
+        while stack:
+            module = stack.pop()
+            if module not in seen:
+                seen.add(module)
+                stack.extend(self.imports.get(module, ()))
+        return seen
+
+    def template_closure(self, templates):
+        seen = set()
+        stack = list(templates)
+        while stack:
+            template = stack.pop()
+            if template not in seen:
+                seen.add(template)
+                stack.extend(self.includes.get(template, ()))
+        return seen
+
+    def dependents(self, modules):
+        "The modules importing any of these, directly or not, and these."
+        return set(module for module in self.imports if self.closure([module]) & set(modules))
+
+    def load_order(self, modules):
+        "The modules, each after those it imports."
+        order = []
+
+        def visit(module, path):
+            if module in order or module in path:
+                return
+            for imported in sorted(self.imports.get(module, ())):
+                visit(imported, path | set([module]))
+            order.append(module)
+
+        for module in sorted(self.imports):
+            visit(module, set())
+        return [module for module in order if module in modules]
+
+    def vizzes_using_modules(self, modules):
+        return set(viz for viz, entry in self.vizzes.items() if self.closure(entry) & set(modules))
+
+    def vizzes_using_templates(self, templates):
+        vizzes = set()
+        for viz, entry in self.vizzes.items():
+            used = set()
+            for module in self.closure(entry):
+                used |= self.templates.get(module, set())
+            if self.template_closure(used) & set(templates):
+                vizzes.add(viz)
+        return vizzes
+
+
+class DevServer(object):
+    """Pelican and the preview server in one process, rebuilding on change.
+
+    settings_file - pelican settings; VIZ_PROCESSES, VIZ_KEEP_RENDERS and
+        LIVE_RELOAD are set for development
+    """
+
+    def __init__(self, settings_file='pelicanconf.py', port=preview_server.PORT):
+        self.settings = read_settings(settings_file, override=dict(
+            VIZ_PROCESSES=0, VIZ_KEEP_RENDERS=True, LIVE_RELOAD=True))
+        self.pelican = Pelican(self.settings)
+        # Imported by pelican, from PLUGIN_PATHS
+        import viz_renderer
+        from content.viz import _data
+        self.viz_renderer = viz_renderer
+        self._data = _data
+        _data.memoize_reads()
+        self.server = preview_server.PreviewServer(('', port), preview_server.PreviewRequestHandler,
+                                                   self.settings['OUTPUT_PATH'])
+        self.roots = ['content', 'theme', CGETOOLS_DIR, _data.DATA_DIR] + list(RESTART_FILES)
+        # Set once a file needing a restart changed: the code running is
+        # stale from then on, and its renders are not cached on disk
+        self.restart_needed = False
+
+    def build(self):
+        start = time.time()
+        try:
+            self.pelican.run()
+        except Exception:
+            logger.error('Build failed:\n%s', traceback.format_exc())
+            return False
+        logger.info('Built in %.1f s', time.time() - start)
+        return True
+
+    def reload_modules(self, modules):
+        "Reload the viz modules, each after those it imports."
+        for module in VizSources().load_order(modules):
+            name = '%s.%s' % (VIZ_PACKAGE, module)
+            if name in sys.modules:
+                importlib.reload(sys.modules[name])
+
+    def apply(self, changed):
+        """Reload the modules and forget the renders affected by the changed
+        files; return the vizzes to render again."""
+        sources = VizSources()
+        all_modules = set(sources.imports)
+        forget = set()
+        modules = set()
+        templates = set()
+        cgetools_changed = []
+        others = set()
+        for path in changed:
+            if any(path == os.path.abspath(f) or is_under(path, f) for f in RESTART_FILES):
+                logger.warning('%s changed; restart dev_server.py to use it', os.path.relpath(path))
+                self.restart_needed = True
+            elif is_under(path, VIZ_DIR) and path.endswith('.py'):
+                modules.add(os.path.basename(path)[:-3])
+            elif is_under(path, VIZ_TEMPLATES_DIR):
+                templates.add(os.path.basename(path))
+            elif is_under(path, CGETOOLS_DIR) and path.endswith('.py'):
+                cgetools_changed.append('cgetools.' + os.path.basename(path)[:-3])
+            else:
+                # Data files, or pages and theme files that no viz reads
+                others.add(path)
+
+        if cgetools_changed:
+            # The changed modules first, then those that may import them
+            loaded = sorted(name for name in sys.modules if name.startswith('cgetools.'))
+            for name in cgetools_changed + [name for name in loaded if name not in cgetools_changed]:
+                if name in sys.modules:
+                    importlib.reload(sys.modules[name])
+            modules = all_modules
+        if '__init__' in modules:
+            importlib.reload(sys.modules[VIZ_PACKAGE])
+            modules = all_modules
+        if modules:
+            modules = sources.dependents(modules)
+            self.reload_modules(modules)
+            forget |= sources.vizzes_using_modules(modules)
+            if not self.restart_needed:
+                self.viz_renderer.sources_reloaded()
+        if templates:
+            forget |= sources.vizzes_using_templates(templates)
+        for viz, reads in self.viz_renderer.kept_reads().items():
+            if set(os.path.abspath(f) for f in reads) & others:
+                forget.add(viz)
+        if others & set(os.path.abspath(f) for reads in self.viz_renderer.kept_reads().values()
+                        for f in reads):
+            self._data.clear_caches()
+        self.viz_renderer.forget(forget)
+        return forget
+
+    def serve(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info('Serving %s on port %d', self.server.root, self.server.server_address[1])
+        files = scan(self.roots)
+        self.build()
+        while True:
+            time.sleep(POLL_INTERVAL)
+            current = scan(self.roots)
+            changed = changes(files, current)
+            if not changed:
+                continue
+            files = current
+            try:
+                vizzes = self.apply(changed)
+            except Exception:
+                logger.error('Could not reload the changed modules:\n%s', traceback.format_exc())
+                continue
+            logger.info('%d files changed; rendering %s', len(changed), ', '.join(sorted(vizzes)) or 'no viz')
+            if self.build():
+                self.server.notify_reload()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the site as it changes, and serve it.')
+    parser.add_argument('port', nargs='?', type=int, default=preview_server.PORT)
+    parser.add_argument('--settings', default='pelicanconf.py')
+    args = parser.parse_args()
+    init_logging(logging.INFO)
+    server = DevServer(args.settings, args.port)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        server.server.server_close()
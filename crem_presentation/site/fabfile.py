@@ -1,11 +1,9 @@
 from fabric.api import *
-import fabric.contrib.project as project
 import os
 import shutil
-import sys
-import SocketServer
 
-from pelican.server import ComplexHTTPRequestHandler
+import deploy
+import preview_server
 
 # Local path configuration (can be absolute or relative to fabfile)
 env.deploy_path = 'output'
@@ -26,12 +24,20 @@ env.github_pages_branch = "gh-pages"
 # Port for `serve`
 PORT = 8000
 
+# Rendered viz cache, as set by VIZ_CACHE_PATH in pelicanconf.py
+env.viz_cache_path = 'cache/viz'
+
 def clean():
     """Remove generated files"""
     if os.path.isdir(DEPLOY_PATH):
         shutil.rmtree(DEPLOY_PATH)
         os.makedirs(DEPLOY_PATH)
 
+def purge_viz_cache():
+    """Remove the cached viz renders, so the next build renders them all"""
+    if os.path.isdir(env.viz_cache_path):
+        shutil.rmtree(env.viz_cache_path)
+
 def build():
     """Build local version of site"""
     local('pelican -s pelicanconf.py')
@@ -45,17 +51,13 @@ def regenerate():
     """Automatically regenerate site upon file modification"""
     local('pelican -r -s pelicanconf.py')
 
+def develop():
+    """Serve the site, rebuilding only what changed and reloading the browser"""
+    local('python3 dev_server.py {}'.format(PORT))
+
 def serve():
     """Serve site at http://localhost:8000/"""
-    os.chdir(env.deploy_path)
-
-    class AddressReuseTCPServer(SocketServer.TCPServer):
-        allow_reuse_address = True
-
-    server = AddressReuseTCPServer(('', PORT), ComplexHTTPRequestHandler)
-
-    sys.stderr.write('Serving on port {0} ...\n'.format(PORT))
-    server.serve_forever()
+    preview_server.serve(env.deploy_path, PORT)
 
 def reserve():
     """`build`, then `serve`"""
@@ -75,17 +77,21 @@ def cf_upload():
               '-K {cloudfiles_api_key} '
               'upload -c {cloudfiles_container} .'.format(**env))
 
+def _flag(value):
+    # Task arguments arrive as strings, e.g. `fab publish:full=yes`
+    return str(value).lower() in ('1', 'true', 'yes')
+
 @hosts(production)
-def publish():
-    """Publish to production via rsync"""
+def publish(full=False):
+    """Publish the files changed since the last deploy to production"""
+    local('pelican -s publishconf.py')
+    target = deploy.RsyncTarget('{user}@{host}'.format(**env), dest_path, port=env.port)
+    deploy.deploy(DEPLOY_PATH, target, full=_flag(full))
+
+def publish_local(path, full=False):
+    """Publish the changed files to a local directory, as to the server"""
     local('pelican -s publishconf.py')
-    project.rsync_project(
-        remote_dir=dest_path,
-        exclude=".DS_Store",
-        local_dir=DEPLOY_PATH.rstrip('/') + '/',
-        delete=True,
-        extra_opts='-c',
-    )
+    deploy.deploy(DEPLOY_PATH, deploy.LocalTarget(path), full=_flag(full))
 
 def gh_pages():
     """Publish to GitHub Pages"""
@@ -18,4 +18,56 @@ DEFAULT_LANG = 'en'
 THEME = 'theme'
 
 PLUGIN_PATHS = ['plugins']
+# viz_renderer also runs the asset_pipeline plugin, once it has written its
+# own assets, so that those are fingerprinted and compressed too.
 PLUGINS = ['viz_renderer']
+
+# Number of worker processes used to pre-render the vizzes; None uses one per
+# CPU and 0 renders them one after another in the pelican process.
+VIZ_PROCESSES = None
+
+# Rendered vizzes are cached here between builds; set to None to always render.
+# Purge with `fab purge_viz_cache` or `make purge_viz_cache`.
+VIZ_CACHE_PATH = 'cache/viz'
+
+# Read the model data from a results warehouse (see cgetools.warehouse) as
+# (path, run), e.g. ('../../../cecp-cop21-data/warehouse.sqlite', '2015-11');
+# None reads the CSV files.
+VIZ_WAREHOUSE = None
+
+# Leave the values of the charts and maps out of the pages, as JSON slices per
+# variable and scenario that the browser fetches as the plots are scrolled
+# into view or scenarios highlighted (see content/viz/_slices.py).
+VIZ_LAZY_DATA = False
+# Where the slices are fetched from; None for those written to
+# theme/data/slices in the output. Any server of that directory does, e.g.
+# `python preview_server.py 8001 --root output/theme/data/slices` with
+# VIZ_DATA_URL = 'http://localhost:8001'.
+VIZ_DATA_URL = None
+
+# Keep the rendered vizzes in memory from one pelican run to the next, until
+# their sources or data change; set by dev_server.py.
+VIZ_KEEP_RENDERS = False
+# Reload the pages in the browser once rebuilt; set by dev_server.py, which
+# serves the reload events.
+LIVE_RELOAD = False
+
+# Timing, memory and payload of each viz render, also logged as a table
+VIZ_REPORT_PATH = 'cache/viz-report.json'
+# Directory for a cProfile dump of each viz render, e.g. 'cache/profiles'
+VIZ_PROFILE_PATH = None
+# Report the peak of the Python allocations of each render, with tracemalloc,
+# which slows the renders down; otherwise the peak RSS of the worker so far.
+VIZ_TRACE_MEMORY = False
+
+# Payload budgets in kB, by page slug: 'json' for the Bokeh documents embedded
+# by the page's vizzes, 'page' for its HTML plus the local assets it loads.
+# The build fails, with a breakdown by data source, when a page goes over.
+VIZ_PAYLOAD_BUDGETS = {
+    'default': {'json': 250, 'page': 600},
+    'economic-growth': {'json': 300},
+    'provincial-comparison': {'json': 300, 'page': 700},
+}
+
+# Fingerprint and pre-compress the output once built (see publishconf.py)
+ASSET_PIPELINE = False
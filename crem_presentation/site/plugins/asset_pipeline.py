@@ -0,0 +1,202 @@
+"""Post-build optimisation of the pelican output for publishing.
+
+Once the site is written, static assets are renamed with a hash of their
+content and the references to them are rewritten, then text files get
+pre-compressed .gz (and, if the brotli module is installed, .br) siblings.
+Caching headers for the result are written to an Apache .htaccess file and
+a JSON manifest.
+
+Enabled by ASSET_PIPELINE = True, as in publishconf.py. With the
+viz_renderer plugin, do not list this one in PLUGINS: viz_renderer runs it
+once it has written its own assets.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from pelican import signals
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Assets that are fingerprinted. JS and JSON are handled before CSS, so that
+# stylesheets referring to them are hashed with the rewritten references.
+LEAF_ASSETS = ('.js', '.json')
+STYLESHEETS = ('.css', )
+# Files that get pre-compressed siblings
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg', '.xml', '.txt')
+COMPRESS_MIN_SIZE = 256
+
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{12}\.[a-z]+$')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+SHORT = 'public, max-age=86400'
+
+MANIFEST = 'asset-manifest.json'
+
+HTACCESS = r'''# Written by the asset_pipeline plugin
+AddEncoding gzip .gz
+AddEncoding br .br
+
+<IfModule mod_rewrite.c>
+  RewriteEngine On
+  RewriteCond %%{HTTP:Accept-Encoding} br
+  RewriteCond %%{REQUEST_FILENAME}.br -f
+  RewriteRule ^(.*)$ $1.br [L]
+  RewriteCond %%{HTTP:Accept-Encoding} gzip
+  RewriteCond %%{REQUEST_FILENAME}.gz -f
+  RewriteRule ^(.*)$ $1.gz [L]
+</IfModule>
+
+<FilesMatch "\.html\.(gz|br)$">
+  ForceType text/html
+</FilesMatch>
+<FilesMatch "\.css\.(gz|br)$">
+  ForceType text/css
+</FilesMatch>
+<FilesMatch "\.js\.(gz|br)$">
+  ForceType application/javascript
+</FilesMatch>
+<FilesMatch "\.json\.(gz|br)$">
+  ForceType application/json
+</FilesMatch>
+
+<IfModule mod_headers.c>
+  Header append Vary Accept-Encoding
+  Header set Cache-Control "%(short)s"
+  <FilesMatch "\.[0-9a-f]{12}\.[a-z]+(\.gz|\.br)?$">
+    Header set Cache-Control "%(immutable)s"
+  </FilesMatch>
+  <FilesMatch "\.html(\.gz|\.br)?$">
+    Header set Cache-Control "%(revalidate)s"
+  </FilesMatch>
+</IfModule>
+'''
+
+
+def content_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def walk(output_path, extensions):
+    "Output files with the given extensions, as '/' separated relative paths."
+    for dirpath, _, filenames in os.walk(output_path):
+        for filename in sorted(filenames):
+            if filename.endswith(extensions):
+                path = os.path.relpath(os.path.join(dirpath, filename), output_path)
+                yield path.replace(os.sep, '/')
+
+
+def fingerprint(output_path, extensions):
+    """Rename the assets after their content; return {old path: new path}."""
+    renamed = {}
+    for path in walk(output_path, extensions):
+        if FINGERPRINTED.search(path):
+            continue
+        root, ext = os.path.splitext(path)
+        new_path = '%s.%s%s' % (root, content_digest(os.path.join(output_path, path)), ext)
+        os.rename(os.path.join(output_path, path), os.path.join(output_path, new_path))
+        renamed[path] = new_path
+    return renamed
+
+
+def rewrite_references(output_path, extensions, renamed):
+    """Point the references in the given files at the fingerprinted assets."""
+    if not renamed:
+        return
+    # A reference ends in the asset path, whether relative or under SITEURL
+    pattern = re.compile(
+        r'(?<=[/"\'(])(%s)(?=[?#"\')\s])' % '|'.join(re.escape(p) for p in sorted(renamed, key=len, reverse=True))
+    )
+    for path in walk(output_path, extensions):
+        full_path = os.path.join(output_path, path)
+        with open(full_path, encoding='utf-8') as f:
+            text = f.read()
+        new_text = pattern.sub(lambda match: renamed[match.group(1)], text)
+        if new_text != text:
+            with open(full_path, 'w', encoding='utf-8') as f:
+                f.write(new_text)
+
+
+def compress(full_path):
+    "Write the .gz and .br siblings of a file; return the sizes written."
+    with open(full_path, 'rb') as f:
+        data = f.read()
+    sizes = {'': len(data)}
+    buf = io.BytesIO()
+    # A fixed mtime keeps the output, and so its hash, reproducible
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, compresslevel=9, mtime=0) as gz:
+        gz.write(data)
+    variants = [('.gz', buf.getvalue())]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        with open(full_path + suffix, 'wb') as f:
+            f.write(compressed)
+        sizes[suffix] = len(compressed)
+    return sizes
+
+
+def cache_control(path):
+    if FINGERPRINTED.search(path):
+        return IMMUTABLE
+    elif path.endswith('.html'):
+        return REVALIDATE
+    return SHORT
+
+
+def optimize(pelican):
+    settings = pelican.settings
+    if not settings.get('ASSET_PIPELINE'):
+        return
+    output_path = settings['OUTPUT_PATH']
+
+    renamed = fingerprint(output_path, LEAF_ASSETS)
+    rewrite_references(output_path, STYLESHEETS, renamed)
+    renamed.update(fingerprint(output_path, STYLESHEETS))
+    rewrite_references(output_path, ('.html', ), renamed)
+
+    if brotli is None:
+        logger.warning('brotli is not installed; only writing .gz files')
+    to_compress = [
+        path for path in walk(output_path, COMPRESSIBLE)
+        if os.path.getsize(os.path.join(output_path, path)) >= COMPRESS_MIN_SIZE
+    ]
+    # zlib and brotli release the GIL, so threads compress in parallel
+    with ThreadPoolExecutor(max_workers=settings.get('ASSET_PIPELINE_THREADS') or os.cpu_count()) as executor:
+        sizes = dict(zip(to_compress, executor.map(
+            lambda path: compress(os.path.join(output_path, path)), to_compress
+        )))
+
+    headers = {}
+    for path in walk(output_path, ''):
+        if path.endswith(('.gz', '.br')) or path in (MANIFEST, '.htaccess'):
+            continue
+        headers[path] = {
+            'Cache-Control': cache_control(path),
+            'encodings': sorted(suffix.lstrip('.') for suffix in sizes.get(path, {}) if suffix),
+        }
+    with open(os.path.join(output_path, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(dict(assets=renamed, headers=headers), f, indent=1, sort_keys=True)
+    with open(os.path.join(output_path, '.htaccess'), 'w', encoding='utf-8') as f:
+        f.write(HTACCESS % dict(immutable=IMMUTABLE, revalidate=REVALIDATE, short=SHORT))
+
+    before = sum(s[''] for s in sizes.values())
+    after = sum(min(s.values()) for s in sizes.values())
+    logger.info('Fingerprinted %d assets; compressed %d files from %d to %d bytes',
+                len(renamed), len(sizes), before, after)
+
+
+def register():
+    signals.finalized.connect(optimize)
@@ -0,0 +1,98 @@
+"""On-disk cache of the rendered viz fragments, used by viz_renderer."""
+import hashlib
+import json
+import os
+import shutil
+from glob import glob
+
+# Libraries whose version affects the rendered output
+LIBRARIES = ('bokeh', 'jinja2', 'matplotlib', 'numpy', 'pandas')
+
+# The viz modules and templates, the cgetools package they use and the
+# plugins rendering them; a change to any of them invalidates all entries, as
+# the modules share most of their helpers.
+SOURCE_PATTERNS = (
+    os.path.join('content', 'viz', '*.py'),
+    os.path.join('theme', 'templates', 'viz', '*.html'),
+    os.path.join('..', '..', 'cgetools', '*.py'),
+    os.path.join('plugins', '*.py'),
+)
+
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def library_versions():
+    versions = {}
+    for name in LIBRARIES:
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return versions
+
+
+def purge(path):
+    """Remove every cached fragment."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+class VizCache(object):
+    """Rendered viz fragments and their render reports, one JSON file per viz.
+
+    Entries are keyed by a fingerprint of the library versions and the source
+    of the viz modules and templates. Each entry also records the digests of
+    the data files read while rendering it, and is only used while those are
+    unchanged.
+
+    salt - other settings the renders depend on, e.g. the warehouse run read,
+        as JSON-serializable values
+    """
+
+    def __init__(self, path, salt=None):
+        self.path = path
+        digest = hashlib.sha1(json.dumps([library_versions(), salt], sort_keys=True).encode('utf-8'))
+        sources = sorted(f for pattern in SOURCE_PATTERNS for f in glob(pattern))
+        # Renders by modules imported before this are stale; see viz_renderer
+        self.sources_mtime = max([os.path.getmtime(f) for f in sources] or [0])
+        for filename in sources:
+            digest.update(filename.encode('utf-8'))
+            digest.update(file_digest(filename).encode('utf-8'))
+        self.fingerprint = digest.hexdigest()[:16]
+
+    def _entry_path(self, viz_name):
+        return os.path.join(self.path, '%s-%s.json' % (viz_name, self.fingerprint))
+
+    def get(self, viz_name):
+        "Return the cached (html, report) of the viz, or None if missing or stale"
+        try:
+            with open(self._entry_path(viz_name), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        for filename, digest in entry['data_files'].items():
+            if not os.path.exists(filename) or file_digest(filename) != digest:
+                return None
+        return (entry['html'], entry['report'])
+
+    def put(self, viz_name, html, report):
+        os.makedirs(self.path, exist_ok=True)
+        # Entries written under an older fingerprint can never be used again
+        for stale in glob(os.path.join(self.path, '%s-*.json' % viz_name)):
+            os.remove(stale)
+        entry = dict(
+            html=html,
+            report=report,
+            data_files=dict((f, file_digest(f)) for f in report['reads']),
+        )
+        # Write then rename, so that a reader never sees a partial entry
+        entry_path = self._entry_path(viz_name)
+        with open(entry_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(entry_path + '.tmp', entry_path)
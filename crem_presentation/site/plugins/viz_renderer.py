@@ -1,20 +1,379 @@
+import cProfile
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import tracemalloc
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
 from pelican import signals
 from pelican.readers import MarkdownReader
 
 # Expect a viz directory under content with the python methods in it.
 from content import viz
+from content.viz import _data, _slices, _tracking
+
+import asset_pipeline
+from cgetools.trace import peak_rss
+from viz_cache import VizCache
+
+logger = logging.getLogger(__name__)
+
+# Metadata keys that name a viz to be rendered into the page
+VIZ_KEYS = ('viz', 'viz_extra')
+
+# Output directory of the shared province geometry asset
+GEOMETRY_DIR = os.path.join('theme', 'data')
+# Output directory of the data slices loaded on demand (VIZ_LAZY_DATA)
+SLICES_DIR = os.path.join('theme', 'data', 'slices')
+
+# Renders for the current pelican run, keyed by viz name. Values are futures
+# while the process pool is working, and (ok, html or traceback, report) once
+# collected; see content.viz._tracking for the report.
+_renders = {}
+_reports = {}
+# Pages written in the current run, keyed by slug: (output path, viz names)
+_pages = {}
+# Data slices of the vizzes, {path under SLICES_DIR: JSON text}
+_data_slices = {}
+# Renders kept in memory across pelican runs with VIZ_KEEP_RENDERS, as by
+# dev_server.py, until forgotten; same values as _renders once collected
+_kept = None
+# When the viz modules were imported. `pelican -r` does not reload them, and
+# the workers are forked from this process, so the renders are only cached
+# while their sources are unchanged since; see sources_reloaded.
+_sources_loaded = time.time()
+_executor = None
+_cache = None
+_geometry = None
+
+
+def find_viz_names(content_path):
+    """Collect the viz names declared in the metadata of the Markdown pages."""
+    header = re.compile(r'^(%s)\s*:\s*(\S+)\s*$' % '|'.join(VIZ_KEYS), re.IGNORECASE)
+    names = []
+    for dirpath, _, filenames in os.walk(content_path):
+        for filename in sorted(filenames):
+            if not filename.endswith('.md'):
+                continue
+            with open(os.path.join(dirpath, filename), encoding='utf-8-sig') as f:
+                for line in f:
+                    # The metadata block ends at the first blank line
+                    if not line.strip():
+                        break
+                    match = header.match(line)
+                    if match and match.group(2) not in names:
+                        names.append(match.group(2))
+    return names
+
+
+def get_render_options(settings):
+    "The settings the vizzes are rendered with, also passed to the workers."
+    warehouse = settings.get('VIZ_WAREHOUSE')
+    return dict(warehouse=warehouse and list(warehouse), lazy_data=bool(settings.get('VIZ_LAZY_DATA')))
+
+
+def _configure(options):
+    _data.use_warehouse(*(options['warehouse'] or (None, None)))
+    _slices.enable(options['lazy_data'])
+
+
+def _render(viz_name, profile_path=None, options=None, trace_memory=False):
+    # Runs in a worker process. Exceptions are returned as formatted
+    # tracebacks, as the original traceback does not survive pickling.
+    # The peak memory is that of the Python allocations of the render with
+    # trace_memory, which slows it down; otherwise the peak RSS of the
+    # process so far.
+    if options:
+        _configure(options)
+    _tracking.reset()
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if profile_path else None
+    start = time.time()
+    try:
+        if profiler:
+            profiler.enable()
+        html = getattr(viz, 'render_' + viz_name)()
+    except Exception:
+        return (False, traceback.format_exc(), None)
+    finally:
+        wall_time = time.time() - start
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            peak_memory = peak_rss()
+        if profiler:
+            profiler.disable()
+            os.makedirs(profile_path, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_path, '%s.prof' % viz_name))
+    report = _tracking.get_report()
+    report.update(wall_time=wall_time, peak_memory=peak_memory, html_bytes=len(html.encode('utf-8')))
+    return (True, html, report)
+
+
+def _error_html(viz_name):
+    return '<p>Error: Viz named <code>%s</code> is not available</p>' % viz_name
+
+
+def prerender(settings):
+    """Start rendering every viz used by the site, before any page is read.
+
+    Vizzes found in the cache are not rendered again.
+    """
+    global _executor, _cache, _kept
+    if _executor is not None or _renders:
+        return
+    if settings.get('VIZ_KEEP_RENDERS') and _kept is None:
+        _kept = {}
+    options = get_render_options(settings)
+    _configure(options)
+    if settings.get('VIZ_CACHE_PATH'):
+        _cache = VizCache(settings['VIZ_CACHE_PATH'], salt=options)
+        if _cache.sources_mtime > _sources_loaded:
+            logger.warning('The viz sources changed since pelican started; the renders of this run '
+                           'are not cached. Restart pelican to cache them again.')
+    processes = settings.get('VIZ_PROCESSES')
+    profile_path = settings.get('VIZ_PROFILE_PATH')
+    trace_memory = bool(settings.get('VIZ_TRACE_MEMORY'))
+    for viz_name in find_viz_names(settings['PATH']):
+        if not hasattr(viz, 'render_' + viz_name):
+            continue
+        if _kept and viz_name in _kept:
+            ok, html, report = _kept[viz_name]
+            # A copy, as the slices are popped from it once collected
+            _renders[viz_name] = (ok, html, dict(report, cached=True))
+            continue
+        cached = _cache.get(viz_name) if _cache else None
+        if cached is not None:
+            html, report = cached
+            report['cached'] = True
+            _renders[viz_name] = (True, html, report)
+        elif processes == 0:
+            _renders[viz_name] = _render(viz_name, profile_path, options, trace_memory)
+        else:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=processes)
+            _renders[viz_name] = _executor.submit(_render, viz_name, profile_path, options, trace_memory)
+
+
+def get_rendered_viz(viz_name):
+    if not hasattr(viz, 'render_' + viz_name):
+        logger.error('Viz named %s is not available', viz_name)
+        return _error_html(viz_name)
+    render = _renders.get(viz_name)
+    if render is None:
+        render = _render(viz_name)
+    elif not isinstance(render, tuple):
+        render = render.result()
+    _renders[viz_name] = render
+    ok, data, report = render
+    if not ok:
+        logger.error('Viz named %s failed to render:\n%s', viz_name, data)
+        return _error_html(viz_name)
+    if viz_name not in _reports:
+        if _cache and not report.get('cached') and _cache.sources_mtime <= _sources_loaded:
+            _cache.put(viz_name, data, report)
+        if _kept is not None and viz_name not in _kept:
+            _kept[viz_name] = (ok, data, dict(report))
+        # Written at the end of the build, and kept out of the report file
+        _data_slices.update(report.pop('slices', {}))
+        _reports[viz_name] = report
+    return data
+
+
+def sources_reloaded():
+    "Note that the changed viz modules were reloaded, as by dev_server.py."
+    global _sources_loaded
+    _sources_loaded = time.time()
+
+
+def forget(viz_names=None):
+    "Render these vizzes again on the next run; all of them with None."
+    if _kept is None:
+        return
+    for viz_name in list(_kept) if viz_names is None else viz_names:
+        _kept.pop(viz_name, None)
+
+
+def kept_reads():
+    "{viz name: files read} of the renders kept in memory."
+    return dict((viz_name, report['reads']) for viz_name, (_, _, report) in (_kept or {}).items())
+
+
+def prepare_geometry(generator):
+    "Name the shared geometry asset by its content, for the page templates."
+    global _geometry
+    if _geometry is None:
+        text = json.dumps(_data.get_province_geometry(), separators=(',', ':'))
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+        url = '/'.join(GEOMETRY_DIR.split(os.sep) + ['provinces.%s.json' % digest])
+        _geometry = (url, text)
+    generator.context['PROVINCE_GEOMETRY_URL'] = _geometry[0]
+
+
+def write_geometry(pelican):
+    url, text = _geometry
+    path = os.path.join(pelican.settings['OUTPUT_PATH'], *url.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    logger.info('Wrote shared province geometry to %s (%d bytes)', path, len(text))
+
+
+def write_slices(pelican):
+    output_path = os.path.join(pelican.settings['OUTPUT_PATH'], SLICES_DIR)
+    for path, text in _data_slices.items():
+        full_path = os.path.join(output_path, *path.split('/'))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    logger.info('Wrote %d data slices to %s (%d bytes)', len(_data_slices), output_path,
+                sum(len(text) for text in _data_slices.values()))
+
+
+def write_report(pelican):
+    """Write the render reports as JSON, and log them as a table."""
+    report_path = pelican.settings.get('VIZ_REPORT_PATH')
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(_reports, f, indent=1, sort_keys=True)
+    if not _reports:
+        return
+    row = '%-32s %8s %9s %5s %7s %10s %10s %10s %10s %10s'
+    rows = [row % ('viz', 'time s', 'peak MB', 'CSVs', 'models',
+                   'script kB', 'html kB', 'geom. kB', 'prec. kB', 'lazy kB')]
+    for viz_name in sorted(_reports):
+        report = _reports[viz_name]
+        rows.append(row % (
+            viz_name + (' (cached)' if report.get('cached') else ''),
+            '%.2f' % report['wall_time'],
+            '-' if report['peak_memory'] is None else '%.1f' % (report['peak_memory'] / 2.0 ** 20),
+            report['csv_reads'],
+            report['models'],
+            '%.1f' % (report['script_bytes'] / 1024.0),
+            '%.1f' % (report['html_bytes'] / 1024.0),
+            '%.1f' % (report['bytes_saved'].get('geometry', 0) / 1024.0),
+            '%.1f' % (report['bytes_saved'].get('precision', 0) / 1024.0),
+            '%.1f' % (report['bytes_saved'].get('lazy', 0) / 1024.0),
+        ))
+    logger.info('Viz renders (geom.: province geometry moved to the shared asset; '
+                'prec.: saved by rounding values to their precision; '
+                'lazy: values moved to data slices):\n%s',
+                '\n'.join(rows))
+
+
+class PayloadBudgetExceeded(Exception):
+    pass
+
+
+def record_page(path, context=None):
+    page = (context or {}).get('page')
+    if page is not None:
+        viz_names = [page.metadata[key] for key in VIZ_KEYS if key in page.metadata]
+        _pages[page.slug] = (path, viz_names)
+
+
+def page_weight(path, settings, with_geometry):
+    """Bytes of a written page and of the local assets it loads."""
+    output_path = settings['OUTPUT_PATH']
+    siteurl = settings.get('SITEURL', '')
+    with open(path, 'rb') as f:
+        html = f.read().decode('utf-8')
+    urls = re.findall(r'<(?:script|img)\s[^>]*?src="([^"]+)"', html)
+    urls += re.findall(r'<link\s[^>]*?href="([^"]+)"', html)
+    if with_geometry:
+        urls += re.findall(r'data-geometry-url="([^"]+)"', html)
+    weight = len(html.encode('utf-8'))
+    for url in set(urls):
+        if siteurl and url.startswith(siteurl):
+            asset = os.path.join(output_path, url[len(siteurl):].lstrip('/'))
+        elif '//' in url:
+            continue  # not ours, e.g. the Bokeh CDN
+        elif url.startswith('/'):
+            asset = os.path.join(output_path, url.lstrip('/'))
+        else:
+            asset = os.path.join(os.path.dirname(path), url)
+        asset = os.path.normpath(asset.split('?')[0].split('#')[0])
+        if os.path.isfile(asset):
+            weight += os.path.getsize(asset)
+    return weight
+
+
+def check_budgets(pelican):
+    """Fail the build if a page exceeds its payload budget.
+
+    VIZ_PAYLOAD_BUDGETS maps page slugs (or 'default') to budgets in kB for
+    'json', the Bokeh documents embedded by the page's vizzes, and 'page', the
+    HTML plus the local assets it loads.
+    """
+    budgets = pelican.settings.get('VIZ_PAYLOAD_BUDGETS')
+    if not budgets:
+        return
+    failures = []
+    for slug, (path, viz_names) in sorted(_pages.items()):
+        budget = dict(budgets.get('default', {}))
+        budget.update(budgets.get(slug, {}))
+        reports = [_reports[name] for name in viz_names if name in _reports]
+        payload = {}
+        for report in reports:
+            for kind, n_bytes in report['payload'].items():
+                payload[kind] = payload.get(kind, 0) + n_bytes
+        with_geometry = any(report['bytes_saved'].get('geometry') for report in reports)
+        measured = dict(
+            json=sum(report['script_bytes'] for report in reports),
+            page=page_weight(path, pelican.settings, with_geometry),
+        )
+        over = [
+            '%s %.1f kB > %s kB' % (key, measured[key] / 1024.0, budget[key])
+            for key in ('json', 'page') if key in budget and measured[key] > budget[key] * 1024
+        ]
+        if over:
+            breakdown = ', '.join('%s %.1f kB' % (kind, payload[kind] / 1024.0) for kind in sorted(payload))
+            failures.append('%s: %s (JSON by source: %s)' % (slug, '; '.join(over), breakdown or 'none'))
+    if failures:
+        raise PayloadBudgetExceeded('Pages over their payload budget:\n  ' + '\n  '.join(failures))
+
+
+def shutdown(pelican):
+    """Release the worker processes; the next (auto)reload renders afresh,
+    but for the renders kept with VIZ_KEEP_RENDERS."""
+    global _executor, _cache, _geometry
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    _cache = None
+    _geometry = None
+    _renders.clear()
+    _reports.clear()
+    _pages.clear()
+    _data_slices.clear()
+
+
+def finalize(pelican):
+    try:
+        if _geometry is not None:
+            write_geometry(pelican)
+        if _data_slices:
+            write_slices(pelican)
+        write_report(pelican)
+        check_budgets(pelican)
+    finally:
+        shutdown(pelican)
+    # Last, as the geometry and slices written above are assets too; the
+    # order of the receivers of a signal is arbitrary
+    asset_pipeline.optimize(pelican)
 
 
 class VizReader(MarkdownReader):
 
     def render_viz(self, viz_name):
-        try:
-            render_function = getattr(viz, 'render_' + viz_name)
-            data = render_function()
-        except AttributeError as e:
-            print(e)
-            data = '<p>Error: Viz named <code>%s</code> is not available</p>' % viz_name
-        return data
+        return get_rendered_viz(viz_name)
 
     def read(self, source_path):
         "Parses content and handles viz parameter"
@@ -31,8 +390,12 @@ class VizReader(MarkdownReader):
 
 def add_reader(readers):
     readers.reader_classes['md'] = VizReader
+    prerender(readers.settings)
 
 
 # This is how pelican works.
 def register():
     signals.readers_init.connect(add_reader)
+    signals.generator_init.connect(prepare_geometry)
+    signals.content_written.connect(record_page)
+    signals.finalized.connect(finalize)
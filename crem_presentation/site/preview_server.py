@@ -0,0 +1,246 @@
+"""Threaded preview server for the built site.
+
+Serves the output directory like pelican.server, but one thread per request,
+with compression and validators: pre-compressed .br/.gz siblings (as written
+by the asset_pipeline plugin) are served when the browser accepts them, other
+text is gzipped on the fly, and ETag/Last-Modified let reloads revalidate
+with a 304. Each request is logged with its latency and the bytes sent.
+
+/__reload is a stream of server-sent events: dev_server.py pushes a 'reload'
+event once it has rebuilt the site, and the pages reload (LIVE_RELOAD).
+
+Usage: python preview_server.py [port] [--root output]
+
+Works with Python 2 too, so that fabfile.py can import it.
+"""
+from __future__ import print_function
+
+import argparse
+import email.utils
+import io
+import json
+import mimetypes
+import os
+import sys
+import threading
+import time
+import zlib
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+PORT = 8000
+
+# Pelican writes 'page.html' for URLs like 'page', as in pelican.server
+SUFFIXES = ['', '.html', '/index.html']
+
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json', 'image/svg+xml')
+COMPRESS_MIN_SIZE = 256
+
+# Written by the asset_pipeline plugin; gives the Cache-Control of each file
+MANIFEST = 'asset-manifest.json'
+
+EVENTS_PATH = '/__reload'
+# Seconds between comments on an idle event stream, which keep it open
+EVENTS_KEEPALIVE = 15
+
+
+class PreviewServer(ThreadingMixIn, HTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, handler_class, root='.'):
+        HTTPServer.__init__(self, address, handler_class)
+        self.root = os.path.abspath(root)
+        self.cache_control = {}
+        manifest = os.path.join(self.root, MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                for path, headers in json.load(f)['headers'].items():
+                    self.cache_control[path] = headers['Cache-Control']
+        # On-the-fly gzipped bodies, {path: (ETag, body)}; only the latest
+        # version of a file is kept, as dev_server.py rebuilds often
+        self.compressed = {}
+        self.lock = threading.Lock()
+        # Counts the rebuilds; the event streams wait on it
+        self.generation = 0
+        self.rebuilt = threading.Condition()
+
+    def notify_reload(self):
+        "Have the pages open on the event stream reload."
+        with self.rebuilt:
+            self.generation += 1
+            self.rebuilt.notify_all()
+
+
+def gzip_bytes(data):
+    # wbits=31 gives the gzip container
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class PreviewRequestHandler(SimpleHTTPRequestHandler):
+    # Keep-alive lets the browser reuse connections for the page's assets
+    protocol_version = 'HTTP/1.1'
+
+    def translate_path(self, path):
+        # Under the server's root rather than the current directory
+        path = SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(self.server.root, os.path.relpath(path, os.getcwd()))
+
+    def resolve(self):
+        "Return the file for the request path, trying pelican's suffixes."
+        path = self.translate_path(self.path)
+        root = os.path.abspath(self.server.root)
+        # 'page/' names a directory: its index.html, never 'page.html'
+        directory = self.path.split('?', 1)[0].split('#', 1)[0].endswith('/')
+        for suffix in SUFFIXES:
+            if directory and suffix == '.html':
+                continue
+            candidate = os.path.abspath(path.rstrip('/') + suffix if suffix else path)
+            if candidate != root and not candidate.startswith(root + os.sep):
+                continue
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def accepted_encodings(self):
+        header = self.headers.get('Accept-Encoding', '')
+        return [e.split(';')[0].strip() for e in header.split(',')]
+
+    def not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            since = email.utils.parsedate_tz(if_modified_since)
+            if since is not None:
+                return int(mtime) <= email.utils.mktime_tz(since)
+        return False
+
+    def send_head(self):
+        path = self.resolve()
+        if path is None:
+            # Directory listings and 404s, as usual
+            return SimpleHTTPRequestHandler.send_head(self)
+
+        stat = os.stat(path)
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        etag = '%x-%x' % (int(stat.st_mtime * 1e6), stat.st_size)
+        accepted = self.accepted_encodings()
+
+        body_path, encoding = path, None
+        for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if name in accepted and os.path.isfile(path + suffix):
+                body_path, encoding = path + suffix, name
+                break
+        compressible = content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+        if encoding is None and 'gzip' in accepted and compressible and stat.st_size >= COMPRESS_MIN_SIZE:
+            encoding = 'gzip'
+        etag = '"%s%s"' % (etag, '-' + encoding if encoding else '')
+
+        if self.not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_validators(path, etag, stat.st_mtime)
+            self.end_headers()
+            return None
+
+        if body_path != path or encoding is None:
+            body = open(body_path, 'rb')
+            length = os.path.getsize(body_path)
+        else:
+            with self.server.lock:
+                cached_etag, data = self.server.compressed.get(path, (None, None))
+            if cached_etag != etag:
+                with open(path, 'rb') as f:
+                    data = gzip_bytes(f.read())
+                with self.server.lock:
+                    self.server.compressed[path] = (etag, data)
+            body = io.BytesIO(data)
+            length = len(data)
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(length))
+        self.send_validators(path, etag, stat.st_mtime)
+        self.end_headers()
+        return body
+
+    def send_validators(self, path, etag, mtime):
+        relative = os.path.relpath(path, self.server.root).replace(os.sep, '/')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(mtime, usegmt=True))
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', self.server.cache_control.get(relative, 'no-cache'))
+        # Pages served from elsewhere may fetch their data slices from here
+        # (VIZ_DATA_URL in pelicanconf.py)
+        self.send_header('Access-Control-Allow-Origin', '*')
+
+    def send_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.close_connection = True
+        with self.server.rebuilt:
+            seen = self.server.generation
+        try:
+            while True:
+                with self.server.rebuilt:
+                    if self.server.generation == seen:
+                        self.server.rebuilt.wait(EVENTS_KEEPALIVE)
+                    generation = self.server.generation
+                if generation != seen:
+                    seen = generation
+                    self.wfile.write(('event: reload\ndata: %d\n\n' % generation).encode('ascii'))
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (IOError, OSError):
+            pass  # the page went away
+
+    def do_GET(self):
+        if self.path.split('?')[0] == EVENTS_PATH:
+            return self.send_events()
+        start = time.time()
+        self.status = None
+        sent = 0
+        body = self.send_head()
+        if body:
+            try:
+                for chunk in iter(lambda: body.read(1 << 16), b''):
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+            finally:
+                body.close()
+        self.log_message('"%s" %s %d bytes %.1f ms', self.requestline, self.status,
+                         sent, (time.time() - start) * 1000)
+
+    def log_request(self, code='-', size='-'):
+        # Logged once the body is sent, by do_GET
+        self.status = code
+
+
+def serve(root='.', port=PORT):
+    server = PreviewServer(('', port), PreviewRequestHandler, root)
+    sys.stderr.write('Serving {0} on port {1} ...\n'.format(server.root, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the built site for preview.')
+    parser.add_argument('port', nargs='?', type=int, default=PORT)
+    parser.add_argument('--root', default='.', help='directory to serve (default: current)')
+    args = parser.parse_args()
+    serve(args.root, args.port)
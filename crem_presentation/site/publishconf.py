@@ -20,6 +20,9 @@ RELATIVE_URLS = False
 
 DELETE_OUTPUT_DIRECTORY = True
 
+# Content-hashed, pre-compressed assets with long-lived caching headers
+ASSET_PIPELINE = True
+
 # Following items are often useful when publishing
 
 #DISQUS_SITENAME = ""
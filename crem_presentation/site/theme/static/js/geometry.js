@@ -0,0 +1,96 @@
+// Attaches the province outlines to the map data sources. The outlines are
+// shared by every map on the site, so the pages embed the sources without
+// them (tagged 'province_geometry') and the browser fetches and caches one
+// content-hashed copy, named in the data-geometry-url of this script's tag.
+// The copy is a shared-arc topology (see cgetools/topology.py), decoded here
+// into the NaN-separated outlines of the Patches glyphs.
+(function($) {
+  var url = $('script[data-geometry-url]').data('geometry-url'),
+      tag = 'province_geometry';
+
+  function tagged_sources() {
+    var sources = [];
+    $.each(Bokeh.index, function(id, view) {
+      $.each(view.model.document._all_models, function(model_id, model) {
+        var tags = model.get('tags');
+        if (tags && tags.indexOf(tag) > -1 && sources.indexOf(model) < 0) {
+          sources.push(model);
+        }
+      });
+    });
+    return sources;
+  }
+
+  function decode_arcs(topology) {
+    // Undo the delta encoding of the arcs, into points on the grid
+    return $.map(topology.arcs, function(flat) {
+      var x = flat[0], y = flat[1], points = [[x, y]], i;
+      for (i = 2; i < flat.length; i += 2) {
+        x += flat[i];
+        y += flat[i + 1];
+        points.push([x, y]);
+      }
+      return [points];
+    });
+  }
+
+  function decode(topology) {
+    var arcs = decode_arcs(topology),
+        scale = topology.scale,
+        tx = topology.translate[0],
+        ty = topology.translate[1],
+        geometry = {};
+    $.each(topology.objects, function(name, rings) {
+      var xs = [], ys = [];
+      $.each(rings, function(i, refs) {
+        var points = [];
+        $.each(refs, function(j, ref) {
+          // ~i refers to arc i reversed
+          var arc = ref >= 0 ? arcs[ref] : arcs[~ref].slice().reverse();
+          points = points.concat(points.length ? arc.slice(1) : arc);
+        });
+        if (points.length < 4) {
+          return;
+        }
+        if (xs.length) {
+          xs.push(NaN);
+          ys.push(NaN);
+        }
+        $.each(points, function(k, point) {
+          xs.push(tx + point[0] * scale);
+          ys.push(ty + point[1] * scale);
+        });
+      });
+      geometry[name] = {xs: xs, ys: ys};
+    });
+    return geometry;
+  }
+
+  function attach(sources, geometry) {
+    $.each(sources, function(i, source) {
+      var data = source.get('data');
+      data.xs = $.map(data.alpha, function(alpha) { return [geometry[alpha].xs]; });
+      data.ys = $.map(data.alpha, function(alpha) { return [geometry[alpha].ys]; });
+      source.set('data', data);
+      source.trigger('change');
+    });
+  }
+
+  function load(attempts) {
+    // The plots are embedded on document ready too; wait for their views
+    if ($.isEmptyObject(Bokeh.index)) {
+      if (attempts > 0) {
+        setTimeout(function() { load(attempts - 1); }, 50);
+      }
+      return;
+    }
+    var sources = tagged_sources();
+    if (sources.length) {
+      $.ajax({url: url, dataType: 'json', cache: true}).done(function(topology) {
+        attach(sources, decode(topology));
+      });
+    }
+  }
+
+  $(function() { load(100); });
+})(Bokeh.$);
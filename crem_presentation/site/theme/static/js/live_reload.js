@@ -0,0 +1,13 @@
+// Reloads the page once dev_server.py has rebuilt the site. The server
+// pushes an event on the stream after each rebuild; EventSource reconnects
+// by itself if the server restarts.
+(function() {
+  var script = document.querySelector('script[data-events-url]');
+  if (!script || !window.EventSource) {
+    return;
+  }
+  var events = new EventSource(script.getAttribute('data-events-url'));
+  events.addEventListener('reload', function() {
+    window.location.reload();
+  });
+})();
@@ -0,0 +1,112 @@
+// Fills in the data left out of the pages with VIZ_LAZY_DATA (see
+// content/viz/_slices.py). Each data source tagged 'lazy_data' names the
+// JSON slice of each of its missing columns. The slices of a source are
+// fetched once one of its plots is scrolled into view, and those of a
+// scenario as soon as it is highlighted. Slices are named after their
+// content, so the browser caches them, and each is fetched once per page.
+(function($) {
+  var base = $('script[data-slices-url]').data('slices-url'),
+      tag = 'lazy_data',
+      requests = {},
+      items = [];
+
+  function fetch(path) {
+    var url = base + '/' + path;
+    if (!requests[url]) {
+      requests[url] = $.ajax({url: url, dataType: 'json', cache: true});
+    }
+    return requests[url];
+  }
+
+  function find_items() {
+    // A source with the plot elements that draw it, once per source
+    var by_id = {};
+    $.each(Bokeh.index, function(id, view) {
+      $.each(view.model.get('renderers') || [], function(i, renderer) {
+        var source = renderer.get('data_source'),
+            tags = source && source.get('tags'),
+            position = tags ? tags.indexOf(tag) : -1;
+        if (position < 0) {
+          return;
+        }
+        if (!by_id[source.id]) {
+          by_id[source.id] = {source: source, spec: tags[position + 1], elements: [], requested: {}};
+          items.push(by_id[source.id]);
+        }
+        if (by_id[source.id].elements.indexOf(view.el) < 0) {
+          by_id[source.id].elements.push(view.el);
+        }
+      });
+    });
+  }
+
+  function attach(item, column, slice) {
+    // Align the slice on the source's index column
+    var data = item.source.get('data'),
+        keys = data[item.spec.index],
+        positions = {},
+        values = [],
+        i;
+    for (i = 0; i < slice.index.length; i++) {
+      positions[slice.index[i]] = i;
+    }
+    for (i = 0; i < keys.length; i++) {
+      values.push(keys[i] in positions ? slice.values[positions[keys[i]]] : NaN);
+    }
+    data[column] = values;
+    item.source.set('data', data);
+    item.source.trigger('change');
+  }
+
+  function load(item, test) {
+    $.each(item.spec.slices, function(column, entry) {
+      if (item.requested[column] || !test(entry)) {
+        return;
+      }
+      item.requested[column] = true;
+      fetch(entry[0]).done(function(slice) { attach(item, column, slice); });
+    });
+  }
+
+  function in_view(element) {
+    var rect = element.getBoundingClientRect(),
+        height = window.innerHeight || document.documentElement.clientHeight;
+    return rect.bottom > 0 && rect.top < height;
+  }
+
+  function check_visible() {
+    $.each(items, function(i, item) {
+      if ($.grep(item.elements, in_view).length) {
+        load(item, function() { return true; });
+      }
+    });
+  }
+
+  Bokeh.custom.load_slices = function(scenarios) {
+    $.each(items, function(i, item) {
+      load(item, function(entry) { return scenarios.indexOf(entry[1]) > -1; });
+    });
+  };
+
+  function start(attempts) {
+    // The plots are embedded on document ready too; wait for their views
+    if ($.isEmptyObject(Bokeh.index)) {
+      if (attempts > 0) {
+        setTimeout(function() { start(attempts - 1); }, 50);
+      }
+      return;
+    }
+    find_items();
+    var scheduled = false;
+    $(window).add('main').on('scroll resize', function() {
+      // At most one check every 100 ms
+      if (!scheduled) {
+        scheduled = true;
+        setTimeout(function() { scheduled = false; check_visible(); }, 100);
+      }
+    });
+    check_visible();
+  }
+
+  $(function() { start(100); });
+})(Bokeh.$);
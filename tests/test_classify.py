@@ -0,0 +1,40 @@
+from itertools import combinations
+
+import numpy as np
+
+from cgetools.classify import classify, jenks
+
+
+def squared_deviation(values, classes):
+    return sum(((values[classes == c] - values[classes == c].mean()) ** 2).sum()
+               for c in np.unique(classes))
+
+
+def brute_force_jenks(values, n_classes):
+    "Least squared deviation over every way to split the sorted values."
+    unique = np.unique(values)
+    best = np.inf
+    for splits in combinations(range(1, len(unique)), n_classes - 1):
+        edges = np.concatenate([[unique[0]], unique[np.array(splits, dtype=int) - 1], [unique[-1]]])
+        best = min(best, squared_deviation(values, classify(values, edges)))
+    return best
+
+
+def test_jenks_matches_brute_force():
+    random = np.random.RandomState(0)
+    for size in (8, 12, 15):
+        for n_classes in (2, 3, 5):
+            # Rounded, so that some values repeat
+            values = np.round(random.lognormal(size=size), 1)
+            breaks = jenks(values, n_classes)
+            assert len(breaks) == n_classes + 1
+            assert breaks[0] == values.min() and breaks[-1] == values.max()
+            np.testing.assert_allclose(squared_deviation(values, classify(values, breaks)),
+                                       brute_force_jenks(values, n_classes))
+
+
+def test_jenks_ignores_missing_values():
+    values = np.array([1, 2, np.nan, 10, 11, 12, np.nan, 30])
+    breaks = jenks(values, 3)
+    np.testing.assert_array_equal(breaks, [1, 2, 12, 30])
+    np.testing.assert_array_equal(classify(values, breaks), [0, 0, -1, 1, 1, 1, -1, 2])
@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'crem_presentation', 'site'))
+import deploy  # noqa: E402
+
+FILES = {
+    'index.html': 'home',
+    'pages/about.html': 'about',
+    'theme/css/main.css': 'body {}',
+    'theme/js/app.js': 'var a;',
+}
+
+
+def write(root, files):
+    for path, text in files.items():
+        filename = os.path.join(root, *path.split('/'))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(text)
+
+
+def published(root):
+    "{path: text} of the files under root, but the manifest."
+    files = {}
+    for path in deploy.walk(root):
+        with open(os.path.join(root, *path.split('/'))) as f:
+            files[path] = f.read()
+    return files
+
+
+def manifest(root):
+    with open(os.path.join(root, deploy.MANIFEST)) as f:
+        return json.load(f)['files']
+
+
+@pytest.fixture
+def dirs(tmpdir):
+    output, target = str(tmpdir.join('output')), str(tmpdir.join('target'))
+    write(output, FILES)
+    return output, target
+
+
+class FailingTarget(deploy.LocalTarget):
+    "Fails on the upload of a given batch."
+
+    def __init__(self, path, fail_at):
+        deploy.LocalTarget.__init__(self, path)
+        self.batches = 0
+        self.fail_at = fail_at
+
+    def upload(self, root, paths):
+        self.batches += 1
+        if self.batches == self.fail_at:
+            raise IOError('connection lost')
+        deploy.LocalTarget.upload(self, root, paths)
+
+
+def test_incremental_deploy_sends_changed_files(dirs):
+    output, target = dirs
+    plan = deploy.deploy(output, deploy.LocalTarget(target))
+    assert plan.assets == ['theme/css/main.css', 'theme/js/app.js']
+    assert plan.pages == ['index.html', 'pages/about.html']
+    assert published(target) == FILES
+
+    write(output, {'theme/js/app.js': 'var b;'})
+    plan = deploy.deploy(output, deploy.LocalTarget(target))
+    assert (plan.assets, plan.pages, plan.removed) == (['theme/js/app.js'], [], [])
+    assert plan.unchanged == 3
+    assert published(target)['theme/js/app.js'] == 'var b;'
+    assert manifest(target) == deploy.hash_tree(output)
+
+
+def test_removed_files_are_deleted(dirs):
+    output, target = dirs
+    deploy.deploy(output, deploy.LocalTarget(target))
+    os.remove(os.path.join(output, 'theme', 'js', 'app.js'))
+    plan = deploy.deploy(output, deploy.LocalTarget(target))
+    assert (plan.assets, plan.pages, plan.removed) == ([], [], ['theme/js/app.js'])
+    assert 'theme/js/app.js' not in published(target)
+    # The directory left empty is pruned
+    assert not os.path.exists(os.path.join(target, 'theme', 'js'))
+    assert 'theme/js/app.js' not in manifest(target)
+
+
+def test_failed_deploy_resumes(dirs):
+    output, target = dirs
+    with pytest.raises(IOError):
+        deploy.deploy(output, FailingTarget(target, fail_at=3), batch_size=1)
+    # The two assets went first, and the manifest records them
+    assert sorted(manifest(target)) == ['theme/css/main.css', 'theme/js/app.js']
+    assert 'index.html' not in published(target)
+
+    plan = deploy.deploy(output, deploy.LocalTarget(target), batch_size=1)
+    assert (plan.assets, plan.pages) == ([], ['index.html', 'pages/about.html'])
+    assert published(target) == FILES
+    assert manifest(target) == deploy.hash_tree(output)
+
+
+def test_full_deploy_sends_every_file_and_deletes_removed(dirs):
+    output, target = dirs
+    deploy.deploy(output, deploy.LocalTarget(target))
+    # Changed on the server by other means, unknown to the manifest
+    write(target, {'index.html': 'edited'})
+    os.remove(os.path.join(output, 'pages', 'about.html'))
+
+    plan = deploy.deploy(output, deploy.LocalTarget(target), full=True)
+    assert plan.assets == ['theme/css/main.css', 'theme/js/app.js']
+    assert plan.pages == ['index.html']
+    assert plan.removed == ['pages/about.html']
+    expected = dict(FILES)
+    del expected['pages/about.html']
+    assert published(target) == expected
+    assert manifest(target) == deploy.hash_tree(output)
@@ -0,0 +1,44 @@
+import numpy as np
+
+from cgetools.ensemble import QuantileSketch
+
+
+def sketch_of(values, k, seed=0):
+    sketch = QuantileSketch(values.shape[1:], k=k, seed=seed)
+    for run in values:
+        sketch.add(run)
+    return sketch
+
+
+def test_quantiles_exact_for_small_ensembles():
+    values = np.random.RandomState(0).normal(size=(50, 3, 4))
+    sketch = sketch_of(values, k=64)
+    bottom, top = sketch.quantiles([0, 1])
+    np.testing.assert_array_equal(bottom, values.min(axis=0))
+    np.testing.assert_array_equal(top, values.max(axis=0))
+    np.testing.assert_allclose(sketch.mean(), values.mean(axis=0))
+
+
+def test_quantiles_ignore_missing_values():
+    random = np.random.RandomState(1)
+    values = random.uniform(size=(50, 20))
+    values[random.uniform(size=values.shape) < 0.3] = np.nan
+    values[:, -1] = np.nan
+    bottom, median, top = sketch_of(values, k=64).quantiles([0, 0.5, 1])
+    np.testing.assert_array_equal(bottom[:-1], np.nanmin(values[:, :-1], axis=0))
+    np.testing.assert_array_equal(top[:-1], np.nanmax(values[:, :-1], axis=0))
+    # A cell without any value
+    assert np.isnan(bottom[-1]) and np.isnan(median[-1]) and np.isnan(top[-1])
+
+
+def test_quantiles_of_compacted_sketch_with_missing_values():
+    random = np.random.RandomState(2)
+    values = random.uniform(size=(2000, 200))
+    # Missing values in every other cell
+    values[random.uniform(size=values.shape) < 0.2 * (np.arange(200) % 2)] = np.nan
+    sketch = sketch_of(values, k=32)
+    median, top = sketch.quantiles([0.5, 1])
+    assert np.all(np.isfinite(top))
+    assert np.all(top <= np.nanmax(values, axis=0))
+    assert np.all(np.abs(median - 0.5) < 0.05)
+    np.testing.assert_array_equal(sketch.missing, np.isnan(values).sum(axis=0))
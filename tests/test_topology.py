@@ -0,0 +1,56 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from cgetools.topology import build_topology, decode_topology
+
+nan = float('nan')
+
+# Two squares side by side, sharing the border x = 1, and the second with an
+# island; counterclockwise, closed, the polygons separated by NaN
+OUTLINES = OrderedDict([
+    ('A', ([0, 1, 1, 0, 0], [0, 0, 1, 1, 0])),
+    ('B', ([1, 2, 2, 1, 1, nan, 3, 4, 4, 3],
+           [0, 0, 1, 1, 0, nan, 0, 0, 1, 0])),
+])
+
+
+def rings(xs, ys):
+    "The rings of an outline, each without its closing point and starting from its least point."
+    result = []
+    points = []
+    for x, y in list(zip(xs, ys)) + [(nan, nan)]:
+        if np.isnan(x):
+            if points[-1] == points[0]:
+                points.pop()
+            start = points.index(min(points))
+            result.append(points[start:] + points[:start])
+            points = []
+        else:
+            points.append((round(x, 6), round(y, 6)))
+    return result
+
+
+def test_round_trip():
+    # Off the grid by less than half a step, so that the points snap back
+    random = np.random.RandomState(0)
+    noisy = OrderedDict(
+        (name, (np.array(xs) + random.uniform(-0.004, 0.004, len(xs)),
+                np.array(ys) + random.uniform(-0.004, 0.004, len(ys))))
+        for name, (xs, ys) in OUTLINES.items())
+    decoded = decode_topology(build_topology(noisy, decimals=2))
+    assert list(decoded) == ['A', 'B']
+    for name, (xs, ys) in OUTLINES.items():
+        assert rings(*decoded[name]) == rings(xs, ys)
+
+
+def test_shared_border_stored_once():
+    topology = build_topology(OUTLINES, decimals=0)
+    # The border, the rest of each square, and the island
+    assert len(topology['arcs']) == 4
+    a, = topology['objects']['A']
+    b, island = topology['objects']['B']
+    shared = set(a) & set(~ref for ref in b)
+    assert len(shared) == 1
+    # The island is no one else's: a single closed arc
+    assert len(island) == 1 and island[0] >= 0